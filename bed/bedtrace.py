@@ -8,8 +8,18 @@ Simple bedtools / bash scripts wrapper with the following operations:
                   second one
 * compare         compares 2 files producing _cond1.bed, _cond2.bed and
                   _common.bed files
+* consensus       regions covered by given count or percent of files
 * metapeaks       compares multiple files and creates Venn diagram in case of
-                  2 or 3 files
+                  2 or 3 files, see overlap_patterns() for N files
+
+Union, intersection, minus and consensus are computed by one of the backends:
+* bash            bedtools based union.sh, intersect.sh and minus.sh scripts
+* native          in-process numpy interval engine, see native.py
+Backend is configured via WASHU_BEDTRACE_BACKEND environment variable or
+set_backend(), both produce the same BED output.
+
+Results of union, intersection and minus can be stored in persistent cache
+shared between processes, see cache.py and set_cache().
 
 NOTE: it is not supposed to replace pybedtools, but add some missing
 functionality.
@@ -17,19 +27,45 @@ functionality.
 Major differences are:
  * union and intersection operations are commutative and associative
 
+Several expressions can be computed together with compute_all(), which uses
+query planner, see optimize() and explain(), explain_analyze() also reports
+time, cache hits and intervals of each operation. Independent operations can be
+computed concurrently, see compute_parallel(), and each operation can be
+split into per-chromosome shards processed in parallel, see set_sharded().
+
+Bed contents can be streamed as parsed intervals or chunks of numpy arrays
+with optional chromosome or region filters, see Bed.intervals() and
+Bed.chunks(), or stored in compact binary format, see Bed.to_binary().
+Bed of binary folder is decoded on demand, so it can be used as operand.
+Summary statistics are computed once per file, see Bed.stats(), and region
+queries are answered by persistent interval index, see Bed.query().
+
+Peaks are annotated with closest genes using cached gene index, see
+closest_gene().
+
+All-pairs Jaccard similarity of many files is computed in-process with each
+file merged once, see jaccard_matrix().
+
 NOTE: python3 required
 
 author oleg.shpynov@jetbrains.com
 """
+import copy
+import functools
+import glob
 import os
+import shutil
 import subprocess
 import tempfile
 import atexit
 
-from matplotlib_venn import venn2
-from matplotlib_venn import venn3
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import nullcontext
+
 from pathlib import Path
 
+from bed import cache, shards, stats
+from bed.io import is_header, label
 from scripts.util import run
 
 UNION_SH = os.path.dirname(os.path.abspath(__file__)) + '/union.sh'
@@ -40,23 +76,273 @@ METAPEAKS_SH = os.path.dirname(os.path.abspath(__file__)) + '/metapeaks.sh'
 JACCARD_SH = os.path.dirname(os.path.abspath(__file__)) + '/jaccard.sh'
 CONSENSUS_SH = os.path.dirname(os.path.abspath(__file__)) + '/consensus.sh'
 
+SCRIPTS = {'union': UNION_SH, 'intersection': INTERSECT_SH, 'minus': MINUS_SH}
+COMPARE_CONDITIONS = ['cond1', 'cond2', 'common']
+
+BACKENDS = ['bash', 'native']
+BACKEND = os.environ.get('WASHU_BEDTRACE_BACKEND', 'bash')
+
+# Default workers limit for concurrent computation
+PARALLELISM = int(os.environ.get('WASHU_PARALLELISM', 8))
+
+# Per-chromosome sharded execution of each operation
+SHARDED = os.environ.get('WASHU_BEDTRACE_SHARDED', '').lower() in ['1', 'true', 'yes']
+
 TEMPFILES = []
 
+# Default number of intervals in chunk, see Bed.chunks()
+CHUNK_SIZE = 100000
+
+# Persistent results cache, disabled by default
+CACHE = cache.from_env()
+
+# Per-operation profiling, disabled by default, see set_profiler()
+PROFILER = None
+
+
+def set_backend(backend):
+    global BACKEND
+    if backend not in BACKENDS:
+        raise Exception("Unknown backend: {}".format(backend))
+    BACKEND = backend
+
+
+def set_cache(folder, max_size=cache.DEFAULT_SIZE, content_hash=False):
+    """Configures persistent results cache, None folder disables cache"""
+    global CACHE
+    CACHE = None if folder is None else \
+        cache.ResultCache(folder, max_size, content_hash)
+
+
+def set_profiler(profiler):
+    """Enables per-operation profiling, see profile.py, None disables it"""
+    global PROFILER
+    PROFILER = profiler
+
+
+def _cache_session(*roots):
+    """Pins cached results used to compute roots, see ResultCache.session()"""
+    if CACHE is None:
+        return nullcontext()
+    return CACHE.session(keep=lambda: [r.path for r in roots if r.path is not None])
+
+
+def _profile_start():
+    return PROFILER.start() if PROFILER is not None else None
+
+
+def _profile_stop(node, started, cache_hit=False):
+    if started is not None and PROFILER is not None:
+        PROFILER.stop(node, started, cache_hit)
+
+
+def set_sharded(sharded):
+    """Enables per-chromosome sharded execution, see shards.py"""
+    global SHARDED
+    SHARDED = sharded
+
+
+def _native():
+    # Lazy import: numpy is required by native backend only
+    from bed import native
+    return native
+
+
+def _index():
+    # Lazy import: numpy is required by interval index only
+    from bed import index
+    return index
+
+
+def _binary():
+    # Lazy import: numpy is required by binary format only
+    from bed import binary
+    return binary
+
+
+def _evaluate(backend, operation, files, outputs, sorted=False):
+    # Scripts skip sorting of already sorted inputs
+    flags = ['-s'] if sorted else []
+    if operation == 'compare' and backend == 'native':
+        with open(outputs[0], 'w') as cond1, open(outputs[1], 'w') as cond2, \
+                open(outputs[2], 'w') as common:
+            _native().compare_files(*files, [cond1, cond2, common])
+        return
+    if operation == 'compare':
+        with tempfile.TemporaryDirectory(prefix='bedtraces') as folder:
+            prefix = os.path.join(folder, 'compare')
+            run([["bash", COMPARE_SH, *flags, *files, prefix]])
+            for cond, output in zip(COMPARE_CONDITIONS, outputs):
+                shutil.move('{}_{}.bed'.format(prefix, cond), output)
+        return
+
+    with open(outputs[0], 'w') as out:
+        if backend == 'native':
+            native = _native()
+            if operation == 'union':
+                native.union_files(files, out)
+            elif operation == 'union_mask':
+                native.union_files(files, out, mask=True)
+            elif operation == 'intersection':
+                native.intersect_files(files, out)
+            else:
+                native.minus_files(*files, out)
+        elif operation == 'union_mask':
+            run([["bash", UNION_SH, "-m", *flags, *files]], stdout=out)
+        else:
+            run([["bash", SCRIPTS[operation], *flags, *files]], stdout=out)
+
+
+def _relabel(path, mapping):
+    """Replaces shard files with original ones in union labels"""
+    with open(path) as f:
+        lines = f.readlines()
+    with open(path, 'w') as out:
+        for line in lines:
+            chrom, start, end, labels = line.rstrip('\n').split('\t')
+            labels = [x.split('_', 1) for x in labels.split('|')]
+            out.write('{}\t{}\t{}\t{}\n'.format(chrom, start, end, '|'.join(
+                label(n, mapping[f]) for n, f in labels)))
+
+
+def run_operation(operation, files, outputs, sorted=False):
+    """
+    Computes operation over files using configured backend and execution mode.
+    Compare writes cond1, cond2 and common outputs, other operations single one.
+    :param sorted: all the files are sorted by chromosome and start, see
+        is_sorted()
+    """
+    if not SHARDED:
+        _evaluate(BACKEND, operation, files, outputs, sorted)
+        return
+
+    # Shards with chromosome missing in these files are empty
+    required = {'intersection': range(len(files)), 'minus': [0]}.get(operation)
+    # Shards of sorted file are sorted as well
+    mapping = shards.run(functools.partial(_evaluate, BACKEND, operation,
+                                           sorted=sorted),
+                         files, outputs, PARALLELISM,
+                         processes=BACKEND == 'native', required=required)
+    if operation == 'union':
+        _relabel(outputs[0], mapping)
+
+
+def _compute_file(operation, files, sorted=False):
+    """Computes operation over files into new temp file"""
+    with tempfile.NamedTemporaryFile(
+            mode='w', suffix='.bed', prefix='bedtraces', delete=False
+    ) as tmpfile:
+        TEMPFILES.append(tmpfile.name)
+    run_operation(operation, files, [tmpfile.name], sorted)
+    return tmpfile.name
+
+
+def is_sorted(path):
+    """
+    Checks that BED file is sorted like `sort -k1,1 -k2,2n` with LC_ALL=C,
+    i.e. can be processed by bedtools without sorting.
+    """
+    chrom, start = None, None
+    with open(path) as f:
+        for line in f:
+            if is_header(line):
+                continue
+            c, s = line.split(None, 2)[:2]
+            s = int(s)
+            if c == chrom:
+                if s < start:
+                    return False
+            elif chrom is not None and c < chrom:
+                return False
+            chrom, start = c, s
+    return True
+
 
 def columns(path):
-    stdout, _stderr = run([
-        ['grep', 'chr', path], ['head', '-1'], ['awk', '{ print NF }']
-    ])
-    return int(stdout.decode('utf-8').strip())
+    return stats.get(path)['columns']
+
+
+def parse_region(region):
+    """
+    Parses region like 'chr1:100-200', 'chr1' or (chrom, start, end) tuple.
+    :return: (chrom, start, end), start and end are None for whole chromosome
+    """
+    if not isinstance(region, str):
+        chrom, start, end = region
+        return chrom, start, end
+    if ':' not in region:
+        return region, None, None
+    chrom, span = region.rsplit(':', 1)
+    try:
+        start, end = [int(x.replace(',', '')) for x in span.split('-')]
+    except ValueError:
+        raise Exception("Illegal region: {}".format(region))
+    return chrom, start, end
+
+
+def read_intervals(path, chroms=None, region=None, sorted=False):
+    """
+    Streams intervals from BED file, headers and empty lines are skipped.
+    :param chroms: chromosome name or collection of names to keep
+    :param region: keep intervals overlapping region, see parse_region()
+    :param sorted: file is sorted, reading stops after region
+    :return: generator of (chrom, start, end, [extra columns])
+    """
+    if isinstance(chroms, str):
+        chroms = {chroms}
+    elif chroms is not None:
+        chroms = set(chroms)
+    rchrom = rstart = rend = None
+    if region is not None:
+        rchrom, rstart, rend = parse_region(region)
+    seen = False
+    with open(path) as f:
+        for line in f:
+            if is_header(line):
+                continue
+            parts = line.rstrip('\n').split('\t')
+            chrom = parts[0]
+            if rchrom is not None and chrom != rchrom:
+                if seen and sorted:
+                    return
+                continue
+            if chroms is not None and chrom not in chroms:
+                continue
+            start, end = int(parts[1]), int(parts[2])
+            if rstart is not None:
+                seen = True
+                if start >= rend:
+                    if sorted:
+                        return
+                    continue
+                if end <= rstart:
+                    continue
+            seen = True
+            yield chrom, start, end, parts[3:]
 
 
 class Bed:
-    """Simple path of Bed file storage"""
+    """Simple path of Bed file storage or binary BED folder, see to_binary()"""
 
-    def __init__(self, path):
+    def __init__(self, path, sorted=None):
         self.path = path
+        # Binary folder is decoded into temp file on demand, see compute()
+        self.binary = None
+        if path is not None and os.path.isdir(path):
+            self.path, self.binary = None, path
+        # Unknown until checked, see is_sorted()
+        self.sorted = sorted
+        # (size, mtime) of indexed file and IntervalIndex, see query()
+        self.interval_index = None
 
     def compute(self):
+        if self.binary is not None and self.path is None:
+            with tempfile.NamedTemporaryFile(
+                    mode='w', suffix='.bed', prefix='bedtraces', delete=False
+            ) as tmpfile:
+                TEMPFILES.append(tmpfile.name)
+            open_binary(self.binary).export(tmpfile.name)
+            self.path = tmpfile.name
         if not Path(self.path).is_file():
             raise Exception("File not found: {}".format(self.path))
 
@@ -64,12 +350,15 @@ class Bed:
         return self.pp(0)
 
     def pp(self, indent):
-        return '\t' * indent + os.path.basename(self.path)
+        return '\t' * indent + os.path.basename(self.binary or self.path)
 
     def count(self):
+        return self.stats()['lines']
+
+    def stats(self):
+        """Single pass summary, stored in sidecar file, see stats.py"""
         self.compute()
-        stdout, _stderr = run([["cat", self.path], ['wc', '-l']])
-        return int(stdout.strip())
+        return stats.get(self.path)
 
     def save(self, path):
         self.compute()
@@ -85,32 +374,172 @@ class Bed:
     def collect_beds(self):
         return [self]
 
+    def outputs(self):
+        """:return: result BED files"""
+        self.compute()
+        return [self.path]
+
+    def is_sorted(self):
+        """Sortedness is checked once and remembered"""
+        if self.sorted is None:
+            self.compute()
+            self.sorted = is_sorted(self.path)
+        return self.sorted
+
+    def key(self):
+        """Persistent identity of the result, used as cache key"""
+        content_hash = CACHE is not None and CACHE.content_hash
+        if self.binary is not None:
+            # Decoded file is new each time, binary arrays identify the content
+            return cache.digest(*[cache.fingerprint(f, content_hash) for f in
+                                  sorted(glob.glob(os.path.join(glob.escape(self.binary), '*')))])
+        self.compute()
+        return cache.fingerprint(self.path, content_hash)
+
     def cat(self):
+        self.compute()
         stdout, _stderr = run([['cat', self.path]])
         return stdout.decode('utf-8')
 
+    def intervals(self, chroms=None, region=None):
+        """
+        Streams parsed intervals with constant memory, see read_intervals()
+        :return: generator of (chrom, start, end, [extra columns])
+        """
+        self.compute()
+        return read_intervals(self.path, chroms, region,
+                              sorted=self.sorted is True)
+
+    def chunks(self, size=CHUNK_SIZE, chroms=None, region=None):
+        """
+        Streams intervals as chunks of numpy arrays, see native.chunks()
+        :param size: max intervals in chunk
+        """
+        return _native().chunks(self.intervals(chroms, region), size)
+
+    def _interval_index(self):
+        self.compute()
+        stat = os.stat(self.path)
+        version = (stat.st_size, stat.st_mtime_ns)
+        if self.interval_index is None or self.interval_index[0] != version:
+            self.interval_index = (version, _index().get(self.path))
+        return self.interval_index[1]
+
+    def _read_lines(self, offsets):
+        result = []
+        with open(self.path, 'rb') as f:
+            for offset in offsets.tolist():
+                f.seek(offset)
+                parts = f.readline().decode('utf-8').rstrip('\n').split('\t')
+                result.append((parts[0], int(parts[1]), int(parts[2]),
+                               parts[3:]))
+        return result
+
+    def query(self, chrom, start=None, end=None):
+        """
+        Intervals overlapping [start, end) using persistent index, see
+        index.py for complexity
+        :param start: None stands for chromosome start
+        :param end: None stands for chromosome end
+        :return: list of (chrom, start, end, [extra columns]) sorted by start
+        """
+        return self._read_lines(
+            self._interval_index().query(chrom, start, end))
+
+    def query_many(self, regions):
+        """
+        Vectorized query() for many regions.
+        :param regions: list of regions, see parse_region()
+        :return: list of query() results, one per region
+        """
+        return [self._read_lines(offsets) for offsets in
+                self._interval_index().query_many(
+                    [parse_region(r) for r in regions])]
+
+    def to_binary(self, folder):
+        """
+        Stores as memory mapped columnar format, see binary.py
+        :return: BinaryBed
+        """
+        self.compute()
+        return _binary().write(self.path, folder)
+
     def head(self, lines=5):
+        self.compute()
         print('HEAD')
         stdout, _stderr = run([['head', '-{}'.format(lines), self.path]])
         print(stdout.decode('utf-8'))
 
     def tail(self, lines=5):
+        self.compute()
         print('TAIL')
         stdout, _stderr = run([['tail', '-{}'.format(lines), self.path]])
         print(stdout.decode('utf-8'))
 
 
+def open_binary(folder):
+    """Opens binary BED with zero copies, see Bed.to_binary()"""
+    return _binary().BinaryBed(folder)
+
+
+def from_binary(folder, path):
+    """Exports binary BED to original text BED file"""
+    open_binary(folder).export(path)
+    return Bed(path)
+
+
 class Operation(Bed):
     """Represents operations over Bed files and other Operations"""
 
     def __init__(self, operation=None, operands=None):
-        super().__init__(None)
+        # All the operations produce results sorted with LC_ALL=C, see is_sorted()
+        super().__init__(None, sorted=True)
         self.operation = operation
         self.operands = operands
 
     def compute(self):
+        # Do not compute twice
+        if self.path is not None:
+            return
+        with _cache_session(self):
+            self._compute()
+
+    def _compute(self):
+        key = None
+        if CACHE is not None:
+            started = _profile_start()
+            key = self.key()
+            self.path = CACHE.get(key)
+            if self.path is not None:
+                _profile_stop(self, started, cache_hit=True)
+                return
+
+        # Compute all the operands recursively
+        for o in self.operands:
+            o.compute()
+        started = _profile_start()
+        self.path = self.evaluate()
+
+        if key is not None:
+            TEMPFILES.remove(self.path)
+            self.path = CACHE.put(key, self.path)
+        _profile_stop(self, started)
+
+    def evaluate(self):
+        """Computes result file given all the operands are computed"""
         raise Exception("Unknown operation: {}".format(self.operation))
 
+    def operands_sorted(self):
+        return all(o.is_sorted() for o in self.operands)
+
+    def params(self):
+        """Operation parameters, which affect result besides operands"""
+        return ()
+
+    def key(self):
+        return cache.digest(self.operation, *[str(p) for p in self.params()],
+                            *[o.key() for o in self.operands])
+
     def __str__(self):
         return self.pp(0)
 
@@ -129,27 +558,16 @@ class Intersection(Operation):
     def __init__(self, operands):
         super().__init__("intersection", operands)
 
-    def compute(self):
-        # Do not compute twice
-        if self.path is not None:
-            return
-
-        # Compute all the operands recursively
-        for o in self.operands:
-            o.compute()
+    def evaluate(self):
         if len(self.operands) == 0:
             raise Exception("Illegal {}: {}".format(self.operation,
                                                     str(self.operands)))
-        self.path = self.intersect_files(*[x.path for x in self.operands])
+        return self.intersect_files(*[x.path for x in self.operands],
+                                    sorted=self.operands_sorted())
 
     @staticmethod
-    def intersect_files(*files):
-        with tempfile.NamedTemporaryFile(
-                mode='w', suffix='.bed', prefix='bedtraces', delete=False
-        ) as tmpfile:
-            run([["bash", INTERSECT_SH, *files]], stdout=tmpfile)
-            TEMPFILES.append(tmpfile.name)
-            return tmpfile.name
+    def intersect_files(*files, sorted=False):
+        return _compute_file('intersection', files, sorted)
 
 
 def intersect(*operands):
@@ -160,27 +578,15 @@ class Minus(Operation):
     def __init__(self, operands):
         super().__init__("minus", operands)
 
-    def compute(self):
-        # Do not compute twice
-        if self.path is not None:
-            return
-
-        # Compute all the operands recursively
-        for o in self.operands:
-            o.compute()
+    def evaluate(self):
         if len(self.operands) != 2:
             raise Exception("Illegal minus: {}".format(str(self.operands)))
-        self.path = self.minus_files(self.operands[0].path,
-                                     self.operands[1].path)
+        return self.minus_files(self.operands[0].path, self.operands[1].path,
+                                sorted=self.operands_sorted())
 
     @staticmethod
-    def minus_files(file1, file2):
-        with tempfile.NamedTemporaryFile(
-                mode='w', suffix='.bed', prefix='bedtraces', delete=False
-        ) as tmpfile:
-            run([["bash", MINUS_SH, file1, file2]], stdout=tmpfile)
-            TEMPFILES.append(tmpfile.name)
-            return tmpfile.name
+    def minus_files(file1, file2, sorted=False):
+        return _compute_file('minus', [file1, file2], sorted)
 
     def collect_beds(self):
         return self.operands[0].collect_beds()
@@ -191,37 +597,73 @@ def minus(*operands):
 
 
 class Union(Operation):
-    def __init__(self, operands):
+    """
+    Merged peaks of all the operands, 4th column lists parent tracks labels
+    or their membership bitmask, where i-th bit stands for i-th operand
+    """
+
+    def __init__(self, operands, mask=False):
         super().__init__("union", operands)
+        self.mask = mask
 
-    def compute(self):
-        # Do not compute twice
-        if self.path is not None:
-            return
+    def params(self):
+        return ('mask',) if self.mask else ()
 
-        # Compute all the operands recursively
-        for o in self.operands:
-            o.compute()
+    def evaluate(self):
         if len(self.operands) == 0:
             raise Exception("Illegal {}: {}".format(self.operation,
                                                     str(self.operands)))
-        self.path = self.union_files(*[x.path for x in self.operands])
+        files = [x.path for x in self.operands]
+        if self.mask:
+            return self.union_files(*files, sorted=self.operands_sorted(),
+                                    mask=True)
+        return self.union_files(*files, sorted=self.operands_sorted())
 
     @staticmethod
-    def union_files(*files):
+    def union_files(*files, sorted=False, mask=False):
+        return _compute_file('union_mask' if mask else 'union', files, sorted)
+
+    def members(self):
+        """:return: operands files table, i-th bit of mask stands for"""
+        self.compute()
+        return [o.path for o in self.operands]
+
+    def select(self, present=(), absent=()):
+        """
+        Regions of masked union by membership without labels parsing, e.g.
+        present in 3rd and 7th operands, but not in 9th one.
+        :param present: operands indices, which should contain region
+        :param absent: operands indices, which should not contain region
+        :return: Bed with selected regions
+        """
+        if not self.mask:
+            raise Exception("Membership mask expected: {}".format(self))
+        required = sum(1 << i for i in present)
+        forbidden = sum(1 << i for i in absent)
+        self.compute()
         with tempfile.NamedTemporaryFile(
                 mode='w', suffix='.bed', prefix='bedtraces', delete=False
         ) as tmpfile:
-            run([["bash", UNION_SH, *files]], stdout=tmpfile)
             TEMPFILES.append(tmpfile.name)
-            return tmpfile.name
+            for chrom, start, end, rest in read_intervals(self.path):
+                m = int(rest[0])
+                if m & required == required and m & forbidden == 0:
+                    tmpfile.write('{}\t{}\t{}\t{}\n'.format(
+                        chrom, start, end, m))
+        return Bed(tmpfile.name, sorted=True)
 
 
-def union(*operands):
-    return Union(operands)
+def union(*operands, mask=False):
+    """:param mask: track membership as bitmask, see Union.select()"""
+    return Union(operands, mask)
 
 
 class Compare(Operation):
+    """
+    Computes exclusive regions of both operands and common ones in a single
+    pass, results are available as cond1, cond2 and common Bed objects.
+    """
+
     def __init__(self, operands):
         super().__init__("compare", operands)
         self.cond1 = self.cond2 = self.common = None
@@ -233,22 +675,29 @@ class Compare(Operation):
 
         if len(self.operands) != 2:
             raise Exception("Illegal compare: {}".format(str(self.operands)))
-        self.path = self.compare(self.operands[0].path, self.operands[1].path)
+        for o in self.operands:
+            o.compute()
+        started = _profile_start()
+        self.path = self.compare(self.operands[0].path, self.operands[1].path,
+                                 sorted=self.operands_sorted())
+        _profile_stop(self, started)
 
-    def compare(self, file1, file2):
+    def outputs(self):
+        self.compute()
+        return [self.cond1.path, self.cond2.path, self.common.path]
+
+    def compare(self, file1, file2, sorted=False):
         with tempfile.NamedTemporaryFile(
                 mode='w', suffix='.txt', prefix='bedtraces', delete=False
         ) as tmpfile:
             prefix = tmpfile.name.replace('.txt', '')
-            run([["bash", COMPARE_SH, file1, file2, prefix]], stdout=tmpfile)
-            self.cond1 = prefix + "_cond1.bed"
-            self.cond2 = prefix + "_cond2.bed"
-            self.common = prefix + "_common.bed"
-            files = [self.cond1, self.cond2, self.common]
-            Path(tmpfile.name).write_text('\n'.join(files))
+            files = ['{}_{}.bed'.format(prefix, c) for c in COMPARE_CONDITIONS]
             TEMPFILES.append(tmpfile.name)
-            for f in files:
-                TEMPFILES.append(f)
+            TEMPFILES.extend(files)
+            run_operation('compare', [file1, file2], files, sorted)
+            Path(tmpfile.name).write_text('\n'.join(files))
+            self.cond1, self.cond2, self.common = \
+                [Bed(f, sorted=True) for f in files]
             return tmpfile.name
 
 
@@ -256,74 +705,344 @@ def compare(*operands):
     return Compare(operands)
 
 
+def _is_computed(node):
+    return not isinstance(node, Operation) or node.path is not None
+
+
+def _operations(*roots):
+    """:return: distinct not computed operations, operands go first"""
+    result = []
+    visited = set()
+
+    def visit(node):
+        if _is_computed(node) or id(node) in visited:
+            return
+        visited.add(id(node))
+        for o in node.operands:
+            visit(o)
+        result.append(node)
+
+    for r in roots:
+        visit(r)
+    return result
+
+
+def optimize(*roots):
+    """
+    Query planner, returns equivalent expressions, where:
+    * intersection operands are deduplicated and ordered
+    * equal subexpressions are shared across all the roots,
+      so that each of them is computed only once
+    Original expressions are left untouched.
+
+    NOTE: nested operations are never flattened. Intersection keeps merged
+    clusters touching every operand, so it is not associative, and union
+    labels refer to its direct operands.
+    """
+    plan = {}
+    signatures = {}
+
+    def visit(node):
+        if _is_computed(node):
+            signature = ('bed', node.binary or node.path)
+        else:
+            operands = [visit(x) for x in node.operands]
+            if isinstance(node, Intersection):
+                unique = {signatures[id(o)]: o for o in operands}
+                operands = [unique[x] for x in sorted(unique, key=repr)]
+            signature = (node.operation,) + node.params() + \
+                tuple(signatures[id(o)] for o in operands)
+            if signature not in plan:
+                node = copy.copy(node)
+                node.operands = operands
+        node = plan.setdefault(signature, node)
+        signatures[id(node)] = signature
+        return node
+
+    return [visit(r) for r in roots]
+
+
+def explain(*roots):
+    """Explain-style dump of the optimized plan for given expressions"""
+    plan = optimize(*roots)
+    ids = {}
+    lines = []
+
+    def pp(node, indent):
+        if _is_computed(node):
+            lines.append('\t' * indent + os.path.basename(node.binary or node.path))
+        elif id(node) in ids:
+            lines.append('\t' * indent + '{} #{} (shared)'.format(
+                node.operation, ids[id(node)]))
+        else:
+            ids[id(node)] = len(ids) + 1
+            lines.append('\t' * indent + '{} #{}'.format(
+                node.operation, ids[id(node)]))
+            for o in node.operands:
+                pp(o, indent + 1)
+
+    for p in plan:
+        pp(p, 0)
+    before, after = _operations(*roots), _operations(*plan)
+    lines.append('Operations: {} -> {}'.format(len(before), len(after)))
+    lines.append('Operands read: {} -> {}'.format(
+        sum(len(o.operands) for o in before),
+        sum(len(o.operands) for o in after)))
+    return '\n'.join(lines)
+
+
+def _resolve_cached(*roots):
+    """Picks up cached results top-down, so that cached subtrees are skipped"""
+    def visit(node):
+        if _is_computed(node):
+            return
+        started = _profile_start()
+        node.path = CACHE.get(node.key())
+        if node.path is not None:
+            _profile_stop(node, started, cache_hit=True)
+        else:
+            for o in node.operands:
+                visit(o)
+
+    for r in roots:
+        visit(r)
+
+
+def compute_parallel(*roots, workers=None):
+    """
+    Computes expressions scheduling operations as soon as all their operands
+    are ready on a thread pool, each operation is computed only once.
+    :param workers: max concurrent operations, default WASHU_PARALLELISM
+    """
+    with _cache_session(*roots):
+        _compute_parallel(roots, workers)
+
+
+def _compute_parallel(roots, workers):
+    if CACHE is not None:
+        _resolve_cached(*roots)
+    operations = _operations(*roots)
+    waiting = {}
+    dependents = {id(o): [] for o in operations}
+    for o in operations:
+        operands = {id(x) for x in o.operands if id(x) in dependents}
+        waiting[id(o)] = len(operands)
+        for x in operands:
+            dependents[x].append(o)
+
+    with ThreadPoolExecutor(max_workers=workers or PARALLELISM) as executor:
+        running = {executor.submit(o.compute): o
+                   for o in operations if waiting[id(o)] == 0}
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                # Fail fast on errors
+                future.result()
+                for o in dependents[id(running.pop(future))]:
+                    waiting[id(o)] -= 1
+                    if waiting[id(o)] == 0:
+                        running[executor.submit(o.compute)] = o
+
+
+def compute_all(*roots, workers=1):
+    """
+    Computes several expressions together using optimized plan
+    :param workers: max concurrent operations, see compute_parallel()
+    """
+    _compute_plan(roots, optimize(*roots), workers)
+
+
+def _compute_plan(roots, plan, workers):
+    with _cache_session(*plan):
+        if workers > 1:
+            compute_parallel(*plan, workers=workers)
+        for p in plan:
+            p.compute()
+    for r, p in zip(roots, plan):
+        # Copy results, but keep original expression
+        for k, v in vars(p).items():
+            if k != 'operands':
+                setattr(r, k, v)
+
+
+def explain_analyze(*roots, workers=1):
+    """
+    Computes expressions like compute_all() recording wall and CPU time,
+    cache hits and intervals of each operation, see profile.py
+    :return: Profiler, use report() for annotated plan
+    """
+    from bed.profile import Profiler
+    global PROFILER
+    previous, PROFILER = PROFILER, Profiler()
+    try:
+        plan = optimize(*roots)
+        PROFILER.roots = plan
+        _compute_plan(roots, plan, workers)
+        return PROFILER
+    finally:
+        PROFILER = previous
+
+
 def jaccard(file1, file2):
     stdout, _stderr = run([['bash', JACCARD_SH, file1, file2]])
     return float(stdout)
 
 
-def consensus(files_paths, count=0, percent=0):
-    if count != 0:
-        stdout, _stderr = run([['bash', CONSENSUS_SH, "-c", str(count), *files_paths]])
-    else:
-        stdout, _stderr = run([['bash', CONSENSUS_SH, "-p", str(percent), *files_paths]])
-    return stdout
-
+def closest_gene(bed, genes):
+    """
+    Annotates peaks with closest genes, same output as closest_gene.sh:
+    peak columns, gene name and distance, see genes.py
+    :param bed: Bed or path
+    :param genes: GTF or BED genes annotation, index is built once
+    :return: Bed
+    """
+    if isinstance(bed, Bed):
+        bed.compute()
+        bed = bed.path
+    # Lazy import: numpy is required by gene index only
+    from bed import genes as genes_index
+    with tempfile.NamedTemporaryFile(
+            mode='w', suffix='.bed', prefix='bedtraces', delete=False
+    ) as tmpfile:
+        TEMPFILES.append(tmpfile.name)
+        genes_index.closest_gene(bed, genes, tmpfile)
+    return Bed(tmpfile.name)
+
+
+def jaccard_matrix(beds, labels=None, workers=1):
+    """
+    All-pairs Jaccard indices, each file is merged only once.
+    :param beds: list of Bed or paths
+    :param labels: matrix rows and columns labels, default file names
+    :param workers: worker processes, see native.jaccard_matrix()
+    :return: pandas DataFrame
+    """
+    # Lazy import: pandas is required by matrix only
+    import pandas as pd
+    paths = []
+    for b in beds:
+        if isinstance(b, Bed):
+            b.compute()
+            b = b.path
+        paths.append(b)
+    if labels is None:
+        labels = [os.path.basename(p) for p in paths]
+    if len(labels) != len(paths):
+        raise Exception("Labels and files count differ: {} vs {}".format(
+            len(labels), len(paths)))
+    matrix = _native().jaccard_matrix(paths, workers=workers)
+    return pd.DataFrame(matrix, index=labels, columns=labels)
+
+
+class Consensus(Operation):
+    """
+    Regions covered by at least count operands or percent of them,
+    percent threshold is rounded down like in consensus.sh
+    """
+
+    def __init__(self, operands, count=0, percent=0):
+        super().__init__("consensus", operands)
+        if count < 0 or percent < 0 or (count > 0) == (percent > 0):
+            raise Exception("Illegal consensus, either count or percent "
+                            "expected: {} {}".format(count, percent))
+        self.min_count = count
+        self.percent = percent
+
+    def params(self):
+        return self.min_count, self.percent
+
+    def threshold(self):
+        if self.min_count > 0:
+            return self.min_count
+        # At least single operand
+        return max(1, len(self.operands) * self.percent // 100)
 
-def metapeaks(filesmap):
-    """Plot venn diagrams for 2 or 3 files"""
-    VENN2_PATTERNS = ["0 1", "1 0", "1 1"]
-    VENN3_PATTERNS = ["0 0 1", "0 1 0", "0 1 1", "1 0 0", "1 0 1", "1 1 0",
-                      "1 1 1"]
+    def pp(self, indent):
+        return '\t' * indent + '{} {}\n'.format(
+            self.operation, self.min_count if self.min_count > 0
+            else '{}%'.format(self.percent)) + \
+            '\n'.join([x.pp(indent + 1) for x in self.operands])
 
-    def showvenn2(s1, s2, aB, Ab, AB):
-        venn2(subsets=(Ab, aB, AB), set_labels=(s1, s2))
+    def evaluate(self):
+        if len(self.operands) == 0:
+            raise Exception("Illegal {}: {}".format(self.operation,
+                                                    str(self.operands)))
+        files = [x.path for x in self.operands]
+        with tempfile.NamedTemporaryFile(
+                mode='w', suffix='.bed', prefix='bedtraces', delete=False
+        ) as tmpfile:
+            TEMPFILES.append(tmpfile.name)
+            if BACKEND == 'native':
+                _native().consensus_files(files, self.threshold(), tmpfile)
+            else:
+                run([['bash', CONSENSUS_SH, '-c', str(self.threshold()),
+                      *files]], stdout=tmpfile)
+        return tmpfile.name
+
+
+def consensus(operands, count=0, percent=0):
+    """
+    :param operands: list of Bed, Operations or paths
+    :return: Consensus operation
+    """
+    return Consensus([x if isinstance(x, Bed) else Bed(x) for x in operands],
+                     count, percent)
+
+
+def overlap_patterns(beds):
+    """
+    Number of merged regions for each files membership pattern in one pass,
+    pattern is like '1 0 1' in metapeaks.sh output.
+    :param beds: list of Bed or paths
+    :return: sparse {pattern: count}, sorted by pattern
+    """
+    paths = []
+    for b in beds:
+        if isinstance(b, Bed):
+            b.compute()
+            b = b.path
+        paths.append(b)
+    counts = _native().patterns(paths)
+    result = {' '.join('1' if mask >> i & 1 else '0'
+                       for i in range(len(paths))): count
+              for mask, count in counts.items()}
+    return {p: result[p] for p in sorted(result)}
 
-    def showvenn3(s1, s2, s3, abC, aBc, aBC, Abc, AbC, ABc, ABC):
-        venn3(subsets=(Abc, aBc, ABc, abC, AbC, aBC, ABC),
-              set_labels=(s1, s2, s3))
 
+def metapeaks(filesmap):
+    """
+    Plot venn diagrams for 2 or 3 files, prints overlap patterns otherwise.
+    :return: {pattern: count}, see overlap_patterns()
+    """
     if not isinstance(filesmap, dict):
         raise Exception("Map <name: bed> is expected")
-    args = {}
-    venn_patterns = None
-    if len(filesmap) == 2:
-        venn_patterns = VENN2_PATTERNS
-    elif len(filesmap) == 3:
-        venn_patterns = VENN3_PATTERNS
+    names = list(filesmap.keys())
+    patterns = overlap_patterns([filesmap[x] for x in names])
+    if len(names) == 2:
+        # Lazy import: plotting is optional
+        from matplotlib_venn import venn2
+        Ab, aB, AB = [patterns.get(p, 0) for p in ["1 0", "0 1", "1 1"]]
+        venn2(subsets=(Ab, aB, AB), set_labels=names)
+    elif len(names) == 3:
+        from matplotlib_venn import venn3
+        venn3(subsets=[patterns.get(p, 0) for p in
+                       ["1 0 0", "0 1 0", "1 1 0", "0 0 1", "1 0 1", "0 1 1",
+                        "1 1 1"]],
+              set_labels=names)
     else:
         print("Cannot create Venn diagram, wrong number of files",
               len(filesmap))
-
-    names = filesmap.keys()
-    # Check everything is computed
-    for x in filesmap.values():
-        x.compute()
-    stdout, _stderr = run([['bash', METAPEAKS_SH,
-                            *[filesmap[x].path for x in names]]])
-    out = stdout.decode("utf-8")
-    if venn_patterns:
-        # Configure args for Venn diagram
-        for p in venn_patterns:
-            args[p] = 0
-        for line in out.split('\n'):
-            for p in venn_patterns:
-                if p in line:
-                    try:
-                        args[p] = int(line[len(p):])
-                    except:  # nopep8
-                        pass
-        if len(filesmap) == 2:
-            showvenn2(*names, *[args[x] for x in venn_patterns])
-        elif len(filesmap) == 3:
-            showvenn3(*names, *[args[x] for x in venn_patterns])
-    else:
-        print(out)
+        for p, count in patterns.items():
+            print('{}\t{}'.format(p, count))
+    return patterns
 
 
 def _cleanup():
     for path in TEMPFILES:
-        if Path(path).is_file():
-            os.remove(path)
+        # Result file and its statistics and index sidecars
+        for f in [path] + glob.glob(glob.escape(path) + '.*'):
+            if Path(f).is_file():
+                os.remove(f)
 
 
 atexit.register(_cleanup)
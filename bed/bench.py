@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of bedtrace operations on synthetic genome-scale data.
+
+Peaks are generated deterministically for given seed, so that results of
+different runs are comparable. Each operation is measured for each backend
+in a separate process, which reports wall time, throughput in input
+intervals per second and peak RSS including child processes, e.g. bedtools.
+
+Usage:
+    python -m bed.bench [--count 100000] [--files 3] [--backends bash,native]
+        [--operations union,intersect] [--output results.tsv]
+        [--baseline previous.tsv] [--tolerance 0.2]
+Results are printed as TSV, operations slower than baseline by more than
+tolerance are reported as regressions and fail the run.
+
+NOTE: numpy required
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+OPERATIONS = ['union', 'intersect', 'minus', 'compare', 'jaccard', 'consensus',
+              'metapeaks']
+# Operations over first files only
+BINARY = ['minus', 'compare']
+COLUMNS = ['operation', 'backend', 'files', 'intervals', 'seconds',
+           'intervals_per_second', 'peak_rss_mb']
+
+# Human-like genome layout: chromosome sizes decrease with index
+GENOME_SIZE = 3 * 10 ** 9
+CHROMOSOMES = 23
+
+
+def chromosomes(n=CHROMOSOMES, genome_size=GENOME_SIZE):
+    """:return: list of (name, size), sizes are proportional to 1 / sqrt(i)"""
+    weights = 1 / np.sqrt(np.arange(1, n + 1))
+    sizes = (genome_size * weights / weights.sum()).astype(np.int64)
+    return [('chr{}'.format(i + 1), int(s)) for i, s in enumerate(sizes)]
+
+
+def generate(folder, files=3, count=100000, width=1000, width_sigma=0.5,
+             overlap=0.5, layout=None, seed=0):
+    """
+    Generates sorted BED files with synthetic peaks.
+    :param count: peaks in each file
+    :param width: median peak width, widths are lognormal
+    :param width_sigma: lognormal sigma of widths
+    :param overlap: fraction of peaks at sites shared between files,
+        the rest are placed uniformly
+    :param layout: list of (chrom, size), default chromosomes()
+    :param seed: the same seed produces the same files
+    :return: list of paths
+    """
+    rng = np.random.RandomState(seed)
+    layout = layout or chromosomes()
+    sizes = np.array([s for _, s in layout], dtype=np.int64)
+    probabilities = sizes / sizes.sum()
+
+    shared = int(count * overlap)
+    sites_chroms = rng.choice(len(layout), size=shared, p=probabilities)
+    sites = (rng.random_sample(shared) * sizes[sites_chroms]).astype(np.int64)
+
+    paths = []
+    for i in range(files):
+        unique = count - shared
+        chroms = np.concatenate([
+            sites_chroms, rng.choice(len(layout), size=unique, p=probabilities)])
+        starts = np.concatenate([
+            # Jitter around shared sites
+            sites + rng.randint(-width // 2, width // 2 + 1, size=shared),
+            (rng.random_sample(unique) * sizes[chroms[shared:]]).astype(np.int64)])
+        widths = np.maximum(1, rng.lognormal(np.log(width), width_sigma,
+                                             size=count).astype(np.int64))
+        starts = np.clip(starts, 0, sizes[chroms] - 1)
+        ends = np.minimum(starts + widths, sizes[chroms])
+        names = np.array([name for name, _ in layout])
+        # Sorted like `sort -k1,1 -k2,2n`
+        order = np.lexsort((starts, names[chroms]))
+        path = os.path.join(folder, 'synthetic_{}.bed'.format(i + 1))
+        with open(path, 'w') as out:
+            for c, s, e in zip(names[chroms][order].tolist(), starts[order].tolist(),
+                               ends[order].tolist()):
+                out.write('{}\t{}\t{}\n'.format(c, s, e))
+        paths.append(path)
+    return paths
+
+
+def run_case(operation, backend, files):
+    """Computes operation in current process, :return: seconds"""
+    from bed import bedtrace as bt
+    bt.set_backend(backend)
+    bt.set_cache(None)
+    beds = [bt.Bed(f) for f in files]
+    start = time.perf_counter()
+    if operation == 'union':
+        bt.union(*beds).compute()
+    elif operation == 'intersect':
+        bt.intersect(*beds).compute()
+    elif operation == 'minus':
+        bt.minus(*beds).compute()
+    elif operation == 'compare':
+        bt.compare(*beds).compute()
+    elif operation == 'consensus':
+        bt.consensus(beds, count=2).compute()
+    elif operation == 'jaccard':
+        if backend == 'native':
+            bt.jaccard_matrix(files)
+        else:
+            for i in range(len(files)):
+                for j in range(i + 1, len(files)):
+                    bt.jaccard(files[i], files[j])
+    elif operation == 'metapeaks':
+        if backend == 'native':
+            bt.overlap_patterns(files)
+        else:
+            bt.run([['bash', bt.METAPEAKS_SH, *files]])
+    else:
+        raise Exception("Unknown operation: {}".format(operation))
+    seconds = time.perf_counter() - start
+    bt._cleanup()
+    return seconds
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+
+
+def measure(operation, backend, files, counts):
+    """
+    Runs operation in a separate process, so that peak RSS is not affected
+    by other cases.
+    :param counts: number of intervals in each file
+    :return: result row dict, see COLUMNS, or None if operation failed
+    """
+    if operation in BINARY:
+        files, counts = files[:2], counts[:2]
+    process = subprocess.run(
+        [sys.executable, '-m', 'bed.bench', '--case', operation, backend, *files],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    if process.returncode != 0:
+        print('FAILED {} {}\n{}'.format(operation, backend,
+                                        process.stderr.decode('utf-8')[-1000:]),
+              file=sys.stderr)
+        return None
+    case = json.loads(process.stdout.decode('utf-8').strip().split('\n')[-1])
+    intervals = sum(counts)
+    return {'operation': operation, 'backend': backend, 'files': len(files),
+            'intervals': intervals, 'seconds': round(case['seconds'], 3),
+            'intervals_per_second': int(intervals / max(case['seconds'], 1e-9)),
+            'peak_rss_mb': round(case['peak_rss_mb'], 1)}
+
+
+def read_results(path):
+    with open(path) as f:
+        header = f.readline().rstrip('\n').split('\t')
+        return [dict(zip(header, line.rstrip('\n').split('\t'))) for line in f]
+
+
+def regressions(results, baseline, tolerance):
+    """:return: list of messages for cases slower than baseline"""
+    previous = {(r['operation'], r['backend']): float(r['seconds']) for r in baseline}
+    messages = []
+    for r in results:
+        key = (r['operation'], r['backend'])
+        if key in previous and r['seconds'] > previous[key] * (1 + tolerance):
+            messages.append('{} {}: {}s vs {}s'.format(*key, r['seconds'], previous[key]))
+    return messages
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--case':
+        operation, backend, files = sys.argv[2], sys.argv[3], sys.argv[4:]
+        seconds = run_case(operation, backend, files)
+        print(json.dumps({'seconds': seconds, 'peak_rss_mb': _peak_rss_mb()}))
+        return
+
+    parser = argparse.ArgumentParser(description='Benchmark bedtrace operations')
+    parser.add_argument('--count', type=int, default=100000, help='peaks per file')
+    parser.add_argument('--files', type=int, default=3)
+    parser.add_argument('--width', type=int, default=1000, help='median peak width')
+    parser.add_argument('--width-sigma', type=float, default=0.5)
+    parser.add_argument('--overlap', type=float, default=0.5,
+                        help='fraction of peaks at shared sites')
+    parser.add_argument('--chromosomes', type=int, default=CHROMOSOMES)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backends', default='bash,native')
+    parser.add_argument('--operations', default=','.join(OPERATIONS))
+    parser.add_argument('--output', help='save results TSV')
+    parser.add_argument('--baseline', help='previous results TSV to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown vs baseline')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='bedtrace_bench') as folder:
+        files = generate(folder, args.files, args.count, args.width, args.width_sigma,
+                         args.overlap, chromosomes(args.chromosomes), args.seed)
+        counts = [args.count] * len(files)
+        results = []
+        failed = False
+        print('\t'.join(COLUMNS))
+        for operation in args.operations.split(','):
+            for backend in args.backends.split(','):
+                result = measure(operation, backend, files, counts)
+                if result is None:
+                    failed = True
+                    continue
+                results.append(result)
+                print('\t'.join(str(result[c]) for c in COLUMNS), flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as out:
+            out.write('\t'.join(COLUMNS) + '\n')
+            for r in results:
+                out.write('\t'.join(str(r[c]) for c in COLUMNS) + '\n')
+    if args.baseline:
+        messages = regressions(results, read_results(args.baseline), args.tolerance)
+        for m in messages:
+            print('REGRESSION', m)
+        failed = failed or len(messages) > 0
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
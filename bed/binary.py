@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+"""
+Compact columnar binary format of BED files, opened via numpy memmap.
+
+Format is a folder of .npy files:
+* meta.json       chromosome names, i.e. codes are indices in this list,
+                  present columns, headers and empty lines for export
+* offsets.npy     rows of chromosome with code c are offsets[c]:offsets[c+1]
+* starts.npy      start and end arrays, int32 if coordinates fit, else int64,
+* ends.npy        rows are grouped by chromosome
+* order.npy       original position of each row, absent if file is grouped
+                  by chromosomes in sorted order
+* name.*.npy      4th column utf-8 blob and offsets, if all rows have it
+* score.npy       5th column, if all values are numbers in canonical form
+* rest.*.npy      remaining fields of each row, if any row has them
+
+Export reproduces original BED file byte by byte, import fails if that is
+not possible, e.g. for coordinates like 0100.
+
+NOTE: numpy required
+"""
+import json
+import os
+
+import numpy as np
+
+from bed.io import is_header
+
+META = 'meta.json'
+VERSION = 1
+# Arrays written only if required, see write()
+OPTIONAL = ['order', 'name.blob', 'name.offsets', 'score', 'rest.blob', 'rest.offsets']
+
+
+def _blob(values):
+    """:return: (utf-8 blob, offsets) for list of strings"""
+    encoded = [v.encode('utf-8') for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def _score(values):
+    """:return: numpy array if values can be restored from it exactly"""
+    try:
+        if all(str(int(v)) == v for v in values):
+            return np.array([int(v) for v in values], dtype=np.int64)
+        if all(repr(float(v)) == v for v in values):
+            return np.array([float(v) for v in values], dtype=np.float64)
+    except ValueError:
+        pass
+    return None
+
+
+def _int(value, line):
+    result = int(value)
+    if str(result) != value:
+        raise Exception("Cannot store losslessly: {}".format(line))
+    return result
+
+
+def write(path, folder):
+    """Imports BED file into binary folder"""
+    chroms, starts, ends, fields = [], [], [], []
+    skipped = []
+    newline = True
+    with open(path) as f:
+        for i, line in enumerate(f):
+            newline = line.endswith('\n')
+            text = line[:-1] if newline else line
+            if is_header(text):
+                skipped.append([i, text])
+                continue
+            parts = text.split('\t')
+            if len(parts) < 3:
+                raise Exception("Illegal BED line: {}".format(line))
+            chroms.append(parts[0])
+            starts.append(_int(parts[1], line))
+            ends.append(_int(parts[2], line))
+            fields.append(parts[3:])
+
+    names = sorted(set(chroms))
+    codes = {c: i for i, c in enumerate(names)}
+    codes_array = np.array([codes[c] for c in chroms], dtype=np.int32)
+    order = np.argsort(codes_array, kind='mergesort')
+    counts = np.bincount(codes_array, minlength=len(names))
+    offsets = np.zeros(len(names) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    starts = np.array(starts, dtype=np.int64)
+    ends = np.array(ends, dtype=np.int64)
+    dtype = np.int64
+    if len(starts) == 0 or (starts.min() >= np.iinfo(np.int32).min and
+                            ends.max() <= np.iinfo(np.int32).max):
+        dtype = np.int32
+
+    os.makedirs(folder, exist_ok=True)
+    # Previous import into the same folder
+    for name in OPTIONAL:
+        if os.path.exists(os.path.join(folder, name + '.npy')):
+            os.remove(os.path.join(folder, name + '.npy'))
+
+    def save(name, array):
+        np.save(os.path.join(folder, name + '.npy'), array)
+
+    save('offsets', offsets)
+    save('starts', starts[order].astype(dtype))
+    save('ends', ends[order].astype(dtype))
+    if np.any(order != np.arange(len(order))):
+        save('order', order)
+    # Grouped order of extra fields
+    fields = [fields[i] for i in order.tolist()]
+
+    columns = []
+    width = min([len(x) for x in fields], default=0)
+    if width >= 1:
+        columns.append('name')
+        blob, blob_offsets = _blob([x[0] for x in fields])
+        save('name.blob', blob)
+        save('name.offsets', blob_offsets)
+    if width >= 2:
+        score = _score([x[1] for x in fields])
+        if score is not None:
+            columns.append('score')
+            save('score', score)
+    if any(len(x) > len(columns) for x in fields):
+        blob, blob_offsets = _blob(
+            [''.join('\t' + v for v in x[len(columns):]) for x in fields])
+        save('rest.blob', blob)
+        save('rest.offsets', blob_offsets)
+        columns.append('rest')
+
+    with open(os.path.join(folder, META), 'w') as f:
+        json.dump({'version': VERSION, 'chromosomes': names,
+                   'columns': columns, 'skipped': skipped,
+                   'newline': newline}, f)
+    return BinaryBed(folder)
+
+
+class BinaryBed:
+    """Memory mapped binary BED, arrays are not read until touched"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        with open(os.path.join(folder, META)) as f:
+            self.meta = json.load(f)
+        if self.meta['version'] != VERSION:
+            raise Exception("Unsupported binary BED version: {}".format(
+                self.meta['version']))
+        self.chromosomes = self.meta['chromosomes']
+        self.columns = self.meta['columns']
+        self.offsets = self._load('offsets')
+        self._starts = self._load('starts')
+        self._ends = self._load('ends')
+
+    def _load(self, name):
+        return np.load(os.path.join(self.folder, name + '.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self._starts)
+
+    def _slice(self, chrom):
+        if chrom is None:
+            return slice(0, len(self))
+        if chrom not in self.chromosomes:
+            return slice(0, 0)
+        code = self.chromosomes.index(chrom)
+        return slice(int(self.offsets[code]), int(self.offsets[code + 1]))
+
+    def codes(self):
+        """:return: chromosome code of each row"""
+        return np.repeat(np.arange(len(self.chromosomes), dtype=np.int32),
+                         np.diff(self.offsets))
+
+    def starts(self, chrom=None):
+        """:return: memmap view of chromosome or all rows starts"""
+        return self._starts[self._slice(chrom)]
+
+    def ends(self, chrom=None):
+        return self._ends[self._slice(chrom)]
+
+    def _strings(self, column, chrom):
+        blob = self._load(column + '.blob')
+        offsets = self._load(column + '.offsets')
+        s = self._slice(chrom)
+        return [bytes(blob[offsets[i]:offsets[i + 1]]).decode('utf-8')
+                for i in range(s.start, s.stop)]
+
+    def names(self, chrom=None):
+        """:return: list of 4th column values or None if not present"""
+        if 'name' not in self.columns:
+            return None
+        return self._strings('name', chrom)
+
+    def scores(self, chrom=None):
+        """:return: memmap view of 5th column or None if not present"""
+        if 'score' not in self.columns:
+            return None
+        return self._load('score')[self._slice(chrom)]
+
+    def export(self, path):
+        """Writes original BED file"""
+        n = len(self)
+        rows = np.arange(n)
+        if os.path.exists(os.path.join(self.folder, 'order.npy')):
+            rows = np.empty(n, dtype=np.int64)
+            rows[self._load('order')] = np.arange(n)
+        chroms = self.codes()
+        names = self.names()
+        scores = self.scores()
+        rest = self._strings('rest', None) if 'rest' in self.columns else None
+        skipped = {i: text for i, text in self.meta['skipped']}
+
+        total = n + len(skipped)
+        row = 0
+        with open(path, 'w') as out:
+            for i in range(total):
+                if i in skipped:
+                    line = skipped[i]
+                else:
+                    r = rows[row]
+                    row += 1
+                    line = '{}\t{}\t{}'.format(self.chromosomes[chroms[r]],
+                                               self._starts[r], self._ends[r])
+                    if names is not None:
+                        line += '\t' + names[r]
+                    if scores is not None:
+                        line += '\t' + repr(scores[r].item())
+                    if rest is not None:
+                        line += rest[r]
+                out.write(line)
+                if i < total - 1 or self.meta['newline']:
+                    out.write('\n')
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+"""
+Persistent on-disk cache of bedtrace operations results.
+
+Results are stored in a single folder under content-addressed names, i.e.
+key is computed from operation type and fingerprints of the operand files,
+see bedtrace Operation.key(). Cache can be shared between processes and
+lives within configured size budget, least recently used results are
+evicted first. Results used by in-progress computation are pinned and not
+evicted until the outermost session ends, see ResultCache.session().
+
+Configuration via environment variables:
+* WASHU_BEDTRACE_CACHE        cache folder, cache is disabled if not set
+* WASHU_BEDTRACE_CACHE_SIZE   size budget, e.g. 500M or 10G, default 10G
+* WASHU_BEDTRACE_CACHE_HASH   fingerprint files by `content` hash instead of
+                              default size and modification time
+"""
+import glob
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+DEFAULT_SIZE = '10G'
+SUFFIX = '.bed'
+UNITS = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+
+def parse_size(size):
+    """Parses size like 1024, 500M or 10G to bytes"""
+    size = str(size).strip().upper()
+    if size and size[-1] in UNITS:
+        return int(float(size[:-1]) * UNITS[size[-1]])
+    return int(size)
+
+
+# Content hashes of files {(path, size, mtime): hash}, files are hashed once
+# while not modified
+_HASHES = {}
+
+
+def fingerprint(path, content_hash=False):
+    """File identity: path with either size and mtime or content hash"""
+    stat = os.stat(path)
+    if content_hash:
+        identity = (path, stat.st_size, stat.st_mtime_ns)
+        if identity not in _HASHES:
+            sha = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    sha.update(chunk)
+            _HASHES[identity] = sha.hexdigest()
+        return '{}:{}'.format(path, _HASHES[identity])
+    return '{}:{}:{}'.format(path, stat.st_size, stat.st_mtime_ns)
+
+
+def digest(*parts):
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """Folder with results named by keys, LRU order is tracked by mtime"""
+
+    def __init__(self, folder, max_size=DEFAULT_SIZE, content_hash=False):
+        self.folder = folder
+        self.max_size = parse_size(max_size)
+        self.content_hash = content_hash
+        os.makedirs(folder, exist_ok=True)
+        # Results used within active sessions, protected from eviction
+        self._pinned = set()
+        self._sessions = 0
+        self._lock = threading.Lock()
+
+    def fingerprint(self, path):
+        return fingerprint(path, self.content_hash)
+
+    def _path(self, key):
+        return os.path.join(self.folder, key + SUFFIX)
+
+    @contextmanager
+    def session(self, keep=None):
+        """
+        Pins results got or put within session, so that operands are not evicted
+        before dependent operation is computed. Sessions can be nested, pinned
+        results are released and cache is evicted when outermost session ends.
+        :param keep: callable returning result paths to keep on release
+        """
+        with self._lock:
+            self._sessions += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._sessions -= 1
+                release = self._sessions == 0
+                if release:
+                    self._pinned.clear()
+            if release:
+                self.evict(keep=keep() if keep is not None else ())
+
+    def _pin(self, path):
+        with self._lock:
+            if self._sessions > 0:
+                self._pinned.add(path)
+
+    def get(self, key):
+        """:return: cached result path or None"""
+        path = self._path(key)
+        try:
+            # Mark as recently used
+            os.utime(path)
+            self._pin(path)
+            return path
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, path):
+        """
+        Moves result file to cache.
+        :return: cached result path
+        """
+        # Move via temp file within cache folder, so that concurrent
+        # processes never see partially written result
+        with tempfile.NamedTemporaryFile(dir=self.folder, prefix='.',
+                                         delete=False) as tmpfile:
+            pass
+        shutil.move(path, tmpfile.name)
+        result = self._path(key)
+        os.replace(tmpfile.name, result)
+        self._pin(result)
+        self.evict(keep=(result,))
+        return result
+
+    def entries(self):
+        """:return: list of (mtime, size, path) for cached results"""
+        result = []
+        for name in os.listdir(self.folder):
+            if not name.endswith(SUFFIX) or name.startswith('.'):
+                continue
+            path = os.path.join(self.folder, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # Evicted by another process
+                continue
+            result.append((stat.st_mtime, stat.st_size, path))
+        return result
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep=()):
+        """Removes least recently used not pinned results until cache fits budget"""
+        with self._lock:
+            pinned = self._pinned | set(keep)
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            if path in pinned:
+                continue
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path):
+        # Statistics and index sidecars are removed together with result
+        for f in [path] + glob.glob(glob.escape(path) + '.*'):
+            try:
+                os.remove(f)
+            except FileNotFoundError:
+                pass
+
+
+def from_env():
+    """:return: ResultCache configured via environment or None"""
+    folder = os.environ.get('WASHU_BEDTRACE_CACHE')
+    if not folder:
+        return None
+    return ResultCache(
+        folder,
+        max_size=os.environ.get('WASHU_BEDTRACE_CACHE_SIZE', DEFAULT_SIZE),
+        content_hash=os.environ.get('WASHU_BEDTRACE_CACHE_HASH') == 'content')
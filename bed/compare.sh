@@ -5,10 +5,20 @@
 # - Two peaks aver overlapping if they share at least one nucleotide
 # - Produces 3 files: exclusive peaks for condition 1 and 2 and common peaks.
 #
+# Usage: compare.sh [-s] <BED_1> <BED_2> <OUT_PREFIX>
+#   -s  files already sorted, skip resort step
+#
 # author Oleg Shpynov (oleg.shpynov@jetbrains.com)
 
 which bedtools &>/dev/null || { echo "ERROR: bedtools not found! Download bedTools: <http://code.google.com/p/bedtools/>"; exit 1; }
 
+# Files already sorted, skip resort step
+SORTED=NO
+if [[ "$1" == "-s" ]]; then
+    SORTED=YES
+    shift
+fi
+
 if [ $# -lt 3 ]; then
     echo "Need 3 parameters! <BED_1> <BED_2> <OUT_PREFIX>"
     exit 1
@@ -30,33 +40,33 @@ FILES=( $BED_1 $BED_2 )
 SORTED_FILES=()
 for F in ${FILES[@]}
 do
+    if [[ "${SORTED}" == "YES" ]]; then
+        SORTED_FILES+=("$F")
+        continue
+    fi
     # Folder with source file be read-only, use temp file
-    SORTED=$(mktemp)
-    sort -k1,1 -k2,2n -T ${TMPDIR} $F > ${SORTED}
-    SORTED_FILES+=("$SORTED")
+    SORTED_FILE=$(mktemp)
+    LC_ALL=C sort -k1,1 -k2,2n -T ${TMPDIR} $F > ${SORTED_FILE}
+    SORTED_FILES+=("$SORTED_FILE")
 done
 
-TMP_FILE=${OUT_PREFIX}_all.txt
+# Empty outputs are created anyway
+for COND in cond1 cond2 common; do
+    : > ${OUT_PREFIX}_${COND}.bed
+done
 
-# Compute common and exclusive peaks
+# Compute common and exclusive peaks, merged regions are already sorted,
+# so that each of them is routed to corresponding output in a single pass
 multiIntersectBed -i ${SORTED_FILES[@]} |\
 bedtools merge -c 6,7 -o max |\
 # Zero problem: max of '0' is 2.225073859e-308 - known floating point issue in bedtools merge
- awk -v OFS="\t" '{print $1,$2,$3,int($4),int($5)}' > ${TMP_FILE}
-
-cat ${TMP_FILE} | awk '/\t1\t0$/' |\
- awk '{for (i=1; i<=3; i++) printf("%s%s", $i, (i==3) ? "\n" : "\t")}' |\
- sort -k1,1 -k2,2n -T ${TMPDIR} > ${OUT_PREFIX}_cond1.bed
-
-cat ${TMP_FILE} | awk '/\t0\t1$/' |\
- awk '{for (i=1; i<=3; i++) printf("%s%s", $i, (i==3) ? "\n" : "\t")}' |\
- sort -k1,1 -k2,2n -T ${TMPDIR} > ${OUT_PREFIX}_cond2.bed
-
-cat ${TMP_FILE} | awk '/\t1\t1$/' |\
- awk '{for (i=1; i<=3; i++) printf("%s%s", $i, (i==3) ? "\n" : "\t")}' |\
- sort -k1,1 -k2,2n -T ${TMPDIR} > ${OUT_PREFIX}_common.bed
+ awk -v OFS="\t" -v PREFIX="${OUT_PREFIX}" '{
+    C1 = int($4); C2 = int($5);
+    if (C1 && !C2) { print $1,$2,$3 > (PREFIX "_cond1.bed") }
+    else if (!C1 && C2) { print $1,$2,$3 > (PREFIX "_cond2.bed") }
+    else if (C1 && C2) { print $1,$2,$3 > (PREFIX "_common.bed") }
+}'
 
 # Cleanup
-rm ${TMP_FILE}
-rm ${SORTED_FILES[@]}
+[[ "${SORTED}" == "YES" ]] || rm ${SORTED_FILES[@]}
 type clean_job_tmp_dir &>/dev/null && clean_job_tmp_dir
@@ -81,4 +81,4 @@ if [ ${PERCENT} -gt 0 ]; then
 fi
 
 bedtools multiinter -i ${FILES} | grep '\(,.*\)\{'${CONS_COUNT}'\}' | \
-    sort -k1,1 -k2,2n | bedtools merge
+    LC_ALL=C sort -k1,1 -k2,2n | bedtools merge
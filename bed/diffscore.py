@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+"""
+Consensus regions scoring by difference of support between groups of tracks.
+
+For each region covered by at least given number of tracks computes number
+of tracks of each group supporting it and absolute difference between them,
+e.g. for old and young donors groups.
+
+Usage: python -m bed.diffscore <folder> <min_consensus_threshold>
+Prints table for OD and YD groups of peaks files in folder, same as
+consensus_diffscore.sh.
+
+NOTE: numpy and pandas required
+"""
+import glob
+import os
+import sys
+
+import pandas as pd
+
+from bed import native
+
+# Peaks files name patterns of group in folder, outliers are ignored
+PEAKS_PATTERNS = ['*{}*island.bed', '*{}*Peak', '*{}*_peaks.bed']
+
+
+def group_files(folder, group):
+    """:return: sorted peaks files of group, e.g. OD or YD"""
+    files = set()
+    for pattern in PEAKS_PATTERNS:
+        files.update(glob.glob(os.path.join(glob.escape(folder),
+                                            pattern.format(group))))
+    return sorted(f for f in files if 'outlier' not in os.path.basename(f))
+
+
+def diffscore(groups, threshold):
+    """
+    :param groups: {label: list of BED files}, labels order is kept
+    :param threshold: min number of tracks supporting region
+    :return: DataFrame with columns chr, start, end, cons, <label>_cons for
+        each group, absdiff, i.e. max minus min of groups support
+    """
+    labels = list(groups.keys())
+    for label in labels:
+        if len(groups[label]) == 0:
+            raise Exception("Empty group: {}".format(label))
+    support = native.group_support(
+        [[native.merged(f) for f in groups[label]] for label in labels],
+        threshold)
+
+    columns = {'chr': [], 'start': [], 'end': [], 'cons': []}
+    groups_support = []
+    for chrom, (starts, ends, cons, depth) in support.items():
+        columns['chr'].extend([chrom] * len(starts))
+        columns['start'].extend(starts.tolist())
+        columns['end'].extend(ends.tolist())
+        columns['cons'].extend(cons.tolist())
+        groups_support.extend(depth.tolist())
+
+    result = pd.DataFrame(columns).astype(
+        {'chr': str, 'start': 'int64', 'end': 'int64', 'cons': 'int64'})
+    for i, label in enumerate(labels):
+        result['{}_cons'.format(label)] = pd.Series(
+            [x[i] for x in groups_support], dtype='int64')
+    group_columns = ['{}_cons'.format(label) for label in labels]
+    result['absdiff'] = result[group_columns].max(axis=1) - \
+        result[group_columns].min(axis=1)
+    return result
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Need 2 parameters! <folder_path> <min_consensus_threshold>")
+        print("""
+For given folder with peaks for each region 'r' (which has consensus above given threshold)
+from multi intersection calculates:
+        abs(#{OD_i intersecting 'r'} - #{YD_i intersecting 'r'}).""")
+        sys.exit(1)
+    folder, threshold = sys.argv[1], int(sys.argv[2])
+    result = diffscore({'od': group_files(folder, 'OD'),
+                        'yd': group_files(folder, 'YD')}, threshold)
+    result.to_csv(sys.stdout, sep='\t', index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+
+"""
+Gene index for nearest gene annotation, same as closest_gene.sh.
+
+Genes are loaded from GTF gene records or BED file with gene name in the 4th
+column. For each chromosome genes are kept sorted by start and by end, so
+that overlapping and closest upstream and downstream genes of all the peaks
+are found by vectorized binary search. Index is stored in .genes.npz
+sidecar file next to genes annotation and is valid while file size and
+modification time are the same, it is also kept in memory once loaded.
+
+Distances follow `bedtools closest -d`: overlapping genes have distance 0,
+otherwise distance is number of bases between peak and gene plus 1,
+all the ties are reported. Peaks on chromosomes without genes get
+'.' gene and distance -1.
+
+NOTE: numpy required
+"""
+import os
+import tempfile
+
+import numpy as np
+
+from bed.io import is_header
+
+SUFFIX = '.genes.npz'
+# Distance to missing upstream or downstream gene
+NO_DISTANCE = np.iinfo(np.int64).max
+
+# Loaded indices {genes path: ((size, mtime), GeneIndex)}
+LOADED = {}
+
+
+def sidecar(path):
+    return path + SUFFIX
+
+
+def read_genes(path):
+    """:return: {chrom: (starts, ends, names)} in file order"""
+    chroms = {}
+    gtf = not path.endswith('.bed')
+    with open(path) as f:
+        for line in f:
+            if is_header(line):
+                continue
+            parts = line.split()
+            if gtf:
+                if parts[2] != 'gene' or 'gene_name' not in parts:
+                    continue
+                chrom, start, end = parts[0], int(parts[3]) - 1, int(parts[4])
+                name = parts[parts.index('gene_name') + 1]
+                name = name.replace('"', '').replace(';', '')
+            else:
+                chrom, start, end = parts[0], int(parts[1]), int(parts[2])
+                name = parts[3] if len(parts) > 3 else '.'
+            if chrom not in chroms:
+                chroms[chrom] = ([], [], [])
+            starts, ends, names = chroms[chrom]
+            starts.append(start)
+            ends.append(end)
+            names.append(name)
+    return chroms
+
+
+def build(path):
+    """:return: dict of index arrays"""
+    chroms = read_genes(path)
+    names = sorted(chroms)
+    arrays = {'chroms': np.array(names)}
+    for i, chrom in enumerate(names):
+        starts, ends, genes = chroms[chrom]
+        starts = np.array(starts, dtype=np.int64)
+        ends = np.array(ends, dtype=np.int64)
+        order = np.lexsort((ends, starts))
+        arrays['starts_{}'.format(i)] = starts[order]
+        arrays['ends_{}'.format(i)] = ends[order]
+        arrays['maxends_{}'.format(i)] = np.maximum.accumulate(ends[order])
+        arrays['names_{}'.format(i)] = np.array(genes)[order]
+        # Genes positions in starts order sorted by end
+        arrays['byend_{}'.format(i)] = np.argsort(ends[order], kind='mergesort')
+    return arrays
+
+
+def _expand(lo, hi):
+    """:return: (owner, position) for all positions of [lo, hi) ranges"""
+    lengths = np.maximum(hi - lo, 0)
+    owners = np.repeat(np.arange(len(lo)), lengths)
+    positions = np.arange(lengths.sum()) - \
+        np.repeat(np.cumsum(lengths) - lengths, lengths) + \
+        np.repeat(lo, lengths)
+    return owners, positions
+
+
+class GeneIndex:
+    def __init__(self, arrays):
+        self.chromosomes = {str(c): i for i, c in enumerate(arrays['chroms'])}
+        self.genes = {}
+        for chrom, i in self.chromosomes.items():
+            starts = arrays['starts_{}'.format(i)]
+            ends = arrays['ends_{}'.format(i)]
+            byend = arrays['byend_{}'.format(i)]
+            self.genes[chrom] = (starts, ends, arrays['maxends_{}'.format(i)],
+                                 arrays['names_{}'.format(i)],
+                                 byend, ends[byend])
+
+    def closest(self, chrom, starts, ends):
+        """
+        Closest genes for peaks of single chromosome.
+        :return: (peak indices, gene names, distances), each peak is
+            repeated for all the tied genes, in genes start order
+        """
+        n = len(starts)
+        if chrom not in self.genes:
+            return (np.arange(n), np.full(n, '.', dtype=object),
+                    np.full(n, -1, dtype=np.int64))
+        gstarts, gends, maxends, names, byend, sorted_ends = self.genes[chrom]
+
+        # Overlapping genes: start < peak end and end > peak start,
+        # genes which end before peak start do start before its end
+        before_end = np.searchsorted(gstarts, ends, side='left')
+        ended = np.searchsorted(sorted_ends, starts, side='right')
+        overlaps = before_end - ended
+
+        # Closest downstream and upstream genes
+        down = np.minimum(before_end, len(gstarts) - 1)
+        down_distance = np.where(before_end < len(gstarts),
+                                 gstarts[down] - ends + 1, NO_DISTANCE)
+        up = np.maximum(ended - 1, 0)
+        up_distance = np.where(ended > 0, starts - sorted_ends[up] + 1,
+                               NO_DISTANCE)
+        distance = np.where(overlaps > 0, 0,
+                            np.minimum(down_distance, up_distance))
+
+        # Overlapping genes of peaks with overlaps, otherwise all the genes
+        # with the closest end upstream and closest start downstream
+        overlapping = overlaps > 0
+        owners, found = _expand(
+            np.where(overlapping,
+                     np.searchsorted(maxends, starts, side='right'), 0),
+            np.where(overlapping, before_end, 0))
+        mask = gends[found] > starts[owners]
+        owners, found = [owners[mask]], [found[mask]]
+
+        up_tied = ~overlapping & (up_distance == distance)
+        up_owners, up_found = _expand(
+            np.where(up_tied, np.searchsorted(sorted_ends, sorted_ends[up],
+                                              side='left'), 0),
+            np.where(up_tied, ended, 0))
+        owners.append(up_owners)
+        found.append(byend[up_found])
+
+        down_tied = ~overlapping & (down_distance == distance)
+        down_owners, down_found = _expand(
+            np.where(down_tied, down, 0),
+            np.where(down_tied, np.searchsorted(gstarts, gstarts[down],
+                                                side='right'), 0))
+        owners.append(down_owners)
+        found.append(down_found)
+
+        owners, found = np.concatenate(owners), np.concatenate(found)
+        order = np.lexsort((found, owners))
+        owners, found = owners[order], found[order]
+        return owners, names[found].astype(object), distance[owners]
+
+
+def get(path):
+    """:return: GeneIndex from memory, valid sidecar or built one"""
+    stat = os.stat(path)
+    version = (stat.st_size, stat.st_mtime_ns)
+    if path in LOADED and LOADED[path][0] == version:
+        return LOADED[path][1]
+
+    arrays = None
+    try:
+        with np.load(sidecar(path)) as cached:
+            if tuple(cached['version'].tolist()) == version:
+                arrays = {k: cached[k] for k in cached.files}
+    except (OSError, ValueError, KeyError):
+        pass
+    if arrays is None:
+        arrays = build(path)
+        try:
+            # Write via temp file, so that concurrent readers never see
+            # partial index
+            with tempfile.NamedTemporaryFile(
+                    dir=os.path.dirname(os.path.abspath(path)), prefix='.',
+                    suffix=SUFFIX, delete=False) as tmpfile:
+                np.savez(tmpfile, version=np.array(version, dtype=np.int64),
+                         **arrays)
+            os.replace(tmpfile.name, sidecar(path))
+        except OSError:
+            # Read-only folder
+            pass
+    index = GeneIndex(arrays)
+    LOADED[path] = (version, index)
+    return index
+
+
+def closest_gene(peaks_path, genes_path, out):
+    """
+    Writes peaks with closest gene name and distance, like closest_gene.sh,
+    sorted by chromosome, end and start
+    """
+    index = get(genes_path)
+    columns = None
+    chroms = {}
+    with open(peaks_path) as f:
+        for line in f:
+            if is_header(line):
+                continue
+            parts = line.split()
+            if columns is None:
+                columns = len(parts)
+            if parts[0] not in chroms:
+                chroms[parts[0]] = []
+            chroms[parts[0]].append(parts[:columns])
+
+    rows = []
+    for chrom, peaks in chroms.items():
+        starts = np.array([int(p[1]) for p in peaks], dtype=np.int64)
+        ends = np.array([int(p[2]) for p in peaks], dtype=np.int64)
+        found, genes, distances = index.closest(chrom, starts, ends)
+        for i, gene, d in zip(found.tolist(), genes.tolist(),
+                              distances.tolist()):
+            line = '\t'.join(peaks[i] + [gene, str(d)])
+            rows.append((chrom, int(ends[i]), int(starts[i]), line))
+    rows.sort()
+    for row in rows:
+        out.write(row[3] + '\n')
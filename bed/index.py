@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+"""
+Persistent interval index of BED file for fast region queries.
+
+For each chromosome intervals are sorted by start and running max of ends
+is kept, so that overlapping intervals are found by two binary searches:
+* intervals after the last one with start < query end can't overlap
+* intervals before the first one with running max end > query start
+  can't overlap either
+Query takes O(log n + k), where k is the number of intervals between the two
+bounds. Intervals nested in a long one are all candidates for queries within
+it, even if they don't overlap, so k is bounded by the number of overlapping
+intervals only for files without deeply nested intervals.
+Index is stored in .index.npz sidecar file next to the BED file and is valid
+while file size and modification time are the same.
+
+NOTE: numpy required
+"""
+import os
+import tempfile
+
+import numpy as np
+
+from bed.io import is_header
+
+SUFFIX = '.index.npz'
+# End of whole chromosome region
+MAX_END = np.iinfo(np.int64).max
+
+
+def sidecar(path):
+    return path + SUFFIX
+
+
+class IntervalIndex:
+    """
+    Per-chromosome arrays sorted by start:
+    starts, ends, running max ends and byte offsets of lines in file
+    """
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.chromosomes = {str(c): i for i, c in enumerate(arrays['chroms'])}
+
+    def _get(self, name, code):
+        return self.arrays['{}_{}'.format(name, code)]
+
+    def query(self, chrom, start=None, end=None):
+        """
+        :param start: None stands for chromosome start
+        :param end: None stands for chromosome end
+        :return: byte offsets of lines overlapping [start, end)
+        """
+        if chrom not in self.chromosomes:
+            return np.zeros(0, dtype=np.int64)
+        start = 0 if start is None else start
+        end = MAX_END if end is None else end
+        code = self.chromosomes[chrom]
+        starts, ends = self._get('starts', code), self._get('ends', code)
+        lo = np.searchsorted(self._get('maxends', code), start, side='right')
+        hi = np.searchsorted(starts, end, side='left')
+        candidates = np.arange(lo, max(lo, hi))
+        return self._get('offsets', code)[candidates[ends[candidates] > start]]
+
+    def query_many(self, regions):
+        """
+        Vectorized lookup of many regions, binary searches are done per
+        chromosome for all its regions at once.
+        :param regions: list of (chrom, start, end), None start and end
+            stand for whole chromosome
+        :return: list of byte offsets arrays, one per region
+        """
+        result = [np.zeros(0, dtype=np.int64)] * len(regions)
+        by_chrom = {}
+        for i, (chrom, _, _) in enumerate(regions):
+            if chrom in self.chromosomes:
+                by_chrom.setdefault(chrom, []).append(i)
+        for chrom, indices in by_chrom.items():
+            code = self.chromosomes[chrom]
+            starts, ends = self._get('starts', code), self._get('ends', code)
+            offsets = self._get('offsets', code)
+            qstarts = np.array([regions[i][1] or 0 for i in indices],
+                               dtype=np.int64)
+            qends = np.array([MAX_END if regions[i][2] is None
+                              else regions[i][2] for i in indices],
+                             dtype=np.int64)
+            los = np.searchsorted(self._get('maxends', code), qstarts,
+                                  side='right')
+            his = np.maximum(los, np.searchsorted(starts, qends, side='left'))
+            # Candidates of all the regions in one flat array
+            lengths = his - los
+            owners = np.repeat(np.arange(len(indices)), lengths)
+            candidates = np.arange(lengths.sum()) - \
+                np.repeat(np.cumsum(lengths) - lengths, lengths) + \
+                np.repeat(los, lengths)
+            mask = ends[candidates] > qstarts[owners]
+            found = offsets[candidates[mask]]
+            bounds = np.searchsorted(owners[mask], np.arange(len(indices) + 1))
+            for j, i in enumerate(indices):
+                result[i] = found[bounds[j]:bounds[j + 1]]
+        return result
+
+
+def build(path):
+    """Reads BED file once, :return: dict of index arrays"""
+    chroms = {}
+    offset = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if not is_header(line):
+                chrom, start, end = line.split(None, 3)[:3]
+                if chrom not in chroms:
+                    chroms[chrom] = ([], [], [])
+                starts, ends, offsets = chroms[chrom]
+                starts.append(int(start))
+                ends.append(int(end))
+                offsets.append(offset)
+            offset += len(line)
+
+    names = sorted(chroms)
+    arrays = {'chroms': np.array([c.decode('utf-8') for c in names])}
+    for i, chrom in enumerate(names):
+        starts, ends, offsets = [np.array(x, dtype=np.int64)
+                                 for x in chroms[chrom]]
+        order = np.argsort(starts, kind='mergesort')
+        arrays['starts_{}'.format(i)] = starts[order]
+        arrays['ends_{}'.format(i)] = ends[order]
+        arrays['maxends_{}'.format(i)] = np.maximum.accumulate(ends[order])
+        arrays['offsets_{}'.format(i)] = offsets[order]
+    return arrays
+
+
+def get(path):
+    """:return: IntervalIndex from valid sidecar or built one"""
+    stat = os.stat(path)
+    version = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+    try:
+        # Npz file reads array on each access, so all of them are read at once
+        with np.load(sidecar(path)) as npz:
+            if np.array_equal(npz['version'], version):
+                return IntervalIndex({name: npz[name] for name in npz.files})
+    except (OSError, ValueError, KeyError):
+        pass
+
+    arrays = build(path)
+    try:
+        # Write via temp file, so that concurrent readers never see partial
+        # index
+        with tempfile.NamedTemporaryFile(
+                dir=os.path.dirname(os.path.abspath(path)), prefix='.',
+                suffix=SUFFIX, delete=False) as tmpfile:
+            np.savez(tmpfile, version=version, **arrays)
+        os.replace(tmpfile.name, sidecar(path))
+    except OSError:
+        # Read-only folder
+        pass
+    return IntervalIndex(arrays)
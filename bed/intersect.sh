@@ -5,11 +5,21 @@
 # - Two peaks aver overlapping if they share at least one nucleotide
 # - Prints only peaks that overlap in all files (merged)
 #
+# Usage: intersect.sh [-s] <FILE>*
+#   -s  files already sorted, skip resort step
+#
 # author Oleg Shpynov (oleg.shpynov@jetbrains.com)
 
 which bedtools &>/dev/null || { echo "ERROR: bedtools not found! Download bedTools: <http://code.google.com/p/bedtools/>"; exit 1; }
 >&2 echo "intersect: $@"
 
+# Files already sorted, skip resort step
+SORTED=NO
+if [[ "$1" == "-s" ]]; then
+    SORTED=YES
+    shift
+fi
+
 if [[ $# -eq 0 ]]; then
   echo "ERROR: Empty arguments list"
   exit 1
@@ -24,10 +34,14 @@ mkdir -p "${TMPDIR}"
 SORTED_FILES=()
 for F in $@
 do
+    if [[ "${SORTED}" == "YES" ]]; then
+        SORTED_FILES+=("$F")
+        continue
+    fi
     # Folder with source file be read-only, use temp file
-    SORTED=$(mktemp)
-    sort -k1,1 -k2,2n -T ${TMPDIR} $F > ${SORTED}
-    SORTED_FILES+=("$SORTED")
+    SORTED_FILE=$(mktemp)
+    LC_ALL=C sort -k1,1 -k2,2n -T ${TMPDIR} $F > ${SORTED_FILE}
+    SORTED_FILES+=("$SORTED_FILE")
 done
 
 range=$(seq -s, 6 1 $(($# + 5)))
@@ -40,10 +54,10 @@ bedtools multiinter -i "${SORTED_FILES[@]}" |\
  # NOTE[shpynov] use awk instead of grep, because grep has some problems with tab characters.
  awk "/$pattern$/" |\
  awk '{for (i=1; i<=3; i++) printf("%s%s", $i, (i==3) ? "\n" : "\t")}' |\
- sort -k1,1 -k2,2n -T ${TMPDIR}
+ LC_ALL=C sort -k1,1 -k2,2n -T ${TMPDIR}
 
 # Cleanup
-rm ${SORTED_FILES[@]}
+[[ "${SORTED}" == "YES" ]] || rm ${SORTED_FILES[@]}
 # TMP dir cleanup:
 type clean_job_tmp_dir &>/dev/null && clean_job_tmp_dir
 
@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+
+"""
+Plain text BED helpers shared by bedtrace modules, no numpy required.
+"""
+
+
+def label(n, path):
+    """Track label used by union.sh, i.e. N_${FILE##.*/}"""
+    if path.startswith('.') and path.rfind('/') > 0:
+        path = path[path.rfind('/') + 1:]
+    return '{}_{}'.format(n, path)
+
+
+# Header lines prefixes, such lines and empty ones are skipped by all the readers
+HEADERS = ('#', 'track', 'browser')
+_HEADERS_BYTES = tuple(h.encode('utf-8') for h in HEADERS)
+
+
+def is_header(line):
+    """:return: True for empty or header str or bytes line, i.e. not an interval"""
+    return not line.strip() or line.startswith(
+        _HEADERS_BYTES if isinstance(line, bytes) else HEADERS)
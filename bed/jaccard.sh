@@ -88,8 +88,8 @@ if [ "${MERGED}" == "NO" ]; then
     if [ "${SORTED}" == "NO" ]; then
         BED1_SORTED=${TMPDIR}/1.sorted.bed
         BED2_SORTED=${TMPDIR}/2.sorted.bed
-        sort -k1,1 -k2,2n -T ${TMPDIR} $BED1 > $BED1_SORTED
-        sort -k1,1 -k2,2n -T ${TMPDIR} $BED2 > $BED2_SORTED
+        LC_ALL=C sort -k1,1 -k2,2n -T ${TMPDIR} $BED1 > $BED1_SORTED
+        LC_ALL=C sort -k1,1 -k2,2n -T ${TMPDIR} $BED2 > $BED2_SORTED
         BED1=$BED1_SORTED
         BED2=$BED2_SORTED
     fi
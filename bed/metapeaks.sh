@@ -42,7 +42,7 @@ do
     PEAKS="$PEAKS$T$NPEAKS"
     # Folder with source file be read-only, use temp file
     SORTED=$(mktemp)
-    sort -k1,1 -k2,2n -T ${TMPDIR} $F > ${SORTED}
+    LC_ALL=C sort -k1,1 -k2,2n -T ${TMPDIR} $F > ${SORTED}
     SORTED_FILES+=("$SORTED")
 done
 
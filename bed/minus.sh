@@ -5,11 +5,21 @@
 # - Two peaks aver overlapping if they share at least one nucleotide
 # - Prints only peaks that is unique to first file
 #
+# Usage: minus.sh [-s] <FILE1> <FILE2>
+#   -s  files already sorted, skip resort step
+#
 # author Oleg Shpynov (oleg.shpynov@jetbrains.com)
 
 which bedtools &>/dev/null || { echo "ERROR: bedtools not found! Download bedTools: <http://code.google.com/p/bedtools/>"; exit 1; }
 >&2 echo "minus: $@"
 
+# Files already sorted, skip resort step
+SORTED=NO
+if [[ "$1" == "-s" ]]; then
+    SORTED=YES
+    shift
+fi
+
 if [ $# -lt 2 ]; then
     echo "Need 2 parameters! <FILE1> <FILE2>"
     exit 1
@@ -23,11 +33,16 @@ mkdir -p "${TMPDIR}"
 
 FILE1=$1
 FILE2=$2
-# Folder with source file be read-only, use temp file
-SORTED1=$(mktemp)
-SORTED2=$(mktemp)
-sort -k1,1 -k2,2n -T ${TMPDIR} $FILE1 > ${SORTED1}
-sort -k1,1 -k2,2n -T ${TMPDIR} $FILE2 > ${SORTED2}
+if [[ "${SORTED}" == "YES" ]]; then
+    SORTED1=${FILE1}
+    SORTED2=${FILE2}
+else
+    # Folder with source file be read-only, use temp file
+    SORTED1=$(mktemp)
+    SORTED2=$(mktemp)
+    LC_ALL=C sort -k1,1 -k2,2n -T ${TMPDIR} $FILE1 > ${SORTED1}
+    LC_ALL=C sort -k1,1 -k2,2n -T ${TMPDIR} $FILE2 > ${SORTED2}
+fi
 
 bedtools multiinter -i ${SORTED1} ${SORTED2} |\
  bedtools merge -c 6,7 -o max |\
@@ -36,8 +51,8 @@ bedtools multiinter -i ${SORTED1} ${SORTED2} |\
  # NOTE[shpynov] use awk instead of grep, because grep has some problems with tab characters.
  awk "/\t1\t0/" |\
  awk '{for (i=1; i<=3; i++) printf("%s%s", $i, (i==3) ? "\n" : "\t")}' |\
- sort -k1,1 -k2,2n -T ${TMPDIR}
+ LC_ALL=C sort -k1,1 -k2,2n -T ${TMPDIR}
 
 # Cleanup
-rm ${SORTED1} ${SORTED2}
+[[ "${SORTED}" == "YES" ]] || rm ${SORTED1} ${SORTED2}
 type clean_job_tmp_dir &>/dev/null && clean_job_tmp_dir
\ No newline at end of file
@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+
+"""
+In-process interval engine for bedtrace operations.
+
+Evaluates union, intersection and minus over per-chromosome sorted numpy
+start/end arrays and produces exactly the same BED output as union.sh,
+intersect.sh and minus.sh scripts:
+* Two peaks are overlapping if they share at least one nucleotide,
+  book-ended peaks are merged as well (bedtools merge default)
+* Chromosomes are ordered like `sort -k1,1` with LC_ALL=C
+
+NOTE: numpy required
+"""
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from bed.io import is_header, label
+
+# Intervals chunk, chroms are codes of names list, which is shared between
+# chunks of the same stream, extra is a list of columns after 3rd one
+Chunk = namedtuple('Chunk', ['names', 'chroms', 'starts', 'ends', 'extra'])
+
+
+def read_bed(path):
+    """
+    Reads BED file into per-chromosome arrays, only first 3 columns are used.
+    :return: {chrom: (starts, ends)}, intervals are sorted by start
+    """
+    chroms = {}
+    with open(path) as f:
+        for line in f:
+            if is_header(line):
+                continue
+            chrom, start, end = line.split()[:3]
+            if chrom not in chroms:
+                chroms[chrom] = ([], [])
+            starts, ends = chroms[chrom]
+            starts.append(int(start))
+            ends.append(int(end))
+
+    result = {}
+    for chrom, (starts, ends) in chroms.items():
+        starts = np.array(starts, dtype=np.int64)
+        ends = np.array(ends, dtype=np.int64)
+        # Sorted input doesn't need reordering
+        if np.any(starts[1:] < starts[:-1]):
+            order = np.argsort(starts, kind='mergesort')
+            starts, ends = starts[order], ends[order]
+        result[chrom] = (starts, ends)
+    return result
+
+
+def chunks(intervals, size):
+    """
+    Groups intervals stream into chunks of arrays.
+    :param intervals: iterable of (chrom, start, end, [extra columns])
+    :param size: max intervals in chunk
+    :return: generator of Chunk, missing extra columns are empty strings
+    """
+    if size <= 0:
+        raise Exception("Illegal chunk size: {}".format(size))
+    names = []
+    codes = {}
+    rows = []
+
+    def chunk():
+        width = max(len(r[3]) for r in rows)
+        extra = [np.array([r[3][i] if i < len(r[3]) else '' for r in rows])
+                 for i in range(width)]
+        return Chunk(names,
+                     np.array([r[0] for r in rows], dtype=np.int32),
+                     np.array([r[1] for r in rows], dtype=np.int64),
+                     np.array([r[2] for r in rows], dtype=np.int64),
+                     extra)
+
+    for chrom, start, end, rest in intervals:
+        if chrom not in codes:
+            codes[chrom] = len(names)
+            names.append(chrom)
+        rows.append((codes[chrom], start, end, rest))
+        if len(rows) == size:
+            yield chunk()
+            rows = []
+    if rows:
+        yield chunk()
+
+
+def merge(starts, ends):
+    """
+    Vectorized sweep-line merge of intervals sorted by start.
+    :return: (merged starts, merged ends, component id for each interval)
+    """
+    if len(starts) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    running_end = np.maximum.accumulate(ends)
+    heads = np.empty(len(starts), dtype=bool)
+    heads[0] = True
+    # Book-ended intervals are merged too
+    heads[1:] = starts[1:] > running_end[:-1]
+    ids = np.cumsum(heads) - 1
+    positions = np.flatnonzero(heads)
+    return starts[positions], np.maximum.reduceat(ends, positions), ids
+
+
+def components(tracks):
+    """
+    Merges intervals of all the tracks together, like
+    `bedtools multiinter | bedtools merge` does.
+    :param tracks: list of {chrom: (starts, ends)}
+    :return: {chrom: (starts, ends, membership)}, where membership is
+        a boolean matrix [components x tracks]
+    """
+    result = {}
+    for chrom in sorted(set().union(*[t.keys() for t in tracks])):
+        present = [(i, t[chrom]) for i, t in enumerate(tracks) if chrom in t]
+        starts = np.concatenate([se[0] for _, se in present])
+        ends = np.concatenate([se[1] for _, se in present])
+        track_ids = np.concatenate([np.full(len(se[0]), i, dtype=np.int64)
+                                    for i, se in present])
+        order = np.argsort(starts, kind='mergesort')
+        cstarts, cends, ids = merge(starts[order], ends[order])
+        membership = np.zeros((len(cstarts), len(tracks)), dtype=bool)
+        membership[ids, track_ids[order]] = True
+        result[chrom] = (cstarts, cends, membership)
+    return result
+
+
+def _write_bed3(out, chrom, starts, ends):
+    for s, e in zip(starts.tolist(), ends.tolist()):
+        out.write('{}\t{}\t{}\n'.format(chrom, s, e))
+
+
+def masks(membership):
+    """:return: list of membership bitmasks, i-th bit for i-th track"""
+    if membership.shape[1] < 63:
+        weights = np.left_shift(1, np.arange(membership.shape[1],
+                                             dtype=np.int64))
+        return (membership.astype(np.int64) @ weights).tolist()
+    packed = np.packbits(membership, axis=1, bitorder='little')
+    return [int.from_bytes(row.tobytes(), 'little') for row in packed]
+
+
+def union_files(files, out, mask=False):
+    """
+    Same as union.sh, writes merged peaks with parent tracks labels
+    :param mask: write membership bitmask instead of labels, see union.sh -m
+    """
+    if len(files) == 0:
+        raise Exception("Empty arguments list")
+    labels = [label(i + 1, f) for i, f in enumerate(files)]
+    for chrom, (starts, ends, membership) in \
+            components([read_bed(f) for f in files]).items():
+        if mask:
+            for s, e, m in zip(starts.tolist(), ends.tolist(),
+                               masks(membership)):
+                out.write('{}\t{}\t{}\t{}\n'.format(chrom, s, e, m))
+            continue
+        for s, e, row in zip(starts.tolist(), ends.tolist(), membership):
+            names = sorted(labels[i] for i in np.flatnonzero(row))
+            out.write('{}\t{}\t{}\t{}\n'.format(chrom, s, e, '|'.join(names)))
+
+
+def intersect_files(files, out):
+    """Same as intersect.sh, writes merged peaks which overlap in all files"""
+    if len(files) == 0:
+        raise Exception("Empty arguments list")
+    for chrom, (starts, ends, membership) in \
+            components([read_bed(f) for f in files]).items():
+        mask = membership.all(axis=1)
+        _write_bed3(out, chrom, starts[mask], ends[mask])
+
+
+def minus_files(file1, file2, out):
+    """Same as minus.sh, writes merged peaks which are unique to first file"""
+    for chrom, (starts, ends, membership) in \
+            components([read_bed(file1), read_bed(file2)]).items():
+        mask = membership[:, 0] & ~membership[:, 1]
+        _write_bed3(out, chrom, starts[mask], ends[mask])
+
+
+def compare_files(file1, file2, outs):
+    """
+    Same as compare.sh, routes each merged region in a single pass
+    :param outs: cond1, cond2 and common outputs
+    """
+    cond1, cond2, common = outs
+    for chrom, (starts, ends, membership) in \
+            components([read_bed(file1), read_bed(file2)]).items():
+        for out, mask in [(cond1, membership[:, 0] & ~membership[:, 1]),
+                          (cond2, ~membership[:, 0] & membership[:, 1]),
+                          (common, membership[:, 0] & membership[:, 1])]:
+            _write_bed3(out, chrom, starts[mask], ends[mask])
+
+
+def merged(path):
+    """:return: {chrom: (starts, ends)} of merged intervals"""
+    result = {}
+    for chrom, (starts, ends) in read_bed(path).items():
+        mstarts, mends, _ids = merge(starts, ends)
+        result[chrom] = (mstarts, mends)
+    return result
+
+
+def covered(track):
+    """:return: total length of merged track"""
+    return int(sum((ends - starts).sum() for starts, ends in track.values()))
+
+
+def overlap(track1, track2):
+    """
+    Length of intersection of two merged tracks, vectorized sweep over
+    sorted boundaries, intersection is covered by both tracks.
+    """
+    result = 0
+    for chrom in track1.keys() & track2.keys():
+        (s1, e1), (s2, e2) = track1[chrom], track2[chrom]
+        positions = np.concatenate([s1, s2, e1, e2])
+        deltas = np.concatenate([np.ones(len(s1) + len(s2), dtype=np.int64),
+                                 -np.ones(len(e1) + len(e2), dtype=np.int64)])
+        order = np.argsort(positions, kind='mergesort')
+        depth = np.cumsum(deltas[order])
+        result += int(np.diff(positions[order])[depth[:-1] == 2].sum())
+    return result
+
+
+def consensus(tracks, count):
+    """
+    Regions covered by at least count tracks, like
+    `bedtools multiinter | grep | bedtools merge` in consensus.sh.
+    Coverage depth is computed by a single sweep over sorted boundaries of
+    all the tracks, tracks are merged first, so that each counts once.
+    :param tracks: list of merged tracks {chrom: (starts, ends)}
+    :return: {chrom: (starts, ends)} merged regions
+    """
+    result = {}
+    for chrom in sorted(set().union(*[t.keys() for t in tracks])):
+        present = [t[chrom] for t in tracks if chrom in t]
+        if len(present) < count:
+            continue
+        starts = np.concatenate([se[0] for se in present])
+        ends = np.concatenate([se[1] for se in present])
+        positions = np.concatenate([starts, ends])
+        deltas = np.concatenate([np.ones(len(starts), dtype=np.int64),
+                                 -np.ones(len(ends), dtype=np.int64)])
+        order = np.argsort(positions, kind='mergesort')
+        positions = positions[order]
+        depth = np.cumsum(deltas[order])
+        # Segment between i-th and next boundary has depth[i]
+        mask = (depth[:-1] >= count) & (positions[1:] > positions[:-1])
+        cstarts, cends, _ids = merge(positions[:-1][mask], positions[1:][mask])
+        if len(cstarts):
+            result[chrom] = (cstarts, cends)
+    return result
+
+
+def group_support(groups, threshold):
+    """
+    Per-group support of consensus regions, like consensus_diffscore.sh.
+    Single sweep over sorted boundaries of all the tracks computes coverage
+    depth for each group at once, segments covered by at least threshold
+    tracks are merged keeping max depth.
+    :param groups: list of groups, each is a list of merged tracks
+    :return: {chrom: (starts, ends, max total depth, max depth per group)},
+        the latter is a matrix [regions x groups]
+    """
+    tracks = [(g, t) for g, group in enumerate(groups) for t in group]
+    result = {}
+    for chrom in sorted(set().union(*[t.keys() for _, t in tracks])):
+        present = [(g, t[chrom]) for g, t in tracks if chrom in t]
+        starts = np.concatenate([se[0] for _, se in present])
+        ends = np.concatenate([se[1] for _, se in present])
+        group_ids = np.concatenate([np.full(len(se[0]), g, dtype=np.int64)
+                                    for g, se in present])
+        positions = np.concatenate([starts, ends])
+        order = np.argsort(positions, kind='mergesort')
+        positions = positions[order]
+        deltas = np.zeros((len(positions), len(groups)), dtype=np.int64)
+        deltas[np.arange(len(positions)),
+               np.concatenate([group_ids, group_ids])[order]] = \
+            np.concatenate([np.ones(len(starts), dtype=np.int64),
+                            -np.ones(len(ends), dtype=np.int64)])[order]
+        # Segment between i-th and next boundary has depth[i]
+        depth = np.cumsum(deltas, axis=0)[:-1]
+        total = depth.sum(axis=1)
+        mask = (total >= threshold) & (positions[1:] > positions[:-1])
+        if not mask.any():
+            continue
+        cstarts, cends, ids = merge(positions[:-1][mask], positions[1:][mask])
+        heads = np.flatnonzero(np.diff(ids, prepend=-1))
+        result[chrom] = (cstarts, cends,
+                         np.maximum.reduceat(total[mask], heads),
+                         np.maximum.reduceat(depth[mask], heads, axis=0))
+    return result
+
+
+def consensus_files(files, count, out):
+    """Same as consensus.sh -c count, writes merged consensus regions"""
+    if len(files) == 0:
+        raise Exception("Empty arguments list")
+    for chrom, (starts, ends) in consensus([merged(f) for f in files],
+                                           count).items():
+        _write_bed3(out, chrom, starts, ends)
+
+
+def patterns(files):
+    """
+    Counts merged regions by files membership, like metapeaks.sh does.
+    Each region gets a bitmask, where i-th bit is set if region overlaps
+    i-th file, any number of files is supported.
+    :return: {bitmask: number of regions} for present patterns only
+    """
+    result = {}
+    for _chrom, (_starts, _ends, membership) in \
+            components([read_bed(f) for f in files]).items():
+        # Little bit order, so that byte j keeps files 8j..8j+7
+        packed = np.packbits(membership, axis=1, bitorder='little')
+        rows, counts = np.unique(packed, axis=0, return_counts=True)
+        for row, count in zip(rows, counts.tolist()):
+            mask = int.from_bytes(row.tobytes(), 'little')
+            result[mask] = result.get(mask, 0) + count
+    return result
+
+
+# Merged tracks shared with worker processes, see jaccard_matrix()
+_TRACKS = None
+
+
+def _init_tracks(tracks):
+    global _TRACKS
+    _TRACKS = tracks
+
+
+def _overlaps_row(i):
+    return [overlap(_TRACKS[i], _TRACKS[j]) for j in range(i + 1, len(_TRACKS))]
+
+
+def jaccard_matrix(files, workers=1):
+    """
+    Pairwise Jaccard indices, same as jaccard.sh for each pair of files.
+    Each file is read and merged once.
+    :param workers: worker processes to compute matrix rows
+    :return: symmetric numpy matrix
+    """
+    tracks = [merged(f) for f in files]
+    n = len(tracks)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_tracks,
+                                 initargs=(tracks,)) as pool:
+            rows = list(pool.map(_overlaps_row, range(n)))
+    else:
+        _init_tracks(tracks)
+        rows = [_overlaps_row(i) for i in range(n)]
+        _init_tracks(None)
+
+    lengths = [covered(t) for t in tracks]
+    result = np.zeros((n, n), dtype=np.float64)
+    for i in range(n):
+        result[i, i] = 1.0 if lengths[i] > 0 else 0.0
+        for j, intersection in enumerate(rows[i], start=i + 1):
+            union = lengths[i] + lengths[j] - intersection
+            # Empty union results in 0
+            result[i, j] = result[j, i] = \
+                intersection / union if union > 0 else 0.0
+    return result
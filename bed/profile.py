@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+"""
+Per-operation profiling of bedtrace expressions, i.e. "explain analyze".
+
+For each computed operation the following is recorded:
+* wall time and CPU time of the operation itself, operands excluded,
+  CPU time includes finished child processes, e.g. bedtools
+* whether result was taken from cache
+* number of input and output intervals and their size in bytes,
+  inputs are unknown for cached results, since operands are not computed
+
+Profile is shown as annotated expression tree, see Profiler.report(), and
+can be exported as JSON or Chrome trace events, which can be opened in
+chrome://tracing or https://ui.perfetto.dev, see Profiler.save_json() and
+Profiler.save_trace().
+
+NOTE: CPU time of child processes is accounted per process, so with
+concurrent computation it is assigned to operations finished in the same
+time frame.
+"""
+import json
+import os
+import resource
+import threading
+import time
+
+from bed import stats
+
+
+def _children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _size(size):
+    if size < 1024:
+        return '{} B'.format(size)
+    for unit in ['KB', 'MB', 'GB']:
+        size /= 1024
+        if size < 1024 or unit == 'GB':
+            return '{:.1f} {}'.format(size, unit)
+
+
+def _or_unknown(value, format=str):
+    return '-' if value is None else format(value)
+
+
+def _files_summary(nodes):
+    """:return: (intervals, bytes) of output files of Bed and Operation nodes"""
+    intervals = 0
+    size = 0
+    for node in nodes:
+        for path in node.outputs():
+            # Statistics sidecars are stored for results only, never next to user files
+            intervals += stats.get(path, store=hasattr(node, 'operands'))['intervals']
+            size += os.path.getsize(path)
+    return intervals, size
+
+
+class Profiler:
+    def __init__(self):
+        # Records of profiled operations {id(node): record}
+        self.records = {}
+        # Expressions to report, see bedtrace.explain_analyze()
+        self.roots = []
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def start(self):
+        """:return: opaque start marker for stop()"""
+        return time.perf_counter(), time.thread_time(), _children_cpu()
+
+    def stop(self, node, started, cache_hit):
+        """
+        Records operation computed since started.
+        :param node: computed operation, see bedtrace.Operation
+        """
+        wall = time.perf_counter() - started[0]
+        cpu = time.thread_time() - started[1] + _children_cpu() - started[2]
+        input_intervals = input_bytes = None
+        if not cache_hit:
+            input_intervals, input_bytes = _files_summary(node.operands)
+        output_intervals, output_bytes = _files_summary([node])
+        with self.lock:
+            self.records[id(node)] = {
+                'id': len(self.records) + 1,
+                'operation': node.operation,
+                'params': [str(p) for p in node.params()],
+                'cache_hit': cache_hit,
+                'start': started[0] - self.origin,
+                'wall': wall,
+                'cpu': cpu,
+                'thread': threading.get_ident(),
+                'input_intervals': input_intervals,
+                'input_bytes': input_bytes,
+                'output_intervals': output_intervals,
+                'output_bytes': output_bytes,
+            }
+
+    def report(self, *roots):
+        """
+        :param roots: expressions, default profiled ones
+        :return: expression trees annotated with recorded measurements
+        """
+        lines = []
+        reported = set()
+
+        def pp(node, indent):
+            prefix = '\t' * indent
+            if not hasattr(node, 'operands'):
+                intervals, size = _files_summary([node])
+                lines.append('{}{}  {} intervals ({})'.format(
+                    prefix, node.pp(0), intervals, _size(size)))
+                return
+            record = self.records.get(id(node))
+            if record is None:
+                lines.append('{}{}  {}'.format(
+                    prefix, node.operation,
+                    'not profiled' if node.path is not None else 'not computed'))
+            elif id(node) in reported:
+                lines.append('{}{} #{} (shared)'.format(
+                    prefix, node.operation, record['id']))
+                return
+            else:
+                reported.add(id(node))
+                lines.append('{}{} #{}  {}  wall {:.3f}s  cpu {:.3f}s  '
+                             'in {} ({})  out {} ({})'.format(
+                                 prefix, node.operation, record['id'],
+                                 'cache hit' if record['cache_hit'] else 'computed',
+                                 record['wall'], record['cpu'],
+                                 _or_unknown(record['input_intervals']),
+                                 _or_unknown(record['input_bytes'], _size),
+                                 record['output_intervals'],
+                                 _size(record['output_bytes'])))
+            for o in node.operands:
+                pp(o, indent + 1)
+
+        for r in roots or self.roots:
+            pp(r, 0)
+        records = list(self.records.values())
+        lines.append('Operations: {}, cache hits: {}, wall {:.3f}s, cpu {:.3f}s'.format(
+            len(records), sum(r['cache_hit'] for r in records),
+            sum(r['wall'] for r in records), sum(r['cpu'] for r in records)))
+        return '\n'.join(lines)
+
+    def to_json(self):
+        """:return: list of records in computation order"""
+        return sorted(self.records.values(), key=lambda r: r['start'])
+
+    def save_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_json(), f, indent=2)
+
+    def to_trace(self):
+        """:return: Chrome trace events, times are in microseconds"""
+        events = []
+        for r in self.to_json():
+            events.append({
+                'name': ' '.join([r['operation']] + r['params']),
+                'cat': 'cache' if r['cache_hit'] else 'compute',
+                'ph': 'X',
+                'ts': int(r['start'] * 1e6),
+                'dur': int(r['wall'] * 1e6),
+                'pid': os.getpid(),
+                'tid': r['thread'],
+                'args': {k: r[k] for k in ['id', 'cpu', 'input_intervals', 'input_bytes',
+                                           'output_intervals', 'output_bytes']}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_trace(), f)
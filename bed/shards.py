@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+"""
+Per-chromosome sharded execution of bedtrace operations.
+
+Chromosomes are independent units in BED data, so inputs are split by
+chromosome, operation is computed for each shard by parallel workers and
+results are concatenated in `sort -k1,1` chromosomes order.
+"""
+import os
+import shutil
+import tempfile
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from bed.io import is_header
+
+# Lines to keep in memory per chromosome before flush to shard file
+BUFFER_LINES = 10000
+
+
+def split(path, folder, prefix):
+    """
+    Splits BED file by chromosome in one pass.
+    :return: {chrom: shard path}
+    """
+    shards = {}
+    buffers = {}
+
+    def flush(chrom):
+        with open(shards[chrom], 'a') as f:
+            f.writelines(buffers[chrom])
+        buffers[chrom] = []
+
+    with open(path) as f:
+        for line in f:
+            if is_header(line):
+                continue
+            chrom = line.split(None, 1)[0]
+            if chrom not in shards:
+                shards[chrom] = os.path.join(
+                    folder, '{}_{}.bed'.format(prefix, len(shards)))
+                buffers[chrom] = []
+            buffers[chrom].append(line if line.endswith('\n') else line + '\n')
+            if len(buffers[chrom]) >= BUFFER_LINES:
+                flush(chrom)
+    for chrom in shards:
+        flush(chrom)
+    return shards
+
+
+def run(evaluate, files, outputs, workers, processes=False, required=None):
+    """
+    Computes operation for each chromosome shard in parallel.
+    :param evaluate: function(shard_files, shard_outputs), picklable in case
+        of processes
+    :param files: input BED files
+    :param outputs: result files, concatenated shard outputs
+    :param workers: max parallel shards
+    :param processes: use processes pool instead of threads
+    :param required: indices of files, which should contain chromosome so
+        that shard result is not empty, e.g. all files for intersection
+    :return: {shard file: original file} mapping
+    """
+    with tempfile.TemporaryDirectory(prefix='bedtraces') as folder:
+        splits = [split(f, folder, i) for i, f in enumerate(files)]
+        chroms = sorted(set().union(*splits))
+        if required is not None:
+            chroms = [c for c in chroms if all(c in splits[i] for i in required)]
+
+        tasks = []
+        for c in chroms:
+            shard_files = []
+            for i, s in enumerate(splits):
+                if c not in s:
+                    # Chromosome is missing, use empty file
+                    s[c] = os.path.join(folder, '{}_empty.bed'.format(i))
+                    open(s[c], 'a').close()
+                shard_files.append(s[c])
+            shard_outputs = [os.path.join(folder, '{}_{}.out'.format(c, j))
+                             for j in range(len(outputs))]
+            tasks.append((shard_files, shard_outputs))
+
+        executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        with executor(max_workers=workers) as pool:
+            for future in [pool.submit(evaluate, *t) for t in tasks]:
+                # Fail fast on errors
+                future.result()
+
+        # Concatenate in sorted chromosomes order
+        for j, output in enumerate(outputs):
+            with open(output, 'w') as out:
+                for _, shard_outputs in tasks:
+                    with open(shard_outputs[j]) as f:
+                        shutil.copyfileobj(f, out)
+
+        return {s[c]: f for s, f in zip(splits, files) for c in s}
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+"""
+Summary statistics of BED files computed in a single pass.
+
+Statistics are stored in a json sidecar file next to the BED file and are
+valid while file size and modification time are the same, so repeated
+requests don't read the file again. Sidecar is not written if the folder
+is read-only.
+"""
+import json
+import os
+from array import array
+
+from bed.io import is_header
+
+SUFFIX = '.stats.json'
+
+
+def sidecar(path):
+    return path + SUFFIX
+
+
+def _quantile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _parse(line):
+    """:return: fields of interval line or None for headers and unparsable rows"""
+    if is_header(line):
+        return None
+    parts = line.split()
+    try:
+        int(parts[1]), int(parts[2])
+    except (IndexError, ValueError):
+        # Header without comment marker, e.g. `chr start end`
+        return None
+    return parts
+
+
+def _coverage(starts, ends):
+    """:return: number of bases covered by intervals given sorted starts and ends"""
+    coverage = 0
+    depth = 0
+    run_start = None
+    j = 0
+    for start in starts:
+        # Adjacent intervals are merged, so starts go before equal ends
+        while ends[j] < start:
+            depth -= 1
+            if depth == 0:
+                coverage += ends[j] - run_start
+            j += 1
+        if depth == 0:
+            run_start = start
+        depth += 1
+    return coverage + ends[-1] - run_start if starts else 0
+
+
+def compute(path):
+    """
+    Reads BED file once, twice if intervals are not sorted by start.
+    :return: dict with
+        lines        number of lines like `wc -l`
+        intervals    number of intervals, i.e. without headers and empty lines
+        columns      number of fields in the first interval
+        bp           total length of intervals
+        coverage     number of bases covered by intervals, overlaps counted once
+        widths       min, q1, median, q3, max and mean interval width
+        chromosomes  {chrom: number of intervals}
+    """
+    lines = 0
+    columns = 0
+    widths = array('q')
+    chroms = {}
+    # Merged intervals are streamed per chromosome: [run start, run end, last start]
+    runs = {}
+    covered = {}
+    unsorted = set()
+    with open(path) as f:
+        for line in f:
+            if line.endswith('\n'):
+                lines += 1
+            parts = _parse(line)
+            if parts is None:
+                continue
+            if not widths:
+                columns = len(parts)
+            chrom, start, end = parts[0], int(parts[1]), int(parts[2])
+            chroms[chrom] = chroms.get(chrom, 0) + 1
+            widths.append(end - start)
+            run = runs.get(chrom)
+            if run is None:
+                runs[chrom] = [start, end, start]
+                covered[chrom] = 0
+            elif start < run[2]:
+                unsorted.add(chrom)
+            elif start > run[1]:
+                covered[chrom] += run[1] - run[0]
+                run[:] = [start, end, start]
+            else:
+                run[1] = max(run[1], end)
+                run[2] = start
+    for chrom, run in runs.items():
+        covered[chrom] += run[1] - run[0]
+
+    if unsorted:
+        # Second pass collects only not sorted chromosomes
+        starts = {c: array('q') for c in unsorted}
+        ends = {c: array('q') for c in unsorted}
+        with open(path) as f:
+            for line in f:
+                parts = _parse(line)
+                if parts is not None and parts[0] in unsorted:
+                    starts[parts[0]].append(int(parts[1]))
+                    ends[parts[0]].append(int(parts[2]))
+        for c in unsorted:
+            covered[c] = _coverage(sorted(starts.pop(c)), sorted(ends.pop(c)))
+
+    bp = sum(widths)
+    widths = sorted(widths)
+    return {
+        'lines': lines,
+        'intervals': len(widths),
+        'columns': columns,
+        'bp': bp,
+        'coverage': sum(covered.values()),
+        'widths': {
+            'min': widths[0],
+            'q1': _quantile(widths, 0.25),
+            'median': _quantile(widths, 0.5),
+            'q3': _quantile(widths, 0.75),
+            'max': widths[-1],
+            'mean': bp / len(widths),
+        } if widths else None,
+        'chromosomes': {c: chroms[c] for c in sorted(chroms)},
+    }
+
+
+def get(path, store=True):
+    """
+    :param store: write computed statistics to sidecar
+    :return: statistics from valid sidecar or computed ones, see compute()
+    """
+    stat = os.stat(path)
+    try:
+        with open(sidecar(path)) as f:
+            cached = json.load(f)
+        if cached['size'] == stat.st_size and \
+                cached['mtime_ns'] == stat.st_mtime_ns:
+            return cached['stats']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    result = compute(path)
+    if not store:
+        return result
+    try:
+        with open(sidecar(path), 'w') as f:
+            json.dump({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                       'stats': result}, f)
+    except OSError:
+        # Read-only folder
+        pass
+    return result
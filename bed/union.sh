@@ -6,15 +6,34 @@
 # - Prints only peaks that exist at least in one file.
 #       4th column indicates tracks, parents of each peak in union.
 #
+# Usage: union.sh [-s] [-m] <FILE>*
+#   -s  files already sorted, merge them without resort
+#   -m  4th column is membership mask instead of labels, i.e. sum of 2^(N-1)
+#       for N-th files, parents of each peak
+#
 # author Oleg Shpynov (oleg.shpynov@jetbrains.com)
 
 which bedtools &>/dev/null || { echo "ERROR: bedtools not found! Download bedTools: <http://code.google.com/p/bedtools/>"; exit 1; }
 >&2 echo "union: $@"
 
+SORTED=NO
+MASK=NO
+while [[ "$1" == "-s" || "$1" == "-m" ]]; do
+    # Files already sorted, skip resort step
+    [[ "$1" == "-s" ]] && SORTED=YES
+    [[ "$1" == "-m" ]] && MASK=YES
+    shift
+done
+
 if [[ $# -eq 0 ]]; then
   echo "ERROR: Empty arguments list"
   exit 1
 fi
+# Mask is exact in awk for 53 bits only
+if [[ "${MASK}" == "YES" && $# -gt 53 ]]; then
+  echo "ERROR: Membership mask supports at most 53 files"
+  exit 1
+fi
 
 # Use temp file since folder can be read-only
 TMP=$(mktemp)
@@ -29,17 +48,43 @@ export TMPDIR=$(type job_tmp_dir &>/dev/null && echo "$(job_tmp_dir)" || echo "/
 mkdir -p "${TMPDIR}"
 
 N=1
+LABELED_FILES=()
 for FILE in $@
 do
     NAME=${FILE##.*/}
-    awk -v OFS='\t' -v N=${N}_${NAME} '{print $1,$2,$3,N}' ${FILE} >> ${TMP}
+    if [[ "${SORTED}" == "YES" ]]; then
+        LABELED=$(mktemp)
+        LABELED_FILES+=("$LABELED")
+    else
+        LABELED=${TMP}
+    fi
+    if [[ "${MASK}" == "YES" ]]; then
+        LABEL=${N}
+    else
+        LABEL=${N}_${NAME}
+    fi
+    awk -v OFS='\t' -v N=${LABEL} '{print $1,$2,$3,N}' ${FILE} >> ${LABELED}
     N=$((N+1))
 done
 
-SORTED=$(mktemp)
-sort -k1,1 -k2,2n -T ${TMPDIR} ${TMP} > ${SORTED}
-bedtools merge -i ${SORTED} -c 4 -o distinct -delim "|"
+SORTED_TMP=$(mktemp)
+if [[ "${SORTED}" == "YES" ]]; then
+    # Merge sorted files in linear time
+    LC_ALL=C sort -m -k1,1 -k2,2n -T ${TMPDIR} "${LABELED_FILES[@]}" > ${SORTED_TMP}
+    rm "${LABELED_FILES[@]}"
+else
+    LC_ALL=C sort -k1,1 -k2,2n -T ${TMPDIR} ${TMP} > ${SORTED_TMP}
+    rm ${TMP}
+fi
+if [[ "${MASK}" == "YES" ]]; then
+    bedtools merge -i ${SORTED_TMP} -c 4 -o distinct -delim "|" |\
+        awk -v OFS='\t' '{ n = split($4, I, "|"); M = 0;
+            for (i = 1; i <= n; i++) { M += 2 ^ (I[i] - 1) };
+            printf("%s\t%s\t%s\t%.0f\n", $1, $2, $3, M) }'
+else
+    bedtools merge -i ${SORTED_TMP} -c 4 -o distinct -delim "|"
+fi
 
 # Cleanup
-rm ${TMP} ${SORTED}
+rm ${SORTED_TMP}
 type clean_job_tmp_dir &>/dev/null && clean_job_tmp_dir
\ No newline at end of file
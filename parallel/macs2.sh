@@ -8,9 +8,16 @@ which macs2 &>/dev/null || { echo "ERROR: MACS2 not found! Download MACS2: <http
 source ${WASHU_ROOT}/parallel/util.sh
 
 >&2 echo "Batch macs2 $@"
+# Sweep mode: peaks for several cutoffs from single callpeak pileup, see scripts/macs2_sweep.sh
+SWEEP=""
+if [[ "$1" == "--sweep" ]]; then
+    SWEEP=$2
+    shift 2
+fi
 if [[ $# -lt 5 ]]; then
-    echo "Need 5 parameters! <genome> <chrom.sizes> <suffix> <params_str> <work_dir> [<work_dir>]*"
+    echo "Need 5 parameters! [--sweep <cutoffs>] <genome> <chrom.sizes> <suffix> <params_str> <work_dir> [<work_dir>]*"
     echo "if <chrom.sizes> file not specified (NONE), no signal will be created"
+    echo "--sweep: comma separated q<qvalue>, p<pvalue> or broad_<qvalue> cutoffs, <params_str> should contain -B"
     exit 1
 fi
 
@@ -32,9 +39,12 @@ for WORK_DIR in ${WORK_DIRS}; do :
     WORK_DIR_NAME=${WORK_DIR##*/}
     cd ${WORK_DIR}
 
-    for FILE in $(find . -name '*.bam' | sed 's#\./##g' | grep -v 'input')
+    FILES=$(find . -name '*.bam' | sed 's#\./##g' | grep -v 'input')
+    # Match inputs for all the files at once, see util.sh find_inputs
+    find_inputs ${FILES}
+    for FILE in ${FILES}
     do :
-        INPUT=$(python ${WASHU_ROOT}/scripts/util.py find_input ${WORK_DIR}/${FILE})
+        INPUT=$(input_of ${FILE})
         echo "${FILE}: control file: ${INPUT}"
 
         NAME=${FILE%%.bam} # file name without extension
@@ -72,6 +82,10 @@ else
     echo "${FILE}: no control file"
     macs2 callpeak --tempdir \${TMPDIR} -t ${FILE} -g ${SPECIES} -n ${ID} ${PARAMS}
 fi
+
+if [[ -n "${SWEEP}" ]]; then
+    bash ${WASHU_ROOT}/scripts/macs2_sweep.sh ${ID} ${NAME} ${SWEEP}
+fi
 SCRIPT
 
             echo "FILE: ${WORK_DIR_NAME}/${FILE}; TASK: ${QSUB_ID}"
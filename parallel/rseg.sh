@@ -40,12 +40,15 @@ if [[ ! -f ${DEADZONES} ]]; then
 fi
 
 TASKS=()
-for FILE in $(find . -name '*.bam' | sed 's#\./##g' | grep -v 'input')
+FILES=$(find . -name '*.bam' | sed 's#\./##g' | grep -v 'input')
+# Match inputs for all the files at once, see util.sh find_inputs
+find_inputs ${FILES}
+for FILE in ${FILES}
 do :
     NAME=${FILE%%.bam} # file name without extension
     FILE_BED=${NAME}.bed
 
-    INPUT=$(python ${WASHU_ROOT}/scripts/util.py find_input ${WORK_DIR}/${FILE})
+    INPUT=$(input_of ${FILE})
     echo "${FILE} input: ${INPUT}"
     INPUT_BED=${INPUT%%.bam}.bed
 
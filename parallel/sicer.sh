@@ -47,7 +47,10 @@ fi
 cd ${WORK_DIR}
 
 TASKS=()
-for FILE in $(find . -name '*.bam' | sed 's#\./##g' | grep -v 'input')
+FILES=$(find . -name '*.bam' | sed 's#\./##g' | grep -v 'input')
+# Match inputs for all the files at once, see util.sh find_inputs
+find_inputs ${FILES}
+for FILE in ${FILES}
 do :
     NAME=${FILE%%.bam} # file name without extension
     ID=${NAME}_F${FRAGMENT_SIZE}_W${WINDOW_SIZE}_G${GAP_SIZE}_FDR${FDR}
@@ -57,7 +60,7 @@ do :
     PEAKS_FILE=$(find . -name "${NAME}-W${WINDOW_SIZE}-G${GAP_SIZE}-FDR${FDR}*island*")
     if [[ -z "${PEAKS_FILE}" ]]; then
         FILE_BED=${NAME}.bed # It is used for results naming
-        INPUT=$(python ${WASHU_ROOT}/scripts/util.py find_input ${WORK_DIR}/${FILE})
+        INPUT=$(input_of ${FILE})
         echo "${FILE} input: ${INPUT}"
         INPUT_BED=${INPUT/.bam/.bed}
 
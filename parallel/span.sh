@@ -42,9 +42,12 @@ fi
 cd ${WORK_DIR}
 
 TASKS=()
-for FILE in $(find . -name '*.bam' | sed 's#\./##g' | grep -v 'input')
+FILES=$(find . -name '*.bam' | sed 's#\./##g' | grep -v 'input')
+# Match inputs for all the files at once, see util.sh find_inputs
+find_inputs ${FILES}
+for FILE in ${FILES}
 do :
-    INPUT=$(python ${WASHU_ROOT}/scripts/util.py find_input ${WORK_DIR}/${FILE})
+    INPUT=$(input_of ${FILE})
     echo "${FILE}: control file: ${INPUT}"
 
     NAME=${FILE%%.bam} # file name without extension
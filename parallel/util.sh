@@ -6,50 +6,70 @@ type module &>/dev/null || module() { echo "[mock] module $@"; }
 
 # CHPC (qsub) mock replacement
 if which qsub &>/dev/null; then
-    # Use function to get rid of command substitution.
-    # Command substitution doesn't work well with parallel execution.
-    run_parallel()
-    {
-        # LOAD args to $CMD
-        CMD=""
-        while read -r line; do CMD+=$line; CMD+=$'\n'; done;
-        # Return through global variable here, because we can't use command substitution.
-        QSUB_ID=$(qsub <<< "$CMD")
-    }
+    if [[ -n $WASHU_QSUB_ARRAY ]]; then
+        # Tasks are submitted by scripts/job_tracker.py in wait_complete,
+        # tasks with the same resources are submitted as a single array job.
+        # NOTE: QSUB_ID is a task file, not a job id
+        QSUB_TASKS=()
 
-    # Small procedure to wait until all the tasks are finished on the qsub cluster
-    # Example of usage: wait_complete $TASKS, where $TASKS is a task ids returned by qsub.
-    wait_complete()
-    {
-        echo "Waiting for tasks..."
-        for TASK in $@
-        do :
-            echo -n "TASK: $TASK"
-            # The task id is actually the first numbers in the string
-            TASK_ID=$(echo ${TASK} | sed -e "s/\([0-9]*\).*/\1/")
-            if [[ ! -z "$TASK_ID" ]]; then
-                while qstat ${TASK_ID} &> /dev/null; do
-                    echo -n "."
-                    sleep 100
-                done;
+        run_parallel()
+        {
+            # LOAD args to $CMD
+            CMD=""
+            while read -r line; do CMD+=$line; CMD+=$'\n'; done;
+            QSUB_FILE=$(mktemp "${TMPDIR:-/tmp/}qsub.XXXXXXXXXXXX")
+            echo "$CMD" > ${QSUB_FILE}
+            QSUB_TASKS+=(${QSUB_FILE})
+            # Return through global variable here, because we can't use command substitution.
+            QSUB_ID=${QSUB_FILE}
+        }
+
+        # Submits all the collected tasks and waits until they are finished,
+        # stops the world if submission or tracking failed
+        wait_complete()
+        {
+            echo "Waiting for tasks..."
+            if [[ ${#QSUB_TASKS[@]} -gt 0 ]]; then
+                python ${WASHU_ROOT}/scripts/job_tracker.py run "${QSUB_TASKS[@]}"
+                STATUS=$?
+                rm -f "${QSUB_TASKS[@]}"
+                QSUB_TASKS=()
+                [[ ${STATUS} -eq 0 ]] || { echo "ERROR: tasks tracking failed"; exit 1; }
             fi
-            echo
-        done
-        echo "Done. Waiting for tasks"
-    }
+            echo "Done. Waiting for tasks"
+        }
+    else
+        # Use function to get rid of command substitution.
+        # Command substitution doesn't work well with parallel execution.
+        run_parallel()
+        {
+            # LOAD args to $CMD
+            CMD=""
+            while read -r line; do CMD+=$line; CMD+=$'\n'; done;
+            # Return through global variable here, because we can't use command substitution.
+            QSUB_ID=$(qsub <<< "$CMD")
+        }
+
+        # Small procedure to wait until all the tasks are finished on the qsub cluster
+        # Example of usage: wait_complete $TASKS, where $TASKS is a task ids returned by qsub.
+        # All the tasks are tracked by a single qstat query, see scripts/job_tracker.py
+        wait_complete()
+        {
+            echo "Waiting for tasks..."
+            python ${WASHU_ROOT}/scripts/job_tracker.py wait $@ ||\
+                { echo "ERROR: tasks tracking failed"; exit 1; }
+            echo "Done. Waiting for tasks"
+        }
+    fi
 else
     if [[ -z $WASHU_PARALLELISM ]]; then
         WASHU_PARALLELISM=8
     fi
     >&2 echo "Local tasks WASHU_PARALLELISM=$WASHU_PARALLELISM"
 
-    # Local qsub emulation
-    qsub()
+    # Creates task file ${QSUB_FILE} for script ${CMD}, ${LOG} is set to its #PBS -o log
+    qsub_file()
     {
-        # LOAD args to $CMD
-        CMD=""
-        while read -r line; do CMD+=$line; CMD+=$'\n'; done;
-
         # MacOS cannot handle XXXX template with ".sh" suffix, also --suffix
         # option not available in BSD mktemp, so let's do some hack
         QSUB_FILE_PREFIX=$(mktemp "${TMPDIR:-/tmp/}qsub.XXXXXXXXXXXX")
@@ -60,28 +80,72 @@ else
         echo 'type module &>/dev/null || module() { echo "[mock] module $@"; }' >> $QSUB_FILE
         echo "$CMD" >> $QSUB_FILE
         LOG=$(echo "$CMD" | grep "#PBS -o" | sed 's/#PBS -o //g')
-        >&2 echo "LOCAL running TASK: ${QSUB_FILE} LOG: $LOG"
-        # Redirect both stderr and stdout to LOG file, don't use output, since we use [run_parallel]
-        bash $QSUB_FILE &> "$LOG" &
     }
 
-    run_parallel()
+    # Local qsub emulation
+    qsub()
     {
-        # Wait until less then $WASHU_PARALLELISM tasks running
-        while [[ $(jobs | wc -l) -ge $WASHU_PARALLELISM ]] ; do sleep 1 ; done
-
         # LOAD args to $CMD
         CMD=""
         while read -r line; do CMD+=$line; CMD+=$'\n'; done;
-        qsub <<< "$CMD"
+        qsub_file
+        >&2 echo "LOCAL running TASK: ${QSUB_FILE} LOG: $LOG"
+        # Redirect both stderr and stdout to LOG file, don't use output, since we use [run_parallel]
+        bash $QSUB_FILE &> "$LOG" &
     }
 
-    wait_complete()
-    {
-        echo "LOCAL waiting for tasks..."
-        wait
-        echo "Done. LOCAL waiting for tasks"
-    }
+    if [[ -n $WASHU_LOCAL_EXECUTOR ]]; then
+        # Tasks are collected and started by scripts/executor.py in wait_complete
+        # within machine cpus and memory, according to their #PBS -l ppn and vmem
+        LOCAL_TASKS=()
+
+        run_parallel()
+        {
+            # LOAD args to $CMD
+            CMD=""
+            while read -r line; do CMD+=$line; CMD+=$'\n'; done;
+            qsub_file
+            >&2 echo "LOCAL submitted TASK: ${QSUB_FILE} LOG: $LOG"
+            LOCAL_TASKS+=(${QSUB_FILE})
+            QSUB_ID=${QSUB_FILE}
+        }
+
+        wait_complete()
+        {
+            echo "LOCAL waiting for tasks..."
+            # Exit status of each task is saved to status file, see scripts/executor.py
+            LOCAL_STATUS=$(mktemp "${TMPDIR:-/tmp/}executor.XXXXXXXXXXXX")
+            python ${WASHU_ROOT}/scripts/executor.py --max-tasks ${WASHU_PARALLELISM} \
+                --status ${LOCAL_STATUS} "${LOCAL_TASKS[@]}"
+            STATUS=$?
+            LOCAL_TASKS=()
+            if [[ ${STATUS} -ne 0 ]]; then
+                echo "ERROR: tasks failed, status: ${LOCAL_STATUS}"
+                awk -F '\t' 'NR > 1 && $5 != 0' ${LOCAL_STATUS}
+                exit 1
+            fi
+            rm ${LOCAL_STATUS}
+            echo "Done. LOCAL waiting for tasks"
+        }
+    else
+        run_parallel()
+        {
+            # Wait until less then $WASHU_PARALLELISM tasks running
+            while [[ $(jobs | wc -l) -ge $WASHU_PARALLELISM ]] ; do sleep 1 ; done
+
+            # LOAD args to $CMD
+            CMD=""
+            while read -r line; do CMD+=$line; CMD+=$'\n'; done;
+            qsub <<< "$CMD"
+        }
+
+        wait_complete()
+        {
+            echo "LOCAL waiting for tasks..."
+            wait
+            echo "Done. LOCAL waiting for tasks"
+        }
+    fi
 fi
 
 # Checks for errors in logs, stops the world
@@ -193,4 +257,21 @@ function pileup(){
         fi
     fi
     echo "${RESULT}"
-}
\ No newline at end of file
+}
+
+# Finds inputs for all the given BAM files at once, see util.py find_inputs
+# Stores tab separated table: file, input file name or empty string in INPUTS_TABLE,
+# use input_of to look up input of the file. Plain variable works with bash 3.2 on MacOS.
+function find_inputs(){
+    INPUTS_TABLE=""
+    if [[ $# -eq 0 ]]; then
+        return 0
+    fi
+    INPUTS_TABLE=$(python ${WASHU_ROOT}/scripts/util.py find_inputs "$@") ||\
+        { echo "ERROR: inputs matching failed"; exit 1; }
+}
+
+# Prints input file name for the file from last find_inputs call or empty string
+function input_of(){
+    awk -F'\t' -v file="$1" '$1 == file { print $2; exit }' <<< "${INPUTS_TABLE}"
+}
@@ -20,7 +20,7 @@ NOTE: python3 required
 author oleg.shpynov@jetbrains.com
 """
 from pipeline_utils import *
-from scripts.util import run_macs2
+from scripts.util import run_macs2_sweep
 
 parser = argparse.ArgumentParser(description='ULI ChIP-Seq data pipeline')
 parser.add_argument('path_to_directory', action=WritableDirectory, type=str,
@@ -34,7 +34,7 @@ args = parser.parse_args()
 #################
 # Configuration #
 #################
-WORK_DIR = args.path_to_directory.rstrip('/')
+WORK_DIR = os.path.abspath(args.path_to_directory.rstrip('/'))
 GENOME = args.genome
 INDEXES = os.path.join(args.path_to_indexes, GENOME)
 CHROM_SIZES = os.path.join(INDEXES, GENOME + ".chrom.sizes")
@@ -54,89 +54,96 @@ print("SPAN:", SPAN)
 ##################
 # Pipeline start #
 ##################
-run_bash("parallel/index_genome.sh", GENOME, INDEXES)
-
-# Batch QC
-run_bash("parallel/fastqc.sh", WORK_DIR)
-# multiqc
-subprocess.run("multiqc -f " + WORK_DIR, shell=True)
-
-# Batch Bowtie with trim 5 first base pairs
-run_bash("parallel/index_bowtie.sh", GENOME, INDEXES)
-run_bash("parallel/bowtie.sh", GENOME, INDEXES, "5", WORK_DIR)
-move_forward(WORK_DIR, WORK_DIR + "_bams", ["*.bam", "*bowtie*.log"])
-# multiqc
-subprocess.run("multiqc -f " + WORK_DIR + "_bams", shell=True)
-
-WORK_DIR = WORK_DIR + "_bams"
-os.chdir(WORK_DIR)
-
-# Batch BigWig visualization
-run_bash("parallel/bigwig.sh", CHROM_SIZES, WORK_DIR)
-move_forward(WORK_DIR, WORK_DIR + "_bws", ["*.bw", "*.bdg", "*bw.log"])
-
-# QC PBC/NRF + PhantomPeakQualTools metrics for BAMs
-run_bash("parallel/bam_qc.sh", PHANTOMPEAKQUALTOOLS, WORK_DIR)
-move_forward(WORK_DIR, WORK_DIR + "/qc", ["*.pdf", "*phantom.tsv", "*pbc_nrf.tsv", "*bam_qc*"])
-
-# Remove duplicates
-run_bash("parallel/remove_duplicates.sh", PICARD_TOOLS, WORK_DIR)
-move_forward(WORK_DIR, WORK_DIR + "_unique",
-             ["*_unique*", "*_metrics.txt", "*duplicates.log"])
-
-# Batch subsampling to 15mln reads
-# READS = 15
-# run_bash("subsample.sh", WORK_DIR, str(READS))
-# WORK_DIR = move_forward(WORK_DIR, WORK_DIR + "_{}mln".format(READS),
-#                         ["*{}*".format(READS)])
-
-########################
-# Peak calling section #
-########################
-
-# MACS2 Broad peak calling. Default: Q=0.1
-run_macs2(GENOME, CHROM_SIZES, 'broad_0.1', '--broad', '--broad-cutoff',
-          0.1, work_dirs=[WORK_DIR])
-
-# MACS2 Regular peak calling. Default: Q=0.05
-run_macs2(GENOME, CHROM_SIZES, 'q0.05', '-q', 0.05, work_dirs=[WORK_DIR])
-
-# MACS1.4 P=1e-5 is default
-# P = 0.00001
-# NAME = '14_p{}'.format(P)
-# FOLDER = '{}_macs_{}'.format(WORK_DIR, NAME)
-# print(FOLDER)
-# if not os.path.exists(FOLDER):
-#     run_bash("macs14.sh", WORK_DIR, GENOME, str(P))
-#     move_forward(WORK_DIR, FOLDER, ['*{}*'.format(NAME), '*rip.csv'],
-#                  chdir=False)
-
-# Batch RSEG
-rseg_suffix = '_rseg'
-if not os.path.exists(WORK_DIR + rseg_suffix):
-    run_bash("parallel/rseg.sh", WORK_DIR, GENOME, CHROM_SIZES)
-    move_forward(WORK_DIR, WORK_DIR + rseg_suffix,
-                 ['*domains*', '*rseg*', '*.bam.bed', 'deadzones*',
-                  '*_chrom_sizes.bed', '*rip.csv'])
-    # multiqc
-    subprocess.run("multiqc " + WORK_DIR + rseg_suffix, shell=True)
-
-# Batch SICER
-sicer_suffix = '_sicer'
-if not os.path.exists(WORK_DIR + sicer_suffix):
+# Stages are run as soon as their inputs are ready, independent ones concurrently.
+# Scripts write intermediate files and check all the logs in working folder, so stages
+# reading the same folder, e.g. BAMS, work in their own folders with input files linked,
+# see Stage link and work_folder.
+BAMS = WORK_DIR + "_bams"
+BAM_FILES = ["*.bam", "*.bai"]
+
+STAGES = [
+    Stage('index_genome', "parallel/index_genome.sh", (GENOME, INDEXES)),
+
+    # Batch QC
+    Stage('fastqc', "parallel/fastqc.sh", (work_folder(WORK_DIR, 'fastqc'),),
+          inputs=[WORK_DIR], outputs=[WORK_DIR + "_fastqc"],
+          move=["fastqc", "*_fastqc.log", "multiqc*"], link=["*.f*q", "*.f*q.gz"]),
+
+    # Batch Bowtie with trim 5 first base pairs
+    Stage('index_bowtie', "parallel/index_bowtie.sh", (GENOME, INDEXES),
+          after=['index_genome']),
+    Stage('bowtie', "parallel/bowtie.sh", (GENOME, INDEXES, "5", WORK_DIR),
+          inputs=[WORK_DIR], outputs=[BAMS], move=["*.bam", "*bowtie*.log"],
+          after=['index_bowtie'], multiqc=[BAMS]),
+
+    # Batch BigWig visualization
+    Stage('bigwig', "parallel/bigwig.sh", (CHROM_SIZES, work_folder(BAMS, 'bigwig')),
+          inputs=[BAMS], outputs=[BAMS + "_bws"], move=["*.bw", "*.bdg", "*bw.log"],
+          link=BAM_FILES),
+
+    # QC PBC/NRF + PhantomPeakQualTools metrics for BAMs
+    Stage('bam_qc', "parallel/bam_qc.sh", (PHANTOMPEAKQUALTOOLS, work_folder(BAMS, 'bam_qc')),
+          inputs=[BAMS], outputs=[BAMS + "/qc"],
+          move=["*.pdf", "*phantom.tsv", "*pbc_nrf.tsv", "*bam_qc*"], link=BAM_FILES),
+
+    # Remove duplicates
+    Stage('remove_duplicates', "parallel/remove_duplicates.sh",
+          (PICARD_TOOLS, work_folder(BAMS, 'remove_duplicates')),
+          inputs=[BAMS], outputs=[BAMS + "_unique"],
+          move=["*_unique*", "*_metrics.txt", "*duplicates.log"], link=BAM_FILES),
+
+    # Batch subsampling to 15mln reads
+    # READS = 15
+    # run_bash("subsample.sh", WORK_DIR, str(READS))
+    # WORK_DIR = move_forward(WORK_DIR, WORK_DIR + "_{}mln".format(READS),
+    #                         ["*{}*".format(READS)])
+
+    ########################
+    # Peak calling section #
+    ########################
+
+    # MACS2 Broad peak calling Q=0.1 and Regular peak calling Q=0.05
+    # from the same pileup and control lambda.
+    # Results are named after BAMS and only files created by MACS2 are moved, so it is
+    # the only stage working in BAMS itself
+    Stage('macs2', action=lambda: run_macs2_sweep(GENOME, CHROM_SIZES, ['broad_0.1', 'q0.05'],
+                                                  work_dirs=[BAMS]),
+          inputs=[BAMS], outputs=[BAMS + "_macs2_broad_0.1", BAMS + "_macs2_q0.05"]),
+
+    # MACS1.4 P=1e-5 is default
+    # P = 0.00001
+    # NAME = '14_p{}'.format(P)
+    # FOLDER = '{}_macs_{}'.format(WORK_DIR, NAME)
+    # print(FOLDER)
+    # if not os.path.exists(FOLDER):
+    #     run_bash("macs14.sh", WORK_DIR, GENOME, str(P))
+    #     move_forward(WORK_DIR, FOLDER, ['*{}*'.format(NAME), '*rip.csv'],
+    #                  chdir=False)
+
+    # Batch RSEG
+    Stage('rseg', "parallel/rseg.sh", (work_folder(BAMS, 'rseg'), GENOME, CHROM_SIZES),
+          inputs=[BAMS], outputs=[BAMS + "_rseg"],
+          move=['*domains*', '*rseg*', '*.bam.bed', 'deadzones*', '*_chrom_sizes.bed',
+                '*rip.csv'],
+          multiqc=[BAMS + "_rseg"], link=BAM_FILES),
+
+    # Batch SICER
     # <work_dir> <genome> <chrom.sizes> <FDR> [window size (bp)] [fragment size] [gap size (bp)] # nopep8
-    run_bash("parallel/sicer.sh", WORK_DIR, GENOME, CHROM_SIZES, "0.01", "200", "150", "600")
-    move_forward(WORK_DIR, WORK_DIR + sicer_suffix,
-                 ['*sicer.log', '*-W*-G*-islands-summary-FDR*',
-                  '*-W*-G*-E*.scoreisland', '*rip.csv'])
-    # multiqc
-    subprocess.run("multiqc " + WORK_DIR + sicer_suffix, shell=True)
-
-# Batch SPAN
-span_suffix = '_span'
-if not os.path.exists(WORK_DIR + span_suffix):
-    os.mkdir(WORK_DIR + span_suffix)
+    Stage('sicer', "parallel/sicer.sh",
+          (work_folder(BAMS, 'sicer'), GENOME, CHROM_SIZES, "0.01", "200", "150", "600"),
+          inputs=[BAMS], outputs=[BAMS + "_sicer"],
+          move=['*sicer.log', '*-W*-G*-islands-summary-FDR*', '*-W*-G*-E*.scoreisland',
+                '*rip.csv'],
+          multiqc=[BAMS + "_sicer"], link=BAM_FILES),
+
+    # Batch SPAN
     #  <SPAN_JAR_PATH> <WORK_DIR> <GENOME> <CHROM_SIZES> [<BIN> <Q> <GAP> <OUTPUT_DIR>]
-    run_bash("parallel/span.sh", SPAN, WORK_DIR, GENOME, CHROM_SIZES,
-             "200", "0.1", "5", WORK_DIR + span_suffix)
-    move_forward(WORK_DIR, WORK_DIR + span_suffix, ['*.peak', '*span*.log'])
+    Stage('span', "parallel/span.sh",
+          (SPAN, work_folder(BAMS, 'span'), GENOME, CHROM_SIZES, "200", "0.1", "5",
+           BAMS + "_span"),
+          action=lambda: os.makedirs(BAMS + "_span", exist_ok=True),
+          inputs=[BAMS], outputs=[BAMS + "_span"], move=['*.peak', '*span*.log'],
+          link=BAM_FILES),
+]
+
+run_stages(STAGES)
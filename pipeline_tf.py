@@ -9,7 +9,7 @@ from typing import Tuple, List
 import pandas as pd
 
 from pipeline_utils import *
-from scripts.util import run_macs2
+from scripts.util import run_macs2_sweep
 
 
 def cli():
@@ -64,30 +64,19 @@ def run_pipeline(out, data):
     ##################
     # Pipeline start #
     ##################
-
-    # Download SRA data:
-    # 'rsync' here skips file if it already exist
-    print("Downloading data...")
-    srx_to_dir_list = []
-    for gsmid in gsm_to_process:
-        sra_dir = os.path.join(out, gsmid, "sra")
-        srxs = gsm2srxs[gsmid]
-        for srx in srxs:
-            srx_to_dir_list.extend([srx, sra_dir])
-
-    run_bash("scripts/geo_rsync.sh", *srx_to_dir_list)
-
-    # Fastq-dump SRA data:
-    run_bash("parallel/fastq_dump.sh", *data_dirs)
-
-    # Prepare genome *.fa and Bowtie indexes
+    # Each sample advances to its next stage as soon as its own previous
+    # stages are finished, without waiting for the whole batch, see run_stages()
     print("Genomes and indices folder: ", indexes)
-    run_bash("parallel/index_genome.sh", genome, indexes)
-    run_bash("parallel/index_bowtie2.sh", genome, indexes)
-    # run_bash("index_bowtie.sh", genome, indexes)
-
-    # Batch QC
-    run_bash("parallel/fastqc.sh", *data_dirs)
+    stages = [
+        # Prepare genome *.fa and Bowtie indexes
+        Stage('index_genome', "parallel/index_genome.sh", (genome, indexes)),
+        Stage('index_bowtie2', "parallel/index_bowtie2.sh", (genome, indexes),
+              after=['index_genome']),
+        # Stage('index_bowtie', "parallel/index_bowtie.sh", (genome, indexes)),
+    ]
+    for gsmid, data_dir in zip(gsm_to_process, data_dirs):
+        stages.extend(sample_stages(gsmid, data_dir, gsm2srxs[gsmid], genome,
+                                    indexes, chrom_sizes, picard_tools))
 
     # Total multiqc:
     # Use -s options, otherwise tons of "SRRnnn" hard to distinguish
@@ -95,64 +84,95 @@ def run_pipeline(out, data):
     #                      file name)
     # -f, --force          Overwrite any existing reports
     # -o, --outdir TEXT    Create report in the specified output directory.
-    # if len(data_dirs) > 1:
-    #     run("multiqc", "-f", "-o", out, " ".join(data_dirs))
-    #
-    # XXX: let's look in multiqc results, it shows that in several samples
-    # it's better to trim first 5bp, so let's trim it in all samples for
-    # simplicity:
-    #
-
-    # Alignment step:
-    def process_sra(sra_dirs):
-        #  * batch Bowtie with trim 5 first base pairs
-        run_bash("parallel/bowtie2.sh", genome, indexes, "5", *sra_dirs)
-
-        # Merge TF SRR*.bam files to one
-        run_bash("parallel/samtools_merge.sh", genome, *sra_dirs)
+    bams_dirs = [data_dir + "_bams" for data_dir in data_dirs]
+    if len(data_dirs) > 1:
+        stages.append(Stage(
+            'multiqc',
+            action=lambda: run("multiqc", "-f", "-o", out, " ".join(data_dirs + bams_dirs)),
+            after=['bowtie_' + gsmid for gsmid in gsm_to_process]))
 
-    bams_dirs = process_dirs(data_dirs, "_bams", ["*.bam", "*bowtie*.log"],
-                             process_sra)
-    for bams_dir in bams_dirs:
-        # multiqc is able to process Bowtie report
-        run("multiqc", "-f", "-o", bams_dir, " ".join(bams_dirs))
+    # Call PEAKS:
+    # Bedtools is necessary for filter script
+    subprocess.run('module load bedtools2', shell=True)
+    for r in data_table.itertuples():
+        stages.append(peak_calling_stage(out, r.signal, r.input if r.input != "-" else None,
+                                         genome, chrom_sizes))
 
-    if len(data_dirs) > 1:
-        run("multiqc", "-f", "-o", out, " ".join(data_dirs + bams_dirs))
+    run_stages(stages)
 
-    # XXX: doesn't work for some reason, "filter by -f66" returns nothing
-    # Process insert size of BAM visualization
-    # run_bash("fragments.sh", *bams_dirs)
 
-    # Batch BigWig visualization
-    process_dirs(bams_dirs, "_bws", ["*.bw", "*.bdg", "*bw.log"],
-                 lambda dirs: run_bash("parallel/bigwig.sh", chrom_sizes,
-                                       *dirs))
+def sample_stages(gsmid, data_dir, srxs, genome, indexes, chrom_sizes, picard_tools):
+    """:return: stages of single sample from download to duplicates removal"""
+    bams_dir = data_dir + "_bams"
 
-    # Batch RPKM visualization
-    process_dirs(bams_dirs, "_rpkms", ["*.bw", "*rpkm.log"],
-                 lambda dirs: run_bash("parallel/rpkm.sh", *dirs))
+    # Download SRA data:
+    # 'rsync' here skips file if it already exist
+    sra_dir = os.path.join(data_dir, "sra")
+    srx_to_dir_list = []
+    for srx in srxs:
+        srx_to_dir_list.extend([srx, sra_dir])
 
-    # Remove duplicates
-    process_dirs(bams_dirs, "_unique",
-                 ["*_unique*", "*_metrics.txt", "*duplicates.log"],
-                 lambda dirs: run_bash("parallel/remove_duplicates.sh",
-                                       picard_tools, *dirs))
+    # Alignment step:
+    def process_sra():
+        #  * batch Bowtie with trim 5 first base pairs
+        run_bash("parallel/bowtie2.sh", genome, indexes, "5", data_dir)
 
-    # Call PEAKS:
-    files_to_cleanup = []
-    try:
-        # let's link signal bams with corresponding input:
-        bams_dirs_for_peakcalling = []
-        for r in data_table.itertuples():
-            gsmid_signal = r.signal
-            bams_dir_signal = os.path.join(out, gsmid_signal + "_bams")
-
-            # if input defined
-            if r.input != "-":
-                gsmid_input = r.input
-                bams_dir_input = os.path.join(out, gsmid_input + "_bams")
+        # Merge TF SRR*.bam files to one
+        run_bash("parallel/samtools_merge.sh", genome, data_dir)
 
+    # XXX: let's look in multiqc results, it shows that in several samples
+    # it's better to trim first 5bp, so let's trim it in all samples for
+    # simplicity.
+    #
+    # XXX: "parallel/fragments.sh" doesn't work for some reason, "filter by -f66"
+    # returns nothing
+    #
+    # BigWig, RPKM visualization and duplicates removal write results into
+    # the same folder, so they are processed one after another
+    return [
+        Stage('download_' + gsmid, "scripts/geo_rsync.sh", srx_to_dir_list),
+        # Fastq-dump SRA data:
+        Stage('fastq_dump_' + gsmid, "parallel/fastq_dump.sh", (data_dir,),
+              after=['download_' + gsmid]),
+        # Batch QC
+        Stage('fastqc_' + gsmid, "parallel/fastqc.sh", (data_dir,),
+              after=['fastq_dump_' + gsmid]),
+        # multiqc is able to process Bowtie report.
+        # FastQC checks logs in the same folder, so alignment waits for it
+        Stage('bowtie_' + gsmid, action=process_sra,
+              inputs=[data_dir], outputs=[bams_dir], move=["*.bam", "*bowtie*.log"],
+              after=['fastqc_' + gsmid, 'index_bowtie2'], multiqc=[bams_dir]),
+        # Batch BigWig visualization
+        Stage('bigwig_' + gsmid, "parallel/bigwig.sh", (chrom_sizes, bams_dir),
+              inputs=[bams_dir], outputs=[bams_dir + "_bws"],
+              move=["*.bw", "*.bdg", "*bw.log"]),
+        # Batch RPKM visualization
+        Stage('rpkm_' + gsmid, "parallel/rpkm.sh", (bams_dir,),
+              inputs=[bams_dir], outputs=[bams_dir + "_rpkms"], move=["*.bw", "*rpkm.log"],
+              after=['bigwig_' + gsmid]),
+        # Remove duplicates
+        Stage('remove_duplicates_' + gsmid, "parallel/remove_duplicates.sh",
+              (picard_tools, bams_dir),
+              inputs=[bams_dir], outputs=[bams_dir + "_unique"],
+              move=["*_unique*", "*_metrics.txt", "*duplicates.log"],
+              after=['rpkm_' + gsmid]),
+    ]
+
+
+def peak_calling_stage(out, gsmid_signal, gsmid_input, genome, chrom_sizes):
+    """:return: stage calling peaks of signal sample with optional input sample"""
+    bams_dir_signal = os.path.join(out, gsmid_signal + "_bams")
+    bams_dir_input = None
+    after = ['remove_duplicates_' + gsmid_signal]
+    if gsmid_input is not None:
+        bams_dir_input = os.path.join(out, gsmid_input + "_bams")
+        after.append('remove_duplicates_' + gsmid_input)
+
+    def call_peaks():
+        files_to_cleanup = []
+        try:
+            # let's link signal bams with corresponding input:
+            if bams_dir_input is not None:
                 # Find all input *.bam and *.bam.bai
                 input_files = [f for f in os.listdir(bams_dir_input)
                                if f.endswith(".bam") or f.endswith(".bam.bai")]
@@ -163,56 +183,23 @@ def run_pipeline(out, data):
                     run("ln", "-s", os.path.join(bams_dir_input, f), f_link)
                     files_to_cleanup.append(f_link)
 
-            bams_dirs_for_peakcalling.append(bams_dir_signal)
-
-        ########################
-        # Peak calling section #
-        ########################
-        # Bedtools is necessary for filter script
-        subprocess.run('module load bedtools2', shell=True)
-
-        fpeaks_and_bams_dirs = []
-
-        # MACS2 Broad peak calling (https://github.com/taoliu/MACS) Q=0.1
-        #  in example
-        run_macs2(genome, chrom_sizes,
-                  'broad_0.1', '--broad', '--broad-cutoff', 0.1,
-                  work_dirs=bams_dirs_for_peakcalling)
-
-        # # MACS2 Regular peak calling (https://github.com/taoliu/MACS)
-        # # Q=0.01 in example
-        run_macs2(genome, chrom_sizes, 'q0.1', '-q', 0.1, work_dirs=bams_dirs_for_peakcalling)
-    finally:
-        for f in files_to_cleanup:
-            print("Cleanup:")
-            try:
-                os.remove(f)
-                print("* deleted: ", f)
-            except OSError:
-                print("Error while deleting '{}'".format(f), sys.exc_info()[0])
-
-
-def process_dirs(dirs, suffix, what_to_move, processor_fun):
-    # filter already processed dirs:
-    dirs_to_process = []
-    result_dirs = []
-    for data_dir in dirs:
-        res_dir = data_dir + suffix
-        result_dirs.append(res_dir)
-        if os.path.exists(res_dir):
-            print("[Skipped] Directory already exists:", res_dir)
-            continue
-        dirs_to_process.append((data_dir, res_dir))
-
-    if dirs_to_process:
-        # process dirs:
-        processor_fun(list(zip(*dirs_to_process))[0])
-
-        # move results:
-        for data_dir, res_dir in dirs_to_process:
-            move_forward(data_dir, res_dir, what_to_move)
-
-    return result_dirs
+            # MACS2 Broad peak calling (https://github.com/taoliu/MACS) Q=0.1
+            #  in example and Regular peak calling Q=0.1 from the same pileup
+            #  and control lambda
+            run_macs2_sweep(genome, chrom_sizes, ['broad_0.1', 'q0.1'],
+                            work_dirs=[bams_dir_signal])
+        finally:
+            for f in files_to_cleanup:
+                print("Cleanup:")
+                try:
+                    os.remove(f)
+                    print("* deleted: ", f)
+                except OSError:
+                    print("Error while deleting '{}'".format(f), sys.exc_info()[0])
+
+    return Stage('macs2_' + gsmid_signal, action=call_peaks, inputs=[bams_dir_signal],
+                 outputs=[bams_dir_signal + "_macs2_broad_0.1", bams_dir_signal + "_macs2_q0.1"],
+                 after=after)
 
 
 if __name__ == '__main__':
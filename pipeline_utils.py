@@ -4,9 +4,12 @@ from os.path import abspath, realpath, dirname
 import argparse
 import subprocess
 import itertools
+import multiprocessing
+import multiprocessing.connection
 import shutil
+import time
 
-from glob import glob
+from glob import glob, escape as glob_escape
 
 PROJECT_ROOT_PATH = abspath(os.path.join(dirname(realpath(__file__))))
 
@@ -81,3 +84,195 @@ def file_path_type(dir=False, exists=True, ext=None):
             raise argparse.ArgumentTypeError(msg)
         return os.path.abspath(arg)
     return inner
+
+
+def work_folder(folder, name):
+    """:return: own working folder of stage `name` reading shared folder, see Stage"""
+    return "{}.{}".format(folder, name)
+
+
+class Stage:
+    """
+    Pipeline stage: runs `parallel/*.sh` script and/or python action over
+    input folders, then moves results from the working folder to the
+    first output folder, see run_stages().
+    First input folder is a working folder of the stage, stages with the same
+    working folder are never run concurrently, since scripts write
+    intermediate files there and check all the logs in it, see check_logs.
+    Stages reading the same input folder can run concurrently in their own
+    working folders with input files linked, see link and work_folder().
+    """
+
+    def __init__(self, name, script=None, params=(), inputs=(), outputs=(),
+                 move=(), action=None, after=(), multiqc=(), link=()):
+        """
+        :param script: script relative to project root, see run_bash
+        :param params: script args
+        :param inputs: folders, which should be produced before stage,
+            the first one is working folder
+        :param outputs: produced folders, stage is skipped if all exist
+        :param move: results patterns, see move_forward
+        :param action: function called before script
+        :param after: names of stages, which should be finished before stage,
+            e.g. when both write intermediate files into the same folder
+        :param multiqc: folders to run multiqc on when stage is finished
+        :param link: patterns of the first input folder files, which are
+            symlinked into own working folder of stage, see work_folder()
+        """
+        self.name = name
+        self.script = script
+        self.params = params
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.move = move
+        self.action = action
+        self.after = list(after)
+        self.multiqc = multiqc
+        self.link = link
+
+    def run(self):
+        if self.link:
+            self.link_inputs()
+        if self.action is not None:
+            self.action()
+        if self.script is not None:
+            run_bash(self.script, *self.params)
+        if self.move:
+            move_forward(self.folder(), self.outputs[0], self.move)
+        if self.link:
+            self.unlink_inputs()
+        for folder in self.multiqc:
+            subprocess.run("multiqc -f -o {0} {0}".format(folder), shell=True)
+
+    def folder(self):
+        """:return: working folder or None"""
+        if not self.inputs:
+            return None
+        return work_folder(self.inputs[0], self.name) if self.link else self.inputs[0]
+
+    def link_inputs(self):
+        folder = self.folder()
+        os.makedirs(folder, exist_ok=True)
+        for pattern in self.link:
+            for f in glob(os.path.join(glob_escape(self.inputs[0]), pattern)):
+                target = os.path.join(folder, os.path.basename(f))
+                if not os.path.lexists(target):
+                    os.symlink(os.path.abspath(f), target)
+
+    def unlink_inputs(self):
+        """Removes links, working folder is kept if intermediate files are left"""
+        folder = self.folder()
+        for name in os.listdir(folder):
+            if os.path.islink(os.path.join(folder, name)):
+                os.remove(os.path.join(folder, name))
+        if not os.listdir(folder):
+            os.rmdir(folder)
+
+    def is_done(self):
+        return len(self.outputs) > 0 and all(os.path.exists(o) for o in self.outputs)
+
+
+def _stage_process(stage, parallelism):
+    # Local tasks limit of stage scripts, see parallel/util.sh
+    os.environ['WASHU_PARALLELISM'] = str(parallelism)
+    stage.run()
+
+
+def stages_dependencies(stages):
+    """
+    :return: {stage name: names of stages producing its inputs or listed in after}
+    """
+    names = {stage.name for stage in stages}
+    if len(names) != len(stages):
+        raise Exception("Duplicate stages names: {}".format([s.name for s in stages]))
+    producers = {}
+    for stage in stages:
+        for o in stage.outputs:
+            if o in producers:
+                raise Exception("Output {} is produced by {} and {}".format(
+                    o, producers[o], stage.name))
+            producers[o] = stage.name
+    dependencies = {}
+    for stage in stages:
+        for name in stage.after:
+            if name not in names:
+                raise Exception("Unknown stage {} required by {}".format(name, stage.name))
+        dependencies[stage.name] = {producers[i] for i in stage.inputs if i in producers} | \
+            set(stage.after)
+
+    # Check for cycles
+    done = set()
+    while len(done) < len(stages):
+        ready = [n for n, d in dependencies.items() if n not in done and d <= done]
+        if not ready:
+            raise Exception("Cyclic dependencies of stages: {}".format(
+                sorted(names - done)))
+        done.update(ready)
+    return dependencies
+
+
+def run_stages(stages, parallelism=None):
+    """
+    Runs stages graph: each stage is started in a separate process as soon
+    as all its dependencies are finished, see stages_dependencies(), and
+    no other stage is running in its working folder, see Stage.
+    Stages with all outputs existing are skipped.
+    Global parallelism budget is shared by running stages: each stage
+    gets its part as WASHU_PARALLELISM for local tasks.
+    If stage fails, no more stages are started and Exception is raised
+    when running ones are finished.
+    :param parallelism: max running stages, default WASHU_PARALLELISM or 8
+        for local tasks, on qsub cluster all the stages may run, because
+        their tasks are queued by the cluster scheduler
+    """
+    budget = parallelism
+    if budget is None:
+        budget = len(stages) if shutil.which('qsub') else \
+            int(os.environ.get('WASHU_PARALLELISM', 8))
+    dependencies = stages_dependencies(stages)
+    waiting = {stage.name: stage for stage in stages}
+    done = set()
+    running = {}
+    failed = []
+    # Fork keeps stages actions available in child process
+    context = multiprocessing.get_context('fork')
+    while waiting or running:
+        ready = [s for s in waiting.values() if dependencies[s.name] <= done]
+        skipped = [s for s in ready if s.is_done()]
+        for stage in skipped:
+            print("[Skipped] Stage {}: outputs already exist".format(stage.name))
+            del waiting[stage.name]
+            done.add(stage.name)
+        if skipped:
+            continue
+        # Stages sharing working folder are run one by one
+        busy = {s.folder() for s, _, _ in running.values()}
+        startable = []
+        for stage in ready:
+            if stage.folder() is None or stage.folder() not in busy:
+                startable.append(stage)
+                busy.add(stage.folder())
+        if startable and not failed and len(running) < budget:
+            share = max(1, budget // (len(running) + len(startable)))
+            for stage in startable[:budget - len(running)]:
+                print("[Stage] {} started, parallelism {}".format(stage.name, share))
+                process = context.Process(target=_stage_process, args=(stage, share))
+                process.start()
+                running[process.sentinel] = (stage, process, time.time())
+                del waiting[stage.name]
+            continue
+        if not running:
+            # Dependencies of waiting stages failed
+            break
+
+        for sentinel in multiprocessing.connection.wait(list(running)):
+            stage, process, started = running.pop(sentinel)
+            process.join()
+            if process.exitcode != 0:
+                print("[Stage] {} failed with exit code {}".format(stage.name, process.exitcode))
+                failed.append(stage.name)
+            else:
+                print("[Stage] {} finished in {:.0f}s".format(stage.name, time.time() - started))
+                done.add(stage.name)
+    if failed:
+        raise Exception("Failed stages: {}".format(", ".join(failed)))
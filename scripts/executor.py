@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+"""
+Resource-aware local tasks executor, used by parallel/util.sh run_parallel
+and wait_complete in local mode if WASHU_LOCAL_EXECUTOR is set.
+
+Each task is a bash script with qsub resources requirements, e.g.
+    #PBS -l nodes=1:ppn=4,walltime=24:00:00,vmem=32gb
+    #PBS -o /path/to/task.log
+Tasks are started in submission order as long as their cpus (ppn) and
+memory (vmem or mem) fit into free machine capacity, smaller tasks are
+started ahead of the waiting ones if they fit. Task larger than the whole
+capacity is started alone. Executor sleeps until any of running tasks
+exits, stdout and stderr of each task are written to its log.
+
+Usage:
+    python executor.py [--cpus N] [--memory 64G] [--max-tasks N]
+        [--status status.tsv] <task.sh>...
+Capacity defaults to available cpus and memory, see WASHU_LOCAL_CPUS and
+WASHU_LOCAL_MEMORY environment variables. Exit status of each task is
+reported and saved to status file, executor fails if any of tasks failed.
+
+author oleg.shpynov@jetbrains.com
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+UNITS = {'': 1, 'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+
+def parse_memory(value):
+    """:return: bytes for memory like '16gb', '500MB' or '8G'"""
+    match = re.match(r'^([0-9.]+)\s*([kmgt]?)b?$', value.strip().lower())
+    if match is None:
+        raise Exception("Illegal memory {}".format(value))
+    return int(float(match.group(1)) * UNITS[match.group(2)])
+
+
+class Task:
+    def __init__(self, path):
+        self.path = path
+        self.cpus = 1
+        self.memory = 0
+        self.log = None
+        with open(path) as f:
+            for line in f:
+                if line.startswith('#PBS -l'):
+                    for resource in re.split('[,:]', line[len('#PBS -l'):].strip()):
+                        name, _, value = resource.partition('=')
+                        if name == 'ppn':
+                            self.cpus = int(value)
+                        elif name in ('vmem', 'mem'):
+                            self.memory = max(self.memory, parse_memory(value))
+                elif line.startswith('#PBS -o'):
+                    self.log = line[len('#PBS -o'):].strip()
+        self.process = None
+        self.started = None
+        self.seconds = None
+        self.returncode = None
+
+    def start(self):
+        out = open(self.log, 'w') if self.log else subprocess.DEVNULL
+        try:
+            self.process = subprocess.Popen(['bash', self.path], stdout=out,
+                                            stderr=subprocess.STDOUT)
+        finally:
+            if self.log:
+                out.close()
+        self.started = time.time()
+
+
+def available_cpus():
+    value = os.environ.get('WASHU_LOCAL_CPUS')
+    if value:
+        return int(value)
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        # MacOS
+        return os.cpu_count()
+
+
+def available_memory():
+    """:return: bytes, MemAvailable on Linux, otherwise physical memory"""
+    value = os.environ.get('WASHU_LOCAL_MEMORY')
+    if value:
+        return parse_memory(value)
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
+def execute(tasks, cpus, memory, max_tasks=None):
+    """
+    Runs all the tasks within given capacity.
+    :param cpus: number of cpus
+    :param memory: bytes
+    :param max_tasks: optional limit of concurrent tasks
+    :return: tasks with returncode and seconds set
+    """
+    waiting = list(tasks)
+    running = {}
+    free_cpus, free_memory = cpus, memory
+    while waiting or running:
+        for task in list(waiting):
+            if max_tasks is not None and len(running) >= max_tasks:
+                break
+            if not running or task.cpus <= free_cpus and task.memory <= free_memory:
+                if task.cpus > cpus or task.memory > memory:
+                    print("WARNING: {} requires more than capacity, started alone".format(
+                        task.path), file=sys.stderr)
+                task.start()
+                running[task.process.pid] = task
+                waiting.remove(task)
+                free_cpus -= task.cpus
+                free_memory -= task.memory
+                if free_cpus < 0 or free_memory < 0:
+                    break
+
+        # Sleep until any child exits
+        pid, status = os.waitpid(-1, 0)
+        task = running.pop(pid, None)
+        if task is None:
+            continue
+        task.returncode = os.waitstatus_to_exitcode(status)
+        # Already reaped
+        task.process.returncode = task.returncode
+        task.seconds = time.time() - task.started
+        free_cpus += task.cpus
+        free_memory += task.memory
+    return tasks
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run tasks within local resources')
+    parser.add_argument('tasks', nargs='*', help='bash scripts with #PBS resources')
+    parser.add_argument('--cpus', type=int, default=None, help='default: available cpus')
+    parser.add_argument('--memory', default=None, help='default: available memory')
+    parser.add_argument('--max-tasks', type=int, default=None)
+    parser.add_argument('--status', help='save tasks exit status TSV')
+    args = parser.parse_args()
+
+    cpus = args.cpus or available_cpus()
+    memory = parse_memory(args.memory) if args.memory else available_memory()
+    print("LOCAL executor: {} tasks, cpus {}, memory {:.1f}G".format(
+        len(args.tasks), cpus, memory / UNITS['g']), file=sys.stderr)
+    tasks = execute([Task(t) for t in args.tasks], cpus, memory, args.max_tasks)
+
+    failed = [t for t in tasks if t.returncode != 0]
+    for t in failed:
+        print("FAILED TASK: {} exit code {} LOG: {}".format(t.path, t.returncode, t.log),
+              file=sys.stderr)
+    if args.status:
+        with open(args.status, 'w') as out:
+            out.write('task\tlog\tcpus\tmemory\texit_code\tseconds\n')
+            for t in tasks:
+                out.write('{}\t{}\t{}\t{}\t{}\t{:.1f}\n'.format(
+                    t.path, t.log, t.cpus, t.memory, t.returncode, t.seconds))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
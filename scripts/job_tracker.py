@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+"""
+Batch jobs submission and tracking on qsub (Torque PBS) cluster, used by
+parallel/util.sh run_parallel and wait_complete.
+
+If WASHU_QSUB_ARRAY is set, tasks are collected and submitted together:
+tasks with the same resources, i.e. the same #PBS lines except log and name,
+are submitted as a single array job `qsub -t 1-N`, each array subjob runs its
+own task with output redirected to the task log.
+Submitted jobs are tracked by a single `qstat -u $USER` query for all the
+outstanding jobs instead of querying them one by one. Completions are
+reported as soon as they are seen, polling interval is reset to minimal
+on each completion and grows while nothing changes, see
+WASHU_QSTAT_MIN_INTERVAL and WASHU_QSTAT_MAX_INTERVAL environment variables.
+Failed qstat queries are retried, tracker fails after QSTAT_RETRIES failures
+in a row, as well as on qsub failure.
+
+Usage:
+    python job_tracker.py run <task.sh>...
+    python job_tracker.py wait <job_id>...
+
+author oleg.shpynov@jetbrains.com
+"""
+import getpass
+import os
+import re
+import subprocess
+import sys
+import time
+
+MIN_INTERVAL = float(os.environ.get('WASHU_QSTAT_MIN_INTERVAL', 5))
+MAX_INTERVAL = float(os.environ.get('WASHU_QSTAT_MAX_INTERVAL', 100))
+INTERVAL_GROWTH = 1.5
+QSTAT_RETRIES = 5
+
+# Per task directives, the rest are resources shared by array subjobs
+TASK_DIRECTIVES = ('#PBS -o', '#PBS -e', '#PBS -N', '#PBS -j')
+# Job state column in `qstat` and `qstat -u` output, C for completed
+COMPLETED = 'C'
+
+
+def job_key(job_id):
+    """
+    :return: job number with array index if any, e.g. 1234 for 1234.server
+        or 1234[], and 1234[1] for array subjob 1234[1].server
+    """
+    match = re.match(r'^(\d+)(\[\d+\])?', job_id.strip())
+    return match.group(0) if match else None
+
+
+def parse_task(text):
+    """:return: (resources, log) of task script"""
+    resources = []
+    log = None
+    for line in text.split('\n'):
+        if line.startswith('#PBS -o'):
+            log = line[len('#PBS -o'):].strip()
+        elif line.startswith('#PBS') and not line.startswith(TASK_DIRECTIVES):
+            resources.append(line.strip())
+    return tuple(resources), log
+
+
+def group_tasks(paths):
+    """:return: list of (resources, [(path, text, log)]) in submission order"""
+    groups = {}
+    for path in paths:
+        with open(path) as f:
+            text = f.read()
+        resources, log = parse_task(text)
+        groups.setdefault(resources, []).append((path, text, log))
+    return list(groups.items())
+
+
+def array_script(resources, tasks):
+    """:return: script of array job running i-th task in i-th subjob"""
+    lines = ['#!/bin/bash'] + list(resources) + [
+        '#PBS -t 1-{}'.format(len(tasks)),
+        '#PBS -j oe',
+        '#PBS -o /dev/null',
+        'case ${PBS_ARRAYID} in']
+    for i, (_path, text, log) in enumerate(tasks):
+        lines.append('{})'.format(i + 1))
+        lines.append('(')
+        lines.append(text.rstrip('\n'))
+        lines.append(') &> "{}"'.format(log or '/dev/null'))
+        lines.append('exit $?')
+        lines.append(';;')
+    lines.append('esac')
+    return '\n'.join(lines) + '\n'
+
+
+def qsub(script):
+    """:return: job id"""
+    process = subprocess.run(['qsub'], input=script.encode('utf-8'),
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        raise Exception("qsub failed: {}".format(process.stderr.decode('utf-8')))
+    return process.stdout.decode('utf-8').strip()
+
+
+def submit(paths):
+    """
+    Submits tasks, tasks with the same resources as array jobs.
+    :return: {job id: log} for each task, array subjob ids are used for arrays
+    """
+    jobs = {}
+    for resources, tasks in group_tasks(paths):
+        if len(tasks) == 1:
+            job = qsub(tasks[0][1])
+            jobs[job] = tasks[0][2]
+        else:
+            job = qsub(array_script(resources, tasks))
+            for i, (_path, _text, log) in enumerate(tasks):
+                jobs[job.replace('[]', '[{}]'.format(i + 1), 1)] = log
+        print("SUBMITTED {}: {} tasks".format(job, len(tasks)), flush=True)
+    return jobs
+
+
+def running_jobs():
+    """
+    Single qstat call for all the jobs of current user, array subjobs are expanded.
+    :return: keys of not completed jobs and subjobs, see job_key()
+    """
+    process = subprocess.run(['qstat', '-t', '-u', getpass.getuser()],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        raise Exception("qstat failed: {}".format(process.stderr.decode('utf-8')))
+    keys = set()
+    for line in process.stdout.decode('utf-8').split('\n'):
+        fields = line.split()
+        # Jobs lines start with job id, state is the last but one column
+        if len(fields) >= 2 and job_key(fields[0]) and fields[-2] != COMPLETED:
+            keys.add(job_key(fields[0]))
+            # Array is running while any of its subjobs is running
+            keys.add(re.match(r'^\d+', fields[0]).group(0))
+    return keys
+
+
+def wait(jobs, min_interval=None, max_interval=None):
+    """
+    Waits until all the jobs are completed, reports completions.
+    :param jobs: job ids or {job id: log}
+    """
+    min_interval = MIN_INTERVAL if min_interval is None else min_interval
+    max_interval = MAX_INTERVAL if max_interval is None else max_interval
+    logs = jobs if isinstance(jobs, dict) else {}
+    outstanding = {job_key(j): j for j in jobs if job_key(j)}
+    interval = min_interval
+    failures = 0
+    while outstanding:
+        try:
+            running = running_jobs()
+            failures = 0
+        except Exception as e:
+            # Scheduler may be temporarily unavailable
+            failures += 1
+            if failures >= QSTAT_RETRIES:
+                raise
+            print("WARNING: {}, retry {} of {}".format(
+                str(e).strip(), failures, QSTAT_RETRIES - 1), file=sys.stderr)
+            time.sleep(interval)
+            interval = min(max_interval, interval * INTERVAL_GROWTH)
+            continue
+        completed = [k for k in outstanding if k not in running]
+        for k in completed:
+            job = outstanding.pop(k)
+            print("DONE {}{}".format(job, " LOG: {}".format(logs[job]) if logs.get(job) else ""),
+                  flush=True)
+        if not outstanding:
+            break
+        if completed:
+            interval = min_interval
+        time.sleep(interval)
+        interval = min(max_interval, interval * INTERVAL_GROWTH)
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ('run', 'wait'):
+        print("Usage: job_tracker.py run <task.sh>... | wait <job_id>...")
+        sys.exit(1)
+    try:
+        if sys.argv[1] == 'run':
+            wait(submit(sys.argv[2:]))
+        else:
+            wait(sys.argv[2:])
+    except Exception as e:
+        print("ERROR: {}".format(str(e).strip()), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
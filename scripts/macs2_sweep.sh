@@ -0,0 +1,65 @@
+#!/bin/bash
+# Calls peaks for several cutoffs from pileup and control lambda tracks of
+# single `macs2 callpeak -B` run, so that each cutoff costs thresholding only.
+# See parallel/macs2.sh
+
+which macs2 &>/dev/null || { echo "ERROR: MACS2 not found! Download MACS2: <https://github.com/taoliu/MACS/wiki/Install-macs2>"; exit 1; }
+
+if [ $# -lt 3 ]; then
+    echo "Need 3 parameters! <callpeak_name> <name> <cutoffs>"
+    echo "Comma separated cutoffs: q<qvalue> or p<pvalue> for narrow peaks, broad_<qvalue> for broad peaks."
+    echo "Results: <name>_<cutoff>_peaks.narrowPeak or <name>_<cutoff>_peaks.broadPeak"
+    exit 1
+fi
+
+ID=$1
+NAME=$2
+CUTOFFS=$3
+
+# Fragment size and reads length estimated by callpeak are used as min peak length and max gap
+D=$(grep "^# d = " ${ID}_peaks.xls | awk '{print $4}')
+TAG_SIZE=$(grep "^# tag size is determined as" ${ID}_peaks.xls | awk '{print $(NF-1)}')
+echo "Sweep ${ID}: d = ${D}, tag size = ${TAG_SIZE}, cutoffs: ${CUTOFFS}"
+
+# -log10 score of given p or q value
+score()
+{
+    awk -v x=$1 'BEGIN { print -log(x) / log(10) }'
+}
+
+# Score track is computed once for all the cutoffs: ppois or qpois
+score_track()
+{
+    if [[ ! -f ${ID}_$1.bdg ]]; then
+        macs2 bdgcmp -t ${ID}_treat_pileup.bdg -c ${ID}_control_lambda.bdg -m $1 -o ${ID}_$1.bdg
+    fi
+}
+
+for CUTOFF in ${CUTOFFS//,/ }; do :
+    OUT=${NAME}_${CUTOFF}_peaks
+    case ${CUTOFF} in
+        broad_*)
+            # Same as callpeak --broad --broad-cutoff, strong regions are called with default q 0.05
+            WEAK=${CUTOFF#broad_}
+            STRONG=$(awk -v x=${WEAK} 'BEGIN { print (x < 0.05 ? x : 0.05) }')
+            score_track qpois
+            macs2 bdgbroadcall -i ${ID}_qpois.bdg -c $(score ${STRONG}) -C $(score ${WEAK}) \
+                -l ${D} -g ${TAG_SIZE} -G $((4 * D)) -o ${OUT}.gappedPeak
+            # gappedPeak -> broadPeak
+            awk -v OFS='\t' '!/^track/ {print $1,$2,$3,$4,$5,$6,$13,$14,$15}' ${OUT}.gappedPeak > ${OUT}.broadPeak
+            rm ${OUT}.gappedPeak
+            ;;
+        q*|p*)
+            METHOD=${CUTOFF:0:1}pois
+            score_track ${METHOD}
+            macs2 bdgpeakcall -i ${ID}_${METHOD}.bdg -c $(score ${CUTOFF:1}) \
+                -l ${D} -g ${TAG_SIZE} -o ${OUT}.narrowPeak.track
+            grep -v "^track" ${OUT}.narrowPeak.track > ${OUT}.narrowPeak
+            rm ${OUT}.narrowPeak.track
+            ;;
+        *)
+            echo "ERROR: Unknown cutoff: ${CUTOFF}"
+            exit 1
+            ;;
+    esac
+done
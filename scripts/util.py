@@ -1,8 +1,10 @@
 #!/usr/bin/env python
+import fnmatch
 import getopt
 import glob
 import os
 import re
+import shutil
 import subprocess
 import sys
 import traceback
@@ -29,6 +31,11 @@ python util.py find_input <file>
      folder find file with "input" substring and
     most common subsequence with initial file.
 
+python util.py find_inputs <file|folder>...
+    Same as find_input for all the given files or *.bam files in folders at once,\
+     each folder is listed once.
+    Prints tab separated table: file, input or empty string.
+
 python util.py macs_species <genome>
     Converts UCSC genome name to MACS.
 
@@ -43,33 +50,22 @@ def usage():
 
 def lcs(x, y):
     """
-    Finds longest common subsequence
-    Code adopted from https://en.wikibooks.org/wiki/Algorithm_Implementation/
-    Strings/Longest_common_subsequence#Python
+    Finds length of longest common subsequence.
+    Dynamic programming keeps only previous row of the table, so that memory
+    is linear and no recursion is required.
     """
-    m = len(x)
-    n = len(y)
-    # An (m+1) times (n+1) matrix
-    c = [[0] * (n + 1) for _ in range(m + 1)]
-    for i in range(1, m + 1):
-        for j in range(1, n + 1):
-            if x[i - 1] == y[j - 1]:
-                c[i][j] = c[i - 1][j - 1] + 1
+    if len(x) < len(y):
+        x, y = y, x
+    previous = [0] * (len(y) + 1)
+    for a in x:
+        current = [0]
+        for j, b in enumerate(y):
+            if a == b:
+                current.append(previous[j] + 1)
             else:
-                c[i][j] = max(c[i][j - 1], c[i - 1][j])
-
-    def back_track(i, j):
-        if i == 0 or j == 0:
-            return ""
-        elif x[i - 1] == y[j - 1]:
-            return back_track(i - 1, j - 1) + x[i - 1]
-        else:
-            if c[i][j - 1] > c[i - 1][j]:
-                return back_track(i, j - 1)
-            else:
-                return back_track(i - 1, j)
-
-    return len(back_track(m, n))
+                current.append(max(current[j], previous[j + 1]))
+        previous = current
+    return previous[-1]
 
 
 def is_input(c):
@@ -91,18 +87,38 @@ def find_input_name(c, variants):
 
 
 def find_input(bam):
-    bam_name = os.path.basename(bam).lower()
-    if 'input' in bam_name:
-        return ''
-
-    # Find all the files within folder
-    dirname = os.path.dirname(bam)
-    names = [os.path.basename(n) for n in glob.glob('{}/*.bam'.format(dirname))]
-    input_name = find_input_name(bam_name, names)
-    if input_name is None:
-        return ''
-    else:
-        return input_name
+    return find_inputs([bam])[bam]
+
+
+def find_inputs(bams):
+    """
+    Batch version of find_input, files within each folder are listed once.
+    :param bams: files or folders, which stand for all the *.bam files in them
+    :return: {file: input name or empty string}
+    """
+    files = []
+    for bam in bams:
+        if os.path.isdir(bam):
+            files.extend(sorted(glob.glob(os.path.join(glob.escape(bam), '*.bam'))))
+        else:
+            files.append(bam)
+
+    folders = {}
+    result = {}
+    for bam in files:
+        bam_name = os.path.basename(bam).lower()
+        if 'input' in bam_name:
+            result[bam] = ''
+            continue
+
+        # Find all the files within folder
+        dirname = os.path.dirname(bam) or '.'
+        if dirname not in folders:
+            folders[dirname] = [os.path.basename(n)
+                                for n in glob.glob('{}/*.bam'.format(glob.escape(dirname)))]
+        input_name = find_input_name(bam_name, folders[dirname])
+        result[bam] = '' if input_name is None else input_name
+    return result
 
 
 def macs_species(genome):
@@ -187,6 +203,76 @@ Defaults for MACS2 broad peak calling:
     return [os.path.join(wd, wd2result[wd]) for wd in work_dirs]
 
 
+# Name of shared callpeak results in sweep mode, see run_macs2_sweep
+MACS2_SWEEP = 'sweep'
+MACS2_CUTOFF = re.compile('^(q|p|broad_)[0-9.]+(e-?[0-9]+)?$')
+
+
+def run_macs2_sweep(genome, chrom_sizes, cutoffs, *params, work_dirs):
+    """
+Sweep mode of run_macs2 for several cutoffs. Treatment pileup, fragment model
+and control lambda are computed by single `macs2 callpeak -B` for each file,
+then peaks for each cutoff are called from them with `macs2 bdgpeakcall` or
+`macs2 bdgbroadcall`, see scripts/macs2_sweep.sh
+Results for each cutoff are stored like run_macs2 does with cutoff as name.
+
+:param cutoffs: list of q<qvalue> or p<pvalue> for narrow peaks and
+    broad_<qvalue> for broad peaks, e.g. ['broad_0.1', 'q0.05']
+:param params: callpeak model params, see run_macs2
+:return: {cutoff: result folders}
+    """
+    for cutoff in cutoffs:
+        if not MACS2_CUTOFF.match(cutoff):
+            raise Exception('Unknown MACS2 cutoff {}'.format(cutoff))
+
+    # Skip existing result folders, work dirs are processed by groups
+    # with the same missing cutoffs
+    results = {cutoff: [] for cutoff in cutoffs}
+    groups = {}
+    for wd in work_dirs:
+        missing = []
+        for cutoff in cutoffs:
+            result_dir = '{}_macs2_{}'.format(wd, cutoff)
+            results[cutoff].append(result_dir)
+            if os.path.exists(result_dir):
+                print('[Macs2] Already processed: ', result_dir)
+            else:
+                missing.append(cutoff)
+        if missing:
+            groups.setdefault(tuple(missing), []).append(wd)
+
+    # Shared callpeak results are copied to folder of each cutoff
+    shared = ['*_{}_peaks.xls'.format(MACS2_SWEEP), '*_{}_model.*'.format(MACS2_SWEEP),
+              '*rip.csv', '*_signal.bdg', '*_signal.bw']
+    for missing, wds in groups.items():
+        # Work dirs are inputs of other stages, only files created here are moved or removed
+        existing = {wd: set(os.listdir(wd)) for wd in wds}
+        run_bash("parallel/macs2.sh", "--sweep", ",".join(missing),
+                 genome, chrom_sizes, MACS2_SWEEP,
+                 "'{}'".format(" ".join([str(p) for p in params + ('-B',)])), *wds)
+
+        for wd in wds:
+            created = set(os.listdir(wd)) - existing[wd]
+
+            def created_files(patterns):
+                return sorted(os.path.join(wd, f) for f in created
+                              if any(fnmatch.fnmatch(f, p) for p in patterns))
+
+            for cutoff in missing:
+                result_dir = '{}_macs2_{}'.format(wd, cutoff)
+                os.makedirs(result_dir, exist_ok=True)
+                for f in created_files(['*_{}_peaks.*'.format(cutoff)]):
+                    shutil.move(f, result_dir)
+                for f in created_files(shared):
+                    shutil.copy(f, result_dir)
+                subprocess.run("multiqc " + result_dir, shell=True)
+            for f in created_files(shared + ['*_{}_*'.format(MACS2_SWEEP)]):
+                if os.path.exists(f):
+                    os.remove(f)
+
+    return results
+
+
 def run(commands, stdin=None, stdout=subprocess.PIPE, stderr=subprocess.PIPE):
     """Launches pipe of commands given stdin and final stdout, stderr"""
 
@@ -247,6 +333,10 @@ def main():
     if len(args) == 2 and args[0] == 'find_input':
         print(find_input(args[1]))
 
+    if len(args) >= 2 and args[0] == 'find_inputs':
+        for bam, input_name in find_inputs(args[1:]).items():
+            print('{}\t{}'.format(bam, input_name))
+
     if len(args) == 2 and args[0] == 'macs_species':
         print(macs_species(args[1]))
 
@@ -4,7 +4,7 @@ __email__ = 'roman.chernyatchik@jetbrains.com'
 import os
 import pytest
 from pathlib import Path
-from bed.bedtrace import _cleanup
+from bed.bedtrace import _cleanup, set_backend, BACKEND, BACKENDS
 
 
 @pytest.fixture
@@ -24,6 +24,14 @@ def bedtrace_cleanup():
     _cleanup()
 
 
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+    default = BACKEND
+    set_backend(request.param)
+    yield request.param
+    set_backend(default)
+
+
 @pytest.fixture
 def tmp_dir(tmpdir):
     # tmpdir is py.path.LocalPath
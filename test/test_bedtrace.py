@@ -1,9 +1,16 @@
+import os
+import re
+import threading
 from pathlib import Path
 
 import pytest
 
-from bed.bedtrace import Bed, union, intersect, minus, compare, jaccard
-from test.fixtures import test_data, bedtrace_cleanup
+from bed.bedtrace import Bed, union, intersect, minus, compare, jaccard, \
+    jaccard_matrix, optimize, explain, compute_all, compute_parallel, \
+    Intersection, Union, is_sorted, columns, open_binary, from_binary, \
+    consensus, overlap_patterns, metapeaks, closest_gene, explain_analyze
+from bed import genes as genes_index
+from test.fixtures import test_data, tmp_dir, bedtrace_cleanup, backend
 
 
 # 0      100  200    300  400    500  600    700
@@ -28,7 +35,7 @@ def test_str_compound(test_data):
 \tC.bed""" == str(c)
 
 
-def test_union(test_data):
+def test_union(test_data, backend):
     u = union(Bed(test_data("bed/A.bed")),
               Bed(test_data("bed/B.bed")))
     assert u.path is None
@@ -43,7 +50,7 @@ chr1	600	750	1_A.bed|2_B.bed
 """
 
 
-def test_intersect(test_data):
+def test_intersect(test_data, backend):
     i = intersect(Bed(test_data("bed/A.bed")), Bed(test_data("bed/B.bed")))
     assert i.path is None
 
@@ -53,7 +60,7 @@ def test_intersect(test_data):
                                         "chr1	600	750\n")
 
 
-def test_minus(test_data):
+def test_minus(test_data, backend):
     m = minus(Bed(test_data("bed/A.bed")), Bed(test_data("bed/B.bed")))
     assert m.path is None
     m.compute()
@@ -67,7 +74,7 @@ def test_minus(test_data):
     (["C.bed"], 5),
     (["A.bed", "B.bed"], 3),
 ])
-def test_count(test_data, files, expected_count):
+def test_count(test_data, backend, files, expected_count):
     if len(files) == 1:
         bed = Bed(test_data("bed/" + files[0]))
     else:
@@ -75,16 +82,27 @@ def test_count(test_data, files, expected_count):
     assert bed.count() == expected_count
 
 
-def test_compare(test_data):
+def test_compare(test_data, backend):
     c = compare(Bed(test_data("bed/A.bed")), Bed(test_data("bed/B.bed")))
     assert c.path is None
 
     c.compute()
     assert c.path is not None
-    assert Path(c.cond1).read_text() == "chr1	0	100\n"
-    assert Path(c.cond2).read_text() == ""
-    assert Path(c.common).read_text() == ("chr1	150	500\n"
-                                          "chr1	600	750\n")
+    assert Path(c.cond1.path).read_text() == "chr1	0	100\n"
+    assert Path(c.cond2.path).read_text() == ""
+    assert Path(c.common.path).read_text() == ("chr1	150	500\n"
+                                               "chr1	600	750\n")
+
+
+def test_compare_operations(test_data, backend):
+    a, b, c = [Bed(test_data("bed/" + f)) for f in ["A.bed", "B.bed", "C.bed"]]
+    cmp = compare(minus(a, c), union(b, c))
+    cmp.compute()
+    assert Path(cmp.cond1.path).read_text() == ""
+    assert cmp.cond2.count() == 4
+    assert Path(cmp.common.path).read_text() == "chr1\t600\t750\n"
+    # Results are Bed objects usable in expressions
+    assert intersect(cmp.common, a).count() == 1
 
 
 def test_jaccard(test_data):
@@ -102,7 +120,24 @@ def test_jaccard_self_intersections(test_data):
     assert u == 35.0 / 72.0
 
 
-def test_save(test_data):
+@pytest.mark.parametrize("workers", [1, 2])
+def test_jaccard_matrix(test_data, workers):
+    files = [test_data("bed/" + f) for f in ["A.unsorted.bed", "B.unsorted.bed", "E.bed", "F.bed"]]
+    m = jaccard_matrix(files, workers=workers)
+    assert list(m.index) == ["A.unsorted.bed", "B.unsorted.bed", "E.bed", "F.bed"]
+    assert m.loc["A.unsorted.bed", "B.unsorted.bed"] == 1.0 / 3.0
+    assert m.loc["B.unsorted.bed", "A.unsorted.bed"] == 1.0 / 3.0
+    assert m.loc["E.bed", "F.bed"] == 35.0 / 72.0
+    assert m.loc["E.bed", "E.bed"] == 1.0
+
+
+def test_jaccard_matrix_labels(test_data):
+    m = jaccard_matrix([Bed(test_data("bed/A.bed")), test_data("bed/B.bed")],
+                       labels=["a", "b"])
+    assert m.loc["a", "b"] == 1.0 / 3.0
+
+
+def test_save(test_data, backend):
     assert union(Bed(test_data("bed/A.bed")),
                  Bed(test_data("bed/B.bed"))).count() == 3
 
@@ -115,3 +150,485 @@ chr1	200	300
 chr1	400	500
 chr1	600	700
 """
+
+
+def test_optimize_not_flattened(test_data):
+    a, b, c = [Bed(test_data("bed/" + f)) for f in ["A.bed", "B.bed", "C.bed"]]
+    u = union(union(a, b), c)
+    assert str(optimize(u)[0]) == "union\n\tunion\n\t\tA.bed\n\t\tB.bed\n\tC.bed"
+    i = intersect(intersect(a, b), c)
+    assert str(optimize(i)[0]) == \
+        "intersection\n\tC.bed\n\tintersection\n\t\tA.bed\n\t\tB.bed"
+
+
+def test_optimize_same_result(tmp_dir, backend):
+    def contents(bed):
+        # Union labels of intermediate results refer to temp files
+        return re.sub(r'bedtraces\w+\.bed', 'tmp', Path(bed.path).read_text())
+
+    def beds(*intervals):
+        result = []
+        for i, (start, end) in enumerate(intervals):
+            path = os.path.join(tmp_dir, "{}.bed".format(i))
+            Path(path).write_text("chr1\t{}\t{}\n".format(start, end))
+            result.append(Bed(path))
+        return result
+
+    # Intersection of merged clusters is not associative
+    expressions = [lambda a, b, c: intersect(intersect(a, b), c),
+                   lambda a, b, c: union(union(a, b), c),
+                   lambda a, b, c: intersect(union(a, c), intersect(b, c), b)]
+    for expression in expressions:
+        a, b, c = beds((0, 10), (20, 30), (5, 25))
+        plain = expression(a, b, c)
+        plain.compute()
+        optimized = expression(a, b, c)
+        compute_all(optimized)
+        assert contents(optimized) == contents(plain)
+    assert intersect(intersect(a, b), c).count() == 0
+
+
+def test_optimize_intersection_operands(test_data):
+    a, b = Bed(test_data("bed/A.bed")), Bed(test_data("bed/B.bed"))
+    i1, i2 = optimize(intersect(b, a, a),
+                      intersect(a, Bed(test_data("bed/B.bed"))))
+    assert i1 is i2
+    assert str(i1) == "intersection\n\tA.bed\n\tB.bed"
+
+
+def test_optimize_common_subexpressions(test_data):
+    a, b, c = [Bed(test_data("bed/" + f)) for f in ["A.bed", "B.bed", "C.bed"]]
+    m1, m2 = optimize(minus(intersect(a, b), c),
+                      minus(c, intersect(Bed(test_data("bed/A.bed")), b)))
+    assert m1.operands[0] is m2.operands[1]
+    assert m1.operands[1] is m2.operands[0]
+
+
+def test_explain(test_data):
+    a, b, c = [Bed(test_data("bed/" + f)) for f in ["A.bed", "B.bed", "C.bed"]]
+    i = intersect(a, b)
+    assert explain(minus(union(a, b, c), i), minus(c, intersect(b, a))) == """minus #1
+\tunion #2
+\t\tA.bed
+\t\tB.bed
+\t\tC.bed
+\tintersection #3
+\t\tA.bed
+\t\tB.bed
+minus #4
+\tC.bed
+\tintersection #3 (shared)
+Operations: 5 -> 4
+Operands read: 11 -> 9"""
+
+
+def test_compute_all(test_data, backend):
+    a, b, c = [Bed(test_data("bed/" + f)) for f in ["A.bed", "B.bed", "C.bed"]]
+    m = minus(intersect(a, b), c)
+    i = intersect(b, a)
+    compute_all(m, i)
+    assert Path(m.path).read_text() == "chr1\t600\t750\n"
+    assert Path(i.path).read_text() == "chr1\t150\t500\nchr1\t600\t750\n"
+
+
+def test_compute_parallel(test_data, backend):
+    a, b, c = [Bed(test_data("bed/" + f)) for f in ["A.bed", "B.bed", "C.bed"]]
+    shared = intersect(a, b)
+    u = union(minus(shared, c), minus(c, shared), shared)
+    compute_parallel(u, workers=4)
+    assert u.count() == 5
+    assert Path(shared.path).read_text() == "chr1\t150\t500\nchr1\t600\t750\n"
+
+
+def test_compute_parallel_siblings_overlap(test_data, monkeypatch):
+    # Both intersections should be running at the same time
+    barrier = threading.Barrier(2, timeout=10)
+    calls = []
+
+    def intersect_files(*files, sorted=False):
+        calls.append(files)
+        barrier.wait()
+        return files[0]
+
+    monkeypatch.setattr(Intersection, "intersect_files", staticmethod(intersect_files))
+    monkeypatch.setattr(Union, "union_files", staticmethod(lambda *files, sorted=False: files[0]))
+    a, b, c = [Bed(test_data("bed/" + f)) for f in ["A.bed", "B.bed", "C.bed"]]
+    shared = intersect(a, b)
+    u = union(shared, intersect(b, c), shared)
+    compute_parallel(u, workers=2)
+    assert len(calls) == 2
+    assert u.path == test_data("bed/A.bed")
+
+
+@pytest.mark.parametrize("file,expected", [
+    ("A.bed", True),
+    ("A.unsorted.bed", False),
+    ("B.unsorted.bed", False),
+])
+def test_is_sorted(test_data, file, expected):
+    assert is_sorted(test_data("bed/" + file)) == expected
+    assert Bed(test_data("bed/" + file)).is_sorted() == expected
+
+
+def test_is_sorted_chromosomes(tmp_dir):
+    path = os.path.join(tmp_dir, "chroms.bed")
+    Path(path).write_text("chr1\t500\t600\nchr10\t0\t10\nchr2\t0\t10\n")
+    assert is_sorted(path)
+    Path(path).write_text("chr2\t0\t10\nchr10\t0\t10\n")
+    assert not is_sorted(path)
+
+
+def test_sorted_operands(test_data, backend):
+    b = Bed(test_data("bed/B.bed"))
+    expected = union(Bed(test_data("bed/A.bed")), b)
+    assert expected.is_sorted()
+    result = union(Bed(test_data("bed/A.unsorted.bed")), b)
+    expected.compute()
+    result.compute()
+    assert Path(result.path).read_text().replace("A.unsorted.bed", "A.bed") == \
+        Path(expected.path).read_text()
+
+
+def test_intervals(test_data):
+    a = Bed(test_data("bed/A.bed"))
+    assert list(a.intervals())[:2] == [("chr1", 0, 100, []), ("chr1", 200, 300, [])]
+    assert list(a.intervals(region="chr1:250-450")) == \
+        [("chr1", 200, 300, []), ("chr1", 400, 500, [])]
+    assert list(a.intervals(chroms="chr2")) == []
+
+
+def test_intervals_operation(test_data):
+    u = union(Bed(test_data("bed/A.bed")), Bed(test_data("bed/B.bed")))
+    result = list(u.intervals(region=("chr1", 0, 160)))
+    assert [x[:3] for x in result] == [("chr1", 0, 100), ("chr1", 150, 500)]
+    assert result[1][3][0].count("|") == 1
+
+
+def test_chunks(tmp_dir):
+    path = os.path.join(tmp_dir, "chroms.bed")
+    Path(path).write_text("track name=x\nchr1\t0\t10\tp1\t5\nchr2\t5\t20\tp2\n"
+                          "chr1\t30\t40\tp3\t7\n")
+    chunks = list(Bed(path).chunks(size=2))
+    assert len(chunks) == 2
+    assert chunks[0].chroms.tolist() == [0, 1]
+    assert chunks[0].starts.tolist() == [0, 5]
+    assert chunks[0].ends.tolist() == [10, 20]
+    assert [c.tolist() for c in chunks[0].extra] == [["p1", "p2"], ["5", ""]]
+    assert chunks[1].names == ["chr1", "chr2"]
+    assert chunks[1].chroms.tolist() == [0]
+    region = list(Bed(path).chunks(region="chr1:35-50"))
+    assert len(region) == 1 and region[0].starts.tolist() == [30]
+
+
+def test_stats(tmp_dir):
+    path = os.path.join(tmp_dir, "peaks.bed")
+    Path(path).write_text("track name=x\nchr2\t0\t10\tp1\nchr1\t5\t20\tp2\n"
+                          "chr1\t10\t40\tp3\n")
+    bed = Bed(path)
+    stats = bed.stats()
+    assert stats["lines"] == 4
+    assert stats["intervals"] == 3
+    assert stats["columns"] == 4
+    assert stats["bp"] == 55
+    assert stats["coverage"] == 45
+    assert stats["widths"]["min"] == 10 and stats["widths"]["max"] == 30
+    assert stats["chromosomes"] == {"chr1": 2, "chr2": 1}
+    assert os.path.exists(path + ".stats.json")
+    assert bed.count() == 4
+    assert columns(path) == 4
+
+
+def test_stats_plain_header(tmp_dir):
+    # Header without comment marker, like diffscore output, not sorted intervals
+    path = os.path.join(tmp_dir, "diff.bed")
+    Path(path).write_text("chr\tstart\tend\tscore\nchr1\t30\t40\t1\nchr1\t0\t10\t2\n"
+                          "chr1\t5\t20\t3\n")
+    bed = Bed(path)
+    stats = bed.stats()
+    assert stats["lines"] == 4
+    assert stats["intervals"] == 3
+    assert stats["columns"] == 4
+    assert stats["coverage"] == 30
+    assert stats["chromosomes"] == {"chr1": 3}
+    assert bed.count() == 4
+
+
+def test_stats_invalidated(tmp_dir):
+    path = os.path.join(tmp_dir, "peaks.bed")
+    Path(path).write_text("chr1\t0\t10\n")
+    assert Bed(path).count() == 1
+    Path(path).write_text("chr1\t0\t10\nchr1\t20\t30\n")
+    assert Bed(path).count() == 2
+
+
+@pytest.mark.parametrize("content", [
+    "chr1\t0\t100\nchr1\t200\t300\n",
+    "track name=x\nchr2\t100\t200\tp1\t5\t+\nchr1\t0\t10\tp2\t7\t-\n\nchr1\t5\t6\tp3\t1\t.",
+    "chr1\t0\t10\tp1\t1.5\nchr10\t5\t20\tp2\t.\tx\t\nchr1\t30\t40\tp3\n",
+])
+def test_binary_roundtrip(tmp_dir, content):
+    path = os.path.join(tmp_dir, "peaks.bed")
+    Path(path).write_text(content)
+    folder = os.path.join(tmp_dir, "peaks.bedb")
+    Bed(path).to_binary(folder)
+    exported = from_binary(folder, os.path.join(tmp_dir, "exported.bed"))
+    assert Path(exported.path).read_text() == content
+
+
+def test_operations_sorted_in_c_locale(tmp_dir, backend, monkeypatch):
+    # Locale order differs from C one, e.g. case insensitive in en_US
+    monkeypatch.setenv("LC_ALL", "en_US.UTF-8")
+    a, b = os.path.join(tmp_dir, "a.bed"), os.path.join(tmp_dir, "b.bed")
+    Path(a).write_text("chr1\t0\t10\nChr2\t0\t10\nchrX\t0\t10\n")
+    Path(b).write_text("chrX\t5\t20\nchr1\t5\t20\nChr2\t5\t20\n")
+    for operation in [union(Bed(a), Bed(b)), intersect(Bed(a), Bed(b)),
+                      minus(Bed(a), Bed(b))]:
+        operation.compute()
+        assert is_sorted(operation.path)
+
+
+def test_binary_reimport(tmp_dir):
+    folder = os.path.join(tmp_dir, "peaks.bedb")
+    unsorted = os.path.join(tmp_dir, "unsorted.bed")
+    Path(unsorted).write_text("chr2\t0\t10\tp1\t1\nchr1\t0\t10\tp2\t2\n")
+    Bed(unsorted).to_binary(folder)
+    # Arrays of previous import are not used
+    content = "chr1\t5\t10\nchr2\t0\t20\n"
+    Path(tmp_dir, "sorted.bed").write_text(content)
+    Bed(os.path.join(tmp_dir, "sorted.bed")).to_binary(folder)
+    exported = from_binary(folder, os.path.join(tmp_dir, "exported.bed"))
+    assert Path(exported.path).read_text() == content
+
+
+def test_binary_operand(tmp_dir, backend):
+    a, b = os.path.join(tmp_dir, "a.bed"), os.path.join(tmp_dir, "b.bed")
+    Path(a).write_text("chr1\t0\t100\nchr1\t200\t300\n")
+    Path(b).write_text("chr1\t50\t250\n")
+    folder = os.path.join(tmp_dir, "a.bedb")
+    Bed(a).to_binary(folder)
+    binary = Bed(folder)
+    assert binary.path is None and str(binary) == "a.bedb"
+    expected = intersect(Bed(a), Bed(b))
+    expected.compute()
+    result = intersect(binary, Bed(b))
+    result.compute()
+    assert Path(result.path).read_text() == Path(expected.path).read_text()
+    assert binary.count() == 2
+    # Binary BEDs are distinct in plan
+    Bed(b).to_binary(os.path.join(tmp_dir, "b.bedb"))
+    plan = explain(union(binary, Bed(os.path.join(tmp_dir, "b.bedb"))))
+    assert "\ta.bedb" in plan and "\tb.bedb" in plan
+
+
+def test_binary_columns(tmp_dir):
+    path = os.path.join(tmp_dir, "peaks.bed")
+    Path(path).write_text("chr2\t100\t200\tp1\t5\nchr1\t0\t10\tp2\t7\nchr1\t20\t30\tp3\t9\n")
+    Bed(path).to_binary(os.path.join(tmp_dir, "peaks.bedb"))
+    b = open_binary(os.path.join(tmp_dir, "peaks.bedb"))
+    assert len(b) == 3
+    assert b.chromosomes == ["chr1", "chr2"]
+    assert b.starts("chr1").tolist() == [0, 20]
+    assert b.ends("chr2").tolist() == [200]
+    assert b.starts().dtype.name == "int32"
+    assert b.names("chr1") == ["p2", "p3"]
+    assert b.scores().tolist() == [7, 9, 5]
+    assert b.codes().tolist() == [0, 0, 1]
+    assert b.starts("chrX").tolist() == []
+
+
+def test_query(tmp_dir):
+    path = os.path.join(tmp_dir, "peaks.bed")
+    Path(path).write_text("chr1\t0\t1000\tlong\nchr1\t100\t200\tp1\nchr2\t0\t10\tp2\n"
+                          "chr1\t300\t400\tp3\n")
+    bed = Bed(path)
+    assert bed.query("chr1", 150, 350) == [
+        ("chr1", 0, 1000, ["long"]), ("chr1", 100, 200, ["p1"]),
+        ("chr1", 300, 400, ["p3"])]
+    assert [x[3] for x in bed.query("chr1", 200, 300)] == [["long"]]
+    assert bed.query("chr1", 1000, 2000) == []
+    assert bed.query("chrX", 0, 10) == []
+    assert os.path.exists(path + ".index.npz")
+    # Open bounds
+    assert [x[3] for x in bed.query("chr1", None, 150)] == [["long"], ["p1"]]
+    assert [x[3] for x in bed.query("chr1", 350)] == [["long"], ["p3"]]
+    assert bed.query("chr2") == [("chr2", 0, 10, ["p2"])]
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="Linux only")
+def test_query_index_closed(tmp_dir):
+    path = os.path.join(tmp_dir, "peaks.bed")
+    Path(path).write_text("chr1\t0\t1000\nchr2\t0\t10\n")
+    Bed(path).query("chr1", 0, 10)
+    # Index is loaded from sidecar file
+    bed = Bed(path)
+    assert len(bed.query("chr2", 0, 10)) == 1
+    opened = [os.readlink(os.path.join("/proc/self/fd", fd))
+              for fd in os.listdir("/proc/self/fd")
+              if os.path.islink(os.path.join("/proc/self/fd", fd))]
+    assert not any(f.endswith(".index.npz") for f in opened)
+
+
+def test_query_many(tmp_dir):
+    path = os.path.join(tmp_dir, "peaks.bed")
+    Path(path).write_text("chr1\t0\t1000\tlong\nchr1\t100\t200\tp1\nchr2\t0\t10\tp2\n"
+                          "chr1\t300\t400\tp3\n")
+    bed = Bed(path)
+    regions = [("chr1", 150, 350), "chr2", "chr1:200-300", ("chr1", 1000, 2000),
+               "chrX:0-10", ("chr1", 350, 360)]
+    assert bed.query_many(regions) == [bed.query(*r) if isinstance(r, tuple) else
+                                       [x for x in bed.intervals(region=r)]
+                                       for r in regions]
+    assert [x[3] for x in bed.query_many(["chr1:399-400"])[0]] == [["long"], ["p3"]]
+
+
+CONSENSUS_TRACKS = ["OD1", "OD2", "OD3", "OD4", "YD1", "YD2", "YD3", "YD4", "YD5", "YD6"]
+
+
+@pytest.mark.parametrize("args,expected", [
+    ({"count": 2}, "consensus_weak_span_consensus.bed"),
+    ({"count": 5}, "consensus_median_span_consensus.bed"),
+    ({"percent": 50}, "consensus_median_span_consensus.bed"),
+])
+def test_consensus(test_data, backend, args, expected):
+    files = [test_data("bed/tracks_for_consensus/{}_peaks.bed".format(t))
+             for t in CONSENSUS_TRACKS]
+    c = consensus(files, **args)
+    expected = Path(test_data("bed/consensus/" + expected)).read_text()
+    c.compute()
+    assert Path(c.path).read_text().startswith(expected)
+
+
+def test_consensus_expression(test_data):
+    a, b, c = [Bed(test_data("bed/" + f)) for f in ["A.bed", "B.bed", "C.bed"]]
+    assert consensus([a, b, c], count=3).count() == intersect(a, b, c).count()
+    assert str(consensus([a, b], percent=50)) == "consensus 50%\n\tA.bed\n\tB.bed"
+    # Different thresholds are never shared
+    plan = optimize(consensus([a, b], count=1), consensus([a, b], count=2))
+    assert plan[0] is not plan[1]
+    with pytest.raises(Exception):
+        consensus([a, b], count=1, percent=50)
+
+
+def test_overlap_patterns(test_data):
+    files = [test_data("bed/" + f) for f in ["A.bed", "B.bed", "C.bed"]]
+    assert overlap_patterns(files) == {"0 0 1": 1, "1 0 1": 1, "1 1 0": 1, "1 1 1": 1}
+
+
+def test_overlap_patterns_many(tmp_dir):
+    # More files than bits in a byte
+    files = []
+    for i in range(10):
+        path = os.path.join(tmp_dir, "{}.bed".format(i))
+        Path(path).write_text("chr1\t0\t10\nchr1\t{}\t{}\n".format(100 * i + 100, 100 * i + 110))
+        files.append(Bed(path))
+    patterns = overlap_patterns(files)
+    assert patterns[" ".join(["1"] * 10)] == 1
+    assert patterns["0 0 0 0 0 0 0 0 0 1"] == 1
+    assert len(patterns) == 11
+
+
+def test_metapeaks_many(test_data, capfd):
+    beds = {f: Bed(test_data("bed/" + f)) for f in ["A.bed", "B.bed", "C.bed", "D.bed"]}
+    patterns = metapeaks(beds)
+    out, _err = capfd.readouterr()
+    for p, count in patterns.items():
+        assert "{}\t{}".format(p, count) in out
+
+
+GTF_LINE = 'chr{}\tHAVANA\t{}\t{}\t{}\t.\t{}\t.\tgene_id "{}"; gene_type "{}"; gene_name "{}";\n'
+GTF = "".join(GTF_LINE.format(*fields) for fields in [
+    (1, "gene", 101, 200, "+", "G1", "protein_coding", "A1"),
+    (1, "transcript", 101, 200, "+", "G1", "protein_coding", "A1"),
+    (1, "gene", 501, 600, "-", "G2", "lncRNA", "B2"),
+    (1, "gene", 551, 700, "-", "G3", "lncRNA", "C3"),
+    (2, "gene", 1001, 1100, "+", "G4", "protein_coding", "D4"),
+])
+
+
+@pytest.mark.parametrize("genes_file", ["genes.gtf", "genes.bed"])
+def test_closest_gene(tmp_dir, genes_file):
+    genes = os.path.join(tmp_dir, genes_file)
+    if genes_file.endswith(".gtf"):
+        Path(genes).write_text(GTF)
+    else:
+        Path(genes).write_text("chr1\t500\t600\tB2\nchr1\t100\t200\tA1\n"
+                               "chr1\t550\t700\tC3\nchr2\t1000\t1100\tD4\n")
+    peaks = os.path.join(tmp_dir, "peaks.bed")
+    Path(peaks).write_text("chr1\t560\t570\tp1\nchr1\t200\t210\tp2\n"
+                           "chr1\t300\t400\tp3\nchrX\t0\t10\tp4\n")
+    result = closest_gene(Bed(peaks), genes)
+    assert Path(result.path).read_text() == """chr1\t200\t210\tp2\tA1\t1
+chr1\t300\t400\tp3\tA1\t101
+chr1\t300\t400\tp3\tB2\t101
+chr1\t560\t570\tp1\tB2\t0
+chr1\t560\t570\tp1\tC3\t0
+chrX\t0\t10\tp4\t.\t-1
+"""
+    assert os.path.exists(genes + ".genes.npz")
+    # Index stored in sidecar gives the same result
+    genes_index.LOADED.clear()
+    assert Path(closest_gene(peaks, genes).path).read_text() == \
+        Path(result.path).read_text()
+
+
+def test_union_mask(test_data, backend):
+    a, b, c = [Bed(test_data("bed/" + f)) for f in ["A.bed", "B.bed", "C.bed"]]
+    u = union(a, b, c, mask=True)
+    u.compute()
+    assert Path(u.path).read_text() == \
+        "chr1\t0\t100\t5\nchr1\t150\t500\t7\nchr1\t600\t750\t3\nchr1\t800\t850\t4\n"
+    assert u.members() == [a.path, b.path, c.path]
+    assert Path(u.select(present=[0, 2]).path).read_text() == \
+        "chr1\t0\t100\t5\nchr1\t150\t500\t7\n"
+    assert Path(u.select(present=[0], absent=[2]).path).read_text() == \
+        "chr1\t600\t750\t3\n"
+    assert u.key() != union(a, b, c).key()
+    with pytest.raises(Exception):
+        union(a, b).select(present=[0])
+
+
+def test_union_mask_not_flattened(test_data):
+    a, b, c = [Bed(test_data("bed/" + f)) for f in ["A.bed", "B.bed", "C.bed"]]
+    plan = optimize(union(union(a, b), c, mask=True))
+    assert len(plan[0].operands) == 2
+
+
+def test_union_mask_many(tmp_dir, backend):
+    beds = []
+    for i in range(70):
+        path = os.path.join(tmp_dir, "{}.bed".format(i))
+        Path(path).write_text("chr1\t{}\t{}\n".format(i * 10, i * 10 + 5))
+        beds.append(Bed(path))
+    if backend == "bash":
+        # Mask is limited by awk numbers precision
+        beds = beds[:53]
+    u = union(*beds, mask=True)
+    masks = [x[3][0] for x in u.intervals()]
+    assert masks == [str(1 << i) for i in range(len(beds))]
+
+
+def test_explain_analyze(tmp_dir, backend):
+    a, b, c = [Bed(os.path.join(tmp_dir, f)) for f in ["a.bed", "b.bed", "c.bed"]]
+    Path(a.path).write_text("chr1\t0\t100\nchr1\t200\t300\n")
+    Path(b.path).write_text("chr1\t50\t250\n")
+    Path(c.path).write_text("chr1\t90\t110\nchr2\t0\t5\n")
+    m = minus(union(a, intersect(b, c)), c)
+    profiler = explain_analyze(m, compare(a, b))
+    assert m.path is not None
+    records = {r["operation"]: r for r in profiler.to_json()}
+    assert set(records) == {"intersection", "union", "minus", "compare"}
+    assert records["intersection"]["input_intervals"] == 3
+    assert records["intersection"]["output_intervals"] == 1
+    assert records["union"]["input_intervals"] == 3
+    assert records["compare"]["output_bytes"] > 0
+    assert not any(r["cache_hit"] for r in records.values())
+    report = profiler.report().split("\n")
+    assert report[0].startswith("minus #3  computed  wall ")
+    assert report[2] == "\t\ta.bed  2 intervals (24 B)"
+    assert report[-1].startswith("Operations: 4, cache hits: 0")
+    # No statistics sidecars next to input files
+    assert sorted(os.listdir(tmp_dir)) == ["a.bed", "b.bed", "c.bed"]
+
+    trace = profiler.to_trace()["traceEvents"]
+    assert [e["name"] for e in trace][:3] == ["intersection", "union", "minus"]
+    assert all(e["ph"] == "X" and e["dur"] >= 0 for e in trace)
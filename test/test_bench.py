@@ -0,0 +1,40 @@
+from pathlib import Path
+
+from bed.bench import generate, measure, regressions
+
+LAYOUT = [("chr1", 1000000), ("chr2", 500000)]
+
+
+def test_generate_deterministic(tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    first = generate(str(tmp_path / "a"), files=2, count=100, layout=LAYOUT, seed=1)
+    second = generate(str(tmp_path / "b"), files=2, count=100, layout=LAYOUT, seed=1)
+    for f1, f2 in zip(first, second):
+        assert Path(f1).read_text() == Path(f2).read_text()
+    rows = [line.split("\t") for line in Path(first[0]).read_text().splitlines()]
+    assert len(rows) == 100
+    keys = [(chrom, int(start)) for chrom, start, _ in rows]
+    assert keys == sorted(keys)
+    assert all(0 <= int(start) < int(end) <= dict(LAYOUT)[chrom] for chrom, start, end in rows)
+
+
+def test_measure_native(tmp_path):
+    files = generate(str(tmp_path), files=3, count=200, layout=LAYOUT)
+    result = measure("union", "native", files, [200] * 3)
+    assert result["operation"] == "union"
+    assert result["files"] == 3
+    assert result["intervals"] == 600
+    assert result["peak_rss_mb"] > 0
+    assert measure("minus", "native", files, [200] * 3)["files"] == 2
+    assert measure("unknown", "native", files, [200] * 3) is None
+
+
+def test_regressions():
+    baseline = [{"operation": "union", "backend": "native", "seconds": "1.0"}]
+    assert regressions([{"operation": "union", "backend": "native", "seconds": 1.1}],
+                       baseline, 0.2) == []
+    assert len(regressions([{"operation": "union", "backend": "native", "seconds": 1.5}],
+                           baseline, 0.2)) == 1
+    assert regressions([{"operation": "union", "backend": "bash", "seconds": 9.0}],
+                       baseline, 0.2) == []
@@ -0,0 +1,141 @@
+import hashlib
+import os
+from pathlib import Path
+
+import pytest
+
+import bed.bedtrace as bt
+from bed.bedtrace import Bed, union, intersect, minus
+from bed.cache import ResultCache, parse_size, fingerprint
+from test.fixtures import test_data, tmp_dir, bedtrace_cleanup
+
+
+@pytest.fixture
+def result_cache(tmp_dir):
+    default_backend, default_cache = bt.BACKEND, bt.CACHE
+    bt.set_backend('native')
+    bt.set_cache(os.path.join(tmp_dir, 'cache'))
+    yield bt.CACHE
+    bt.set_backend(default_backend)
+    bt.CACHE = default_cache
+
+
+@pytest.mark.parametrize("size,expected", [
+    ("1024", 1024),
+    ("2K", 2048),
+    ("1.5M", 1572864),
+    ("10g", 10737418240),
+])
+def test_parse_size(size, expected):
+    assert parse_size(size) == expected
+
+
+def test_fingerprint(tmp_dir):
+    path = os.path.join(tmp_dir, 'a.bed')
+    Path(path).write_text("chr1\t0\t100\n")
+    size_mtime = fingerprint(path)
+    content = fingerprint(path, content_hash=True)
+    os.utime(path, (0, 0))
+    assert fingerprint(path) != size_mtime
+    assert fingerprint(path, content_hash=True) == content
+
+
+def test_fingerprint_hashed_once(tmp_dir, monkeypatch):
+    path = os.path.join(tmp_dir, 'a.bed')
+    Path(path).write_text("chr1\t0\t100\n")
+    hashed = []
+    sha1 = hashlib.sha1
+    monkeypatch.setattr(hashlib, 'sha1', lambda *args: hashed.append(path) or sha1(*args))
+    content = fingerprint(path, content_hash=True)
+    assert fingerprint(path, content_hash=True) == content
+    assert len(hashed) == 1
+    # Modified file is hashed again
+    Path(path).write_text("chr1\t0\t200\n")
+    os.utime(path, (0, 0))
+    assert fingerprint(path, content_hash=True) != content
+    assert len(hashed) == 2
+
+
+def test_put_get(tmp_dir):
+    cache = ResultCache(os.path.join(tmp_dir, 'cache'))
+    result = os.path.join(tmp_dir, 'result.bed')
+    Path(result).write_text("chr1\t0\t100\n")
+
+    assert cache.get('foo') is None
+    path = cache.put('foo', result)
+    assert not os.path.exists(result)
+    assert cache.get('foo') == path
+    assert Path(path).read_text() == "chr1\t0\t100\n"
+
+
+def test_evict_lru(tmp_dir):
+    cache = ResultCache(os.path.join(tmp_dir, 'cache'), max_size=25)
+    for i, key in enumerate(['a', 'b']):
+        result = os.path.join(tmp_dir, key)
+        Path(result).write_text("chr1\t0\t100\n")
+        os.utime(cache.put(key, result), (i, i))
+    # Use 'a', so that 'b' is least recently used
+    cache.get('a')
+
+    result = os.path.join(tmp_dir, 'c')
+    Path(result).write_text("chr1\t0\t100\n")
+    cache.put('c', result)
+    assert cache.get('a') is not None
+    assert cache.get('b') is None
+    assert cache.get('c') is not None
+    assert cache.size() <= 25
+
+
+def test_operation_cached(result_cache, test_data):
+    u = union(Bed(test_data("bed/A.bed")), Bed(test_data("bed/B.bed")))
+    u.compute()
+    assert os.path.dirname(u.path) == result_cache.folder
+    expected = Path(u.path).read_text()
+
+    # New expression tree reuses result, nested operands are not computed
+    nested = intersect(Bed(test_data("bed/C.bed")))
+    same = union(Bed(test_data("bed/A.bed")), Bed(test_data("bed/B.bed")))
+    assert same.key() == u.key()
+    same.compute()
+    assert same.path == u.path
+    assert Path(same.path).read_text() == expected
+
+    m1 = minus(Bed(test_data("bed/A.bed")), nested)
+    m2 = minus(Bed(test_data("bed/A.bed")), intersect(Bed(test_data("bed/C.bed"))))
+    m1.compute()
+    m2.compute()
+    assert m1.path == m2.path
+    assert m2.operands[1].path is None
+
+
+def test_operation_key_order(test_data):
+    a, b = Bed(test_data("bed/A.bed")), Bed(test_data("bed/B.bed"))
+    assert minus(a, b).key() != minus(b, a).key()
+    assert union(a, b).key() != intersect(a, b).key()
+
+
+def test_explain_analyze_cache_hit(result_cache, test_data):
+    a, b, c = [Bed(test_data("bed/" + f)) for f in ["A.bed", "B.bed", "C.bed"]]
+    bt.explain_analyze(minus(union(a, b), c))
+    profiler = bt.explain_analyze(minus(union(a, b), c))
+    records = profiler.to_json()
+    assert [(r["operation"], r["cache_hit"]) for r in records] == [("minus", True)]
+    assert records[0]["input_intervals"] is None
+    assert "\tunion  not computed" in profiler.report()
+    assert bt.PROFILER is None
+
+
+def test_operands_not_evicted(result_cache, test_data):
+    # Each result exceeds budget, operands must survive until parent is computed
+    result_cache.max_size = 20
+    a, b, c = [Bed(test_data("bed/" + f)) for f in ["A.bed", "B.bed", "C.bed"]]
+    u = union(intersect(a, b), minus(a, c))
+    u.compute()
+    assert os.path.exists(u.path)
+
+    bt.set_cache(result_cache.folder, max_size=20)
+    u = union(intersect(a, b), minus(a, c))
+    bt.compute_all(u, workers=2)
+    assert os.path.exists(u.path)
+    # Pinned results are released once computation is finished
+    assert len(bt.CACHE.entries()) == 1
@@ -0,0 +1,45 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from pipeline_utils import run_bash
+from bed.diffscore import diffscore, group_files
+from test.fixtures import test_data, tmp_dir
+
+
+@pytest.mark.parametrize("threshold", [2, 3, 4])
+def test_diffscore(test_data, threshold):
+    folder = test_data("consensus_diffscore/tracks")
+    result = diffscore({"od": group_files(folder, "OD"),
+                        "yd": group_files(folder, "YD")}, threshold)
+    expected = Path(test_data("consensus_diffscore/result_cons{}.bed".format(threshold)))
+    assert result.to_csv(sep="\t", index=False) == expected.read_text()
+
+
+def test_diffscore_script(capfd, test_data):
+    run_bash("bed/consensus_diffscore.sh", test_data("consensus_diffscore/tracks"), "3")
+    out, _err = capfd.readouterr()
+    assert out.endswith(Path(test_data("consensus_diffscore/result_cons3.bed")).read_text())
+
+
+def test_diffscore_groups(test_data):
+    folder = test_data("consensus_diffscore/tracks")
+    groups = {"a": [os.path.join(folder, "OD1_peaks.bed")],
+              "b": [os.path.join(folder, "OD2_peaks.bed")],
+              "c": [os.path.join(folder, "YD3_peaks.bed")]}
+    result = diffscore(groups, 3)
+    assert list(result.columns) == ["chr", "start", "end", "cons", "a_cons", "b_cons",
+                                    "c_cons", "absdiff"]
+    assert result[["start", "end", "cons", "absdiff"]].values.tolist() == \
+        [[20, 40, 3, 0], [1020, 1040, 3, 0]]
+    assert str(result["cons"].dtype) == "int64"
+
+
+def test_group_files_outliers(tmp_dir):
+    folder = os.path.join(tmp_dir, "outliers_check")
+    os.makedirs(folder)
+    for name in ["OD1_peaks.bed", "OD2_outlier_peaks.bed", "YD1_peaks.bed"]:
+        Path(folder, name).touch()
+    # Folder name is not checked
+    assert group_files(folder, "OD") == [os.path.join(folder, "OD1_peaks.bed")]
@@ -0,0 +1,127 @@
+import os
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from test.fixtures import tmp_dir
+
+from pipeline_utils import PROJECT_ROOT_PATH
+from scripts.executor import Task, execute, parse_memory
+
+
+def task(tmp_dir, name, script, resources="nodes=1:ppn=1"):
+    path = os.path.join(tmp_dir, "{}.sh".format(name))
+    with open(path, 'w') as f:
+        f.write("#PBS -l {}\n#PBS -o {}/{}.log\n{}\n".format(resources, tmp_dir, name, script))
+    return Task(path)
+
+
+@pytest.mark.parametrize("value,expected", [
+    ("32gb", 32 * 1024 ** 3),
+    ("500MB", 500 * 1024 ** 2),
+    ("8G", 8 * 1024 ** 3),
+    ("1024", 1024),
+])
+def test_parse_memory(value, expected):
+    assert parse_memory(value) == expected
+
+
+def test_task_resources(tmp_dir):
+    t = task(tmp_dir, "a", "echo a", "nodes=1:ppn=8:haswell,walltime=24:00:00,vmem=32gb")
+    assert (t.cpus, t.memory, t.log) == (8, 32 * 1024 ** 3, os.path.join(tmp_dir, "a.log"))
+    t = task(tmp_dir, "b", "echo b", "walltime=1:00:00")
+    assert (t.cpus, t.memory) == (1, 0)
+
+
+def test_execute_capacity(tmp_dir):
+    log = os.path.join(tmp_dir, "events.txt")
+    tasks = [task(tmp_dir, name, "echo start >> {0}; sleep 0.3; echo end >> {0}".format(log),
+                  "nodes=1:ppn=2")
+             for name in ["a", "b", "c"]]
+    execute(tasks, cpus=3, memory=parse_memory("1G"))
+    # Tasks requiring 2 cpus of 3 never overlap
+    assert Path(log).read_text().split() == ["start", "end"] * 3
+    assert [t.returncode for t in tasks] == [0, 0, 0]
+
+
+def test_execute_backfill(tmp_dir):
+    big = task(tmp_dir, "big", "sleep 0.3", "nodes=1:ppn=1,vmem=2gb")
+    bigger = task(tmp_dir, "bigger", "sleep 0.3", "nodes=1:ppn=1,vmem=2gb")
+    small = task(tmp_dir, "small", "sleep 0.1", "nodes=1:ppn=1,vmem=100mb")
+    execute([big, bigger, small], cpus=4, memory=parse_memory("3G"))
+    # Small task doesn't wait for the bigger one
+    assert small.started < bigger.started
+
+
+def test_execute_status(tmp_dir):
+    tasks = [task(tmp_dir, "ok", "echo ok"),
+             task(tmp_dir, "failed", "echo failed; exit 3"),
+             task(tmp_dir, "huge", "echo huge", "nodes=1:ppn=100")]
+    execute(tasks, cpus=2, memory=0)
+    assert [t.returncode for t in tasks] == [0, 3, 0]
+    assert Path(tmp_dir, "failed.log").read_text() == "failed\n"
+    assert all(t.seconds is not None for t in tasks)
+
+
+def test_executor_cli(tmp_dir):
+    tasks = [task(tmp_dir, "ok", "echo ok"), task(tmp_dir, "failed", "exit 1")]
+    status = os.path.join(tmp_dir, "status.tsv")
+    process = subprocess.run(
+        ["python", os.path.join(PROJECT_ROOT_PATH, "scripts", "executor.py"),
+         "--cpus", "2", "--memory", "1G", "--status", status] + [t.path for t in tasks],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert process.returncode == 1
+    assert "FAILED TASK: {}".format(tasks[1].path) in process.stderr.decode('utf-8')
+    rows = [line.split('\t') for line in Path(status).read_text().splitlines()]
+    assert rows[0][:5] == ["task", "log", "cpus", "memory", "exit_code"]
+    assert [(r[0], r[4]) for r in rows[1:]] == [(tasks[0].path, "0"), (tasks[1].path, "1")]
+
+
+def test_run_parallel_executor(tmp_dir):
+    with open(os.path.join(tmp_dir, "foo.sh"), 'w') as f:
+        f.write("""
+source {0}/parallel/util.sh
+TASKS=""
+for i in $(seq 1 10); do
+    run_parallel << SCRIPT
+#PBS -l nodes=1:ppn=2,vmem=1gb
+#PBS -o {1}/file_$i.log
+echo $i > {1}/file_$i.txt
+SCRIPT
+    TASKS="$TASKS $QSUB_ID"
+done
+wait_complete $TASKS
+""".format(PROJECT_ROOT_PATH, tmp_dir))
+    env = dict(os.environ, WASHU_LOCAL_EXECUTOR="1", WASHU_ROOT=PROJECT_ROOT_PATH)
+    process = subprocess.run(["bash", os.path.join(tmp_dir, "foo.sh")], env=env,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert process.returncode == 0
+    assert process.stdout.decode('utf-8') == \
+        "LOCAL waiting for tasks...\nDone. LOCAL waiting for tasks\n"
+    for i in range(1, 11):
+        assert Path(tmp_dir, "file_{}.txt".format(i)).read_text() == "{}\n".format(i)
+
+
+def test_run_parallel_executor_failed(tmp_dir):
+    with open(os.path.join(tmp_dir, "foo.sh"), 'w') as f:
+        f.write("""
+source {0}/parallel/util.sh
+for i in 1 2; do
+    run_parallel << SCRIPT
+#PBS -o {1}/file_$i.log
+exit \\$(( $i - 1 ))
+SCRIPT
+done
+wait_complete
+echo "Not reached"
+""".format(PROJECT_ROOT_PATH, tmp_dir))
+    env = dict(os.environ, WASHU_LOCAL_EXECUTOR="1", WASHU_ROOT=PROJECT_ROOT_PATH)
+    process = subprocess.run(["bash", os.path.join(tmp_dir, "foo.sh")], env=env,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert process.returncode == 1
+    out = process.stdout.decode('utf-8').splitlines()
+    assert out[1].startswith("ERROR: tasks failed, status: ")
+    # Failed task status line
+    assert out[2].split("\t")[1:5] == [os.path.join(tmp_dir, "file_2.log"), "1", "0", "1"]
+    assert "Not reached" not in out
@@ -1,6 +1,9 @@
+import io
+
 from pipeline_utils import run_bash, PROJECT_ROOT_PATH
 
 import pytest
+from bed import native
 from test.fixtures import test_data
 
 
@@ -11,12 +14,15 @@ from test.fixtures import test_data
 #            |------------------|              |--|
 # C.bed
 #  |-| |-|        |-|          |-|                  |-|
-@pytest.mark.parametrize("files,line", [
+INTERSECTIONS = [
     (["A.bed", "B.bed", "C.bed"], "chr1	150	500"),
     (["A.bed", "B.bed"], "chr1	150	500\nchr1	600	750"),
     (["A.bed", "C.bed"], "chr1	0	100\nchr1	200	300\nchr1	400	500"),
     (["B.bed", "C.bed"], "chr1	150	460"),
-])
+]
+
+
+@pytest.mark.parametrize("files,line", INTERSECTIONS)
 def test_intersect(capfd, test_data, files, line):
     run_bash("bed/intersect.sh", *[test_data("bed/" + f) for f in files])
 
@@ -26,6 +32,18 @@ def test_intersect(capfd, test_data, files, line):
                                                      line) == res
 
 
+@pytest.mark.parametrize("files,line", INTERSECTIONS)
+def test_intersect_native(test_data, files, line):
+    out = io.StringIO()
+    native.intersect_files([test_data("bed/" + f) for f in files], out)
+    assert out.getvalue() == line + "\n"
+
+
+def test_intersect_native_empty():
+    with pytest.raises(Exception):
+        native.intersect_files([], io.StringIO())
+
+
 def test_intersect_empty():
     try:
         run_bash("bed/intersect.sh")
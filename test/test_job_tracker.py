@@ -0,0 +1,200 @@
+import os
+import subprocess
+from pathlib import Path
+
+import pytest
+from test.fixtures import tmp_dir
+
+import scripts.job_tracker as jt
+from pipeline_utils import PROJECT_ROOT_PATH
+
+# Emulates Torque PBS: jobs are run in background, running jobs are marked
+# with files in {pbs} folder, completed ones are reported with C state
+FAKE_QSUB = """#!/bin/bash
+SCRIPT=$(cat)
+ID=$(( $(ls {pbs} | grep -c "\\.script$") + 1 ))
+echo "$SCRIPT" > {pbs}/$ID.script
+echo "qsub" >> {pbs}/calls.txt
+ARRAY=$(echo "$SCRIPT" | grep "^#PBS -t" | sed -E 's/.*1-([0-9]+)/\\1/')
+LOG=$(echo "$SCRIPT" | grep "^#PBS -o" | sed 's/#PBS -o //')
+if [[ -n $ARRAY ]]; then
+    for i in $(seq 1 $ARRAY); do
+        touch "{pbs}/$ID[$i].running"
+        (sleep 0.2; PBS_ARRAYID=$i bash {pbs}/$ID.script
+         mv "{pbs}/$ID[$i].running" "{pbs}/$ID[$i].done") &> /dev/null &
+    done
+    echo "$ID[].fake"
+else
+    touch {pbs}/$ID.running
+    (sleep 0.2; bash {pbs}/$ID.script &> $LOG; mv {pbs}/$ID.running {pbs}/$ID.done) &> /dev/null &
+    echo "$ID.fake"
+fi
+"""
+
+FAKE_QSTAT = """#!/bin/bash
+echo "qstat $@" >> {pbs}/calls.txt
+echo "Job ID          Username Queue Jobname SessID NDS TSK Memory Time     S Time"
+echo "--------------- -------- ----- ------- ------ --- --- ------ -------- - --------"
+for F in {pbs}/*.running {pbs}/*.done; do
+    [[ -f "$F" ]] || continue
+    NAME=$(basename "$F")
+    STATE=$([[ $NAME == *.running ]] && echo R || echo C)
+    echo "${{NAME%.*}}.fake user batch job 1234 1 1 1gb 24:00:00 $STATE 00:00:01"
+done
+"""
+
+
+@pytest.fixture
+def fake_pbs(tmp_dir, monkeypatch):
+    pbs = os.path.join(tmp_dir, "pbs")
+    bin_dir = os.path.join(tmp_dir, "bin")
+    os.makedirs(pbs)
+    os.makedirs(bin_dir)
+    for name, script in [("qsub", FAKE_QSUB), ("qstat", FAKE_QSTAT)]:
+        with open(os.path.join(bin_dir, name), "w") as f:
+            f.write(script.format(pbs=pbs))
+        os.chmod(os.path.join(bin_dir, name), 0o755)
+    monkeypatch.setenv("PATH", bin_dir + os.pathsep + os.environ["PATH"])
+    return pbs
+
+
+def task_file(tmp_dir, name, resources="nodes=1:ppn=1,walltime=1:00:00"):
+    path = os.path.join(tmp_dir, "{}.sh".format(name))
+    with open(path, 'w') as f:
+        f.write("#PBS -N {0}\n#PBS -l {1}\n#PBS -o {2}/{0}.log\n"
+                "echo {0} > {2}/{0}.txt\necho {0} log\n".format(name, resources, tmp_dir))
+    return path
+
+
+@pytest.mark.parametrize("job_id,expected", [
+    ("1234.server", "1234"),
+    ("1234[].server", "1234"),
+    ("1234[5].serv", "1234[5]"),
+    ("Job", None),
+])
+def test_job_key(job_id, expected):
+    assert jt.job_key(job_id) == expected
+
+
+def test_group_tasks(tmp_dir):
+    paths = [task_file(tmp_dir, "a"), task_file(tmp_dir, "big", "nodes=1:ppn=8"),
+             task_file(tmp_dir, "b")]
+    groups = jt.group_tasks(paths)
+    assert [g[0] for g in groups] == [("#PBS -l nodes=1:ppn=1,walltime=1:00:00",),
+                                      ("#PBS -l nodes=1:ppn=8",)]
+    assert [[t[0] for t in g[1]] for g in groups] == [[paths[0], paths[2]], [paths[1]]]
+    assert groups[0][1][1][2] == os.path.join(tmp_dir, "b.log")
+
+
+def test_submit_and_wait(tmp_dir, fake_pbs, capsys):
+    paths = [task_file(tmp_dir, name) for name in ["a", "b", "c"]] + \
+            [task_file(tmp_dir, "big", "nodes=1:ppn=8")]
+    jobs = jt.submit(paths)
+    assert list(jobs) == ["1[1].fake", "1[2].fake", "1[3].fake", "2.fake"]
+    jt.wait(jobs, min_interval=0.1, max_interval=0.2)
+
+    for name in ["a", "b", "c", "big"]:
+        assert Path(tmp_dir, name + ".txt").read_text() == name + "\n"
+        assert Path(tmp_dir, name + ".log").read_text() == name + " log\n"
+    out = capsys.readouterr().out
+    assert "SUBMITTED 1[].fake: 3 tasks" in out
+    assert "DONE 1[2].fake LOG: {}/b.log".format(tmp_dir) in out
+    calls = Path(fake_pbs, "calls.txt").read_text().splitlines()
+    assert calls.count("qsub") == 2
+    # Single bulk query per poll
+    assert all(c == "qstat -t -u {}".format(jt.getpass.getuser())
+               for c in calls if c != "qsub")
+
+
+def test_wait_adaptive_interval(monkeypatch, capsys):
+    polls = iter([{"1", "2"}, {"1", "2"}, {"2"}, {"2"}, set()])
+    sleeps = []
+    monkeypatch.setattr(jt, "running_jobs", lambda: next(polls))
+    monkeypatch.setattr(jt.time, "sleep", sleeps.append)
+    jt.wait(["1.server", "2.server", "3.server"], min_interval=1, max_interval=2)
+    # Interval grows while nothing changes and is reset on completion
+    assert sleeps == [1, 1.5, 1, 1.5]
+    assert capsys.readouterr().out == "DONE 3.server\nDONE 1.server\nDONE 2.server\n"
+
+
+def run_script(tmp_dir, body, **env):
+    with open(os.path.join(tmp_dir, "foo.sh"), 'w') as f:
+        f.write("source {}/parallel/util.sh\n".format(PROJECT_ROOT_PATH) +
+                body.format(tmp_dir))
+    env = dict(os.environ, WASHU_ROOT=PROJECT_ROOT_PATH, WASHU_QSTAT_MIN_INTERVAL="0.1", **env)
+    return subprocess.run(["bash", os.path.join(tmp_dir, "foo.sh")], env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+TASKS_SCRIPT = """
+TASKS=""
+for i in $(seq 1 5); do
+    run_parallel << SCRIPT
+#PBS -l nodes=1:ppn=1
+#PBS -o {0}/file_$i.log
+echo $i > {0}/file_$i.txt
+SCRIPT
+    echo "TASK: $QSUB_ID"
+    TASKS="$TASKS $QSUB_ID"
+done
+wait_complete $TASKS
+echo "Finished"
+"""
+
+
+def test_run_parallel_qsub(tmp_dir, fake_pbs):
+    process = run_script(tmp_dir, TASKS_SCRIPT)
+    assert process.returncode == 0, process.stderr
+    out = process.stdout.decode('utf-8').splitlines()
+    # Jobs are submitted immediately
+    assert out[:6] == ["TASK: {}.fake".format(i) for i in range(1, 6)] + \
+        ["Waiting for tasks..."]
+    assert out[-2:] == ["Done. Waiting for tasks", "Finished"]
+    for i in range(1, 6):
+        assert Path(tmp_dir, "file_{}.txt".format(i)).read_text() == "{}\n".format(i)
+
+
+def test_run_parallel_qsub_array(tmp_dir, fake_pbs):
+    process = run_script(tmp_dir, TASKS_SCRIPT, WASHU_QSUB_ARRAY="1")
+    assert process.returncode == 0, process.stderr
+    out = [line for line in process.stdout.decode('utf-8').splitlines()
+           if not line.startswith("TASK: ")]
+    assert out[:2] == ["Waiting for tasks...", "SUBMITTED 1[].fake: 5 tasks"]
+    assert out[-2:] == ["Done. Waiting for tasks", "Finished"]
+    for i in range(1, 6):
+        assert Path(tmp_dir, "file_{}.txt".format(i)).read_text() == "{}\n".format(i)
+    assert Path(fake_pbs, "calls.txt").read_text().splitlines().count("qsub") == 1
+
+
+@pytest.mark.parametrize("array", ["", "1"])
+def test_run_parallel_qstat_failed(tmp_dir, fake_pbs, array):
+    with open(os.path.join(tmp_dir, "bin", "qstat"), "w") as f:
+        f.write("#!/bin/bash\necho 'Cannot connect to server' >&2\nexit 1\n")
+    process = run_script(tmp_dir, TASKS_SCRIPT, WASHU_QSUB_ARRAY=array,
+                         WASHU_QSTAT_MAX_INTERVAL="0.1")
+    assert process.returncode == 1
+    out = process.stdout.decode('utf-8').splitlines()
+    assert out[-1] == "ERROR: tasks tracking failed"
+    assert "Cannot connect to server" in process.stderr.decode('utf-8')
+
+
+def test_wait_qstat_retry(monkeypatch, capsys):
+    results = iter([Exception("qstat failed"), Exception("qstat failed"), {"2"}, set()])
+
+    def running_jobs():
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(jt, "running_jobs", running_jobs)
+    monkeypatch.setattr(jt.time, "sleep", lambda _: None)
+    jt.wait(["1.server", "2.server"], min_interval=1, max_interval=2)
+    captured = capsys.readouterr()
+    assert captured.out == "DONE 1.server\nDONE 2.server\n"
+    assert "retry 2 of 4" in captured.err
+
+    # Persistent failure
+    results = iter([Exception("qstat failed")] * jt.QSTAT_RETRIES)
+    with pytest.raises(Exception, match="qstat failed"):
+        jt.wait(["1.server"], min_interval=1, max_interval=2)
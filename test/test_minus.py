@@ -1,6 +1,9 @@
+import io
+
 from pipeline_utils import run_bash, PROJECT_ROOT_PATH
 
 import pytest
+from bed import native
 from test.fixtures import test_data
 
 
@@ -11,14 +14,24 @@ from test.fixtures import test_data
 #            |------------------|              |--|
 # C.bed
 #  |-| |-|        |-|          |-|                  |-|
-@pytest.mark.parametrize("file1,file2,line", [
+MINUSES = [
     ("A.bed", "B.bed", "chr1	0	100"),
     ("A.bed", "C.bed", "chr1	600	700"),
     ("B.bed", "C.bed", "chr1	650	750"),
-])
+]
+
+
+@pytest.mark.parametrize("file1,file2,line", MINUSES)
 def test_minus(capfd, test_data, file1, file2, line):
     run_bash("bed/minus.sh", test_data("bed/" + file1),
              test_data("bed/" + file2))
     out, _err = capfd.readouterr()
     res = out.replace(test_data("bed/"), "").replace(PROJECT_ROOT_PATH, ".")
     assert res == "bash ./bed/minus.sh {} {}\n{}\n".format(file1, file2, line)
+
+
+@pytest.mark.parametrize("file1,file2,line", MINUSES)
+def test_minus_native(test_data, file1, file2, line):
+    out = io.StringIO()
+    native.minus_files(test_data("bed/" + file1), test_data("bed/" + file2), out)
+    assert out.getvalue() == line + "\n"
@@ -0,0 +1,22 @@
+from pipeline_tf import sample_stages, peak_calling_stage
+from pipeline_utils import Stage, stages_dependencies
+
+
+def test_samples_streaming():
+    stages = [Stage('index_bowtie2')]
+    for gsmid in ["GSM1", "GSM2", "GSM3"]:
+        stages.extend(sample_stages(gsmid, "/out/" + gsmid, ["SRX1"], "hg19",
+                                    "/indexes", "/indexes/hg19.chrom.sizes", "picard.jar"))
+    stages.append(peak_calling_stage("/out", "GSM1", "GSM2", "hg19",
+                                     "/indexes/hg19.chrom.sizes"))
+    stages.append(peak_calling_stage("/out", "GSM3", None, "hg19",
+                                     "/indexes/hg19.chrom.sizes"))
+    dependencies = stages_dependencies(stages)
+
+    # Each sample depends on its own previous stages only
+    assert dependencies['bowtie_GSM1'] == {'fastqc_GSM1', 'index_bowtie2'}
+    assert dependencies['bigwig_GSM1'] == {'bowtie_GSM1'}
+    assert dependencies['remove_duplicates_GSM1'] == {'bowtie_GSM1', 'rpkm_GSM1'}
+    assert dependencies['macs2_GSM1'] == {'bowtie_GSM1', 'remove_duplicates_GSM1',
+                                          'remove_duplicates_GSM2'}
+    assert dependencies['macs2_GSM3'] == {'bowtie_GSM3', 'remove_duplicates_GSM3'}
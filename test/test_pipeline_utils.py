@@ -0,0 +1,118 @@
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from pipeline_utils import Stage, run_stages, stages_dependencies, work_folder
+from test.fixtures import tmp_dir
+
+
+def log_action(log, name, seconds=0.0):
+    def action():
+        with open(log, 'a') as f:
+            f.write("start {}\n".format(name))
+        time.sleep(seconds)
+        with open(log, 'a') as f:
+            f.write("end {} {}\n".format(name, os.environ['WASHU_PARALLELISM']))
+    return action
+
+
+def test_stages_dependencies(tmp_dir):
+    a = os.path.join(tmp_dir, "a")
+    stages = [Stage('b', inputs=[a]),
+              Stage('a', outputs=[a]),
+              Stage('c', after=['a', 'b'])]
+    assert stages_dependencies(stages) == {'a': set(), 'b': {'a'}, 'c': {'a', 'b'}}
+
+
+@pytest.mark.parametrize("stages", [
+    [Stage('a', after=['b']), Stage('b', after=['a'])],
+    [Stage('a', after=['foo'])],
+    [Stage('a'), Stage('a')],
+    [Stage('a', outputs=['x']), Stage('b', outputs=['x'])],
+])
+def test_stages_dependencies_illegal(stages):
+    with pytest.raises(Exception):
+        stages_dependencies(stages)
+
+
+def test_run_stages(tmp_dir):
+    log = os.path.join(tmp_dir, "log.txt")
+    data, bams = os.path.join(tmp_dir, "data"), os.path.join(tmp_dir, "data_bams")
+    os.mkdir(data)
+    Path(os.path.join(data, "a.bam")).touch()
+    run_stages([
+        Stage('qc1', inputs=[bams], action=log_action(log, 'qc1', 0.5)),
+        Stage('qc2', after=['align'], action=log_action(log, 'qc2', 0.5)),
+        Stage('align', inputs=[data], outputs=[bams], move=["*.bam"],
+              action=log_action(log, 'align')),
+        Stage('done', after=['qc1', 'qc2'], action=log_action(log, 'done')),
+    ], parallelism=4)
+
+    assert os.path.exists(os.path.join(bams, "a.bam"))
+    lines = Path(log).read_text().splitlines()
+    assert lines[:2] == ["start align", "end align 4"]
+    # Independent stages are run concurrently sharing parallelism
+    assert sorted(lines[2:4]) == ["start qc1", "start qc2"]
+    assert sorted(lines[4:6]) == ["end qc1 2", "end qc2 2"]
+    assert lines[6:] == ["start done", "end done 4"]
+
+
+def test_run_stages_skip_and_fail(tmp_dir):
+    log = os.path.join(tmp_dir, "log.txt")
+
+    def fail():
+        raise Exception("Failed")
+
+    with pytest.raises(Exception, match="Failed stages: fail"):
+        run_stages([
+            Stage('skipped', outputs=[tmp_dir], action=log_action(log, 'skipped')),
+            Stage('fail', after=['skipped'], action=fail),
+            Stage('other', after=['skipped'], action=log_action(log, 'other')),
+            Stage('next', after=['fail'], action=log_action(log, 'next')),
+        ], parallelism=2)
+    assert Path(log).read_text().splitlines() == ["start other", "end other 1"]
+
+
+def test_run_stages_same_folder(tmp_dir):
+    log = os.path.join(tmp_dir, "log.txt")
+    run_stages([
+        Stage('macs2', inputs=[tmp_dir], action=log_action(log, 'macs2', 0.3)),
+        Stage('rseg', inputs=[tmp_dir], action=log_action(log, 'rseg', 0.3)),
+        Stage('sicer', inputs=[tmp_dir], action=log_action(log, 'sicer', 0.3)),
+    ], parallelism=3)
+    # Stages working in the same folder never overlap
+    lines = [line.split()[:2] for line in Path(log).read_text().splitlines()]
+    assert [action for action, _ in lines] == ["start", "end"] * 3
+    assert [lines[i][1] == lines[i + 1][1] for i in range(0, 6, 2)] == [True] * 3
+
+
+def test_run_stages_linked_folders(tmp_dir):
+    log = os.path.join(tmp_dir, "log.txt")
+    bams = os.path.join(tmp_dir, "bams")
+    os.mkdir(bams)
+    Path(os.path.join(bams, "a.bam")).touch()
+    Path(os.path.join(bams, "a.txt")).touch()
+
+    def call(name):
+        def action():
+            folder = work_folder(bams, name)
+            assert sorted(os.listdir(folder)) == ["a.bam"]
+            assert os.path.islink(os.path.join(folder, "a.bam"))
+            Path(os.path.join(folder, "a_{}.bed".format(name))).touch()
+            log_action(log, name, 0.5)()
+        return action
+
+    run_stages([
+        Stage(name, inputs=[bams], outputs=[bams + "_" + name], move=["*.bed"],
+              action=call(name), link=["*.bam"])
+        for name in ['rseg', 'sicer']
+    ], parallelism=2)
+    # Stages reading the same folder overlap in their own working folders
+    lines = Path(log).read_text().splitlines()
+    assert sorted(lines[:2]) == ["start rseg", "start sicer"]
+    for name in ['rseg', 'sicer']:
+        assert os.listdir(bams + "_" + name) == ["a_{}.bed".format(name)]
+        assert not os.path.exists(work_folder(bams, name))
+    assert sorted(os.listdir(bams)) == ["a.bam", "a.txt"]
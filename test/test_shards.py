@@ -0,0 +1,105 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import bed.bedtrace as bt
+from bed import shards
+from bed.bedtrace import Bed, union, intersect, minus, compare
+from pipeline_utils import PROJECT_ROOT_PATH
+from test.fixtures import test_data, tmp_dir, bedtrace_cleanup, backend
+
+A = """chr2\t100\t200
+chr1\t0\t100
+chr10\t50\t60
+chr1\t200\t300
+chrX\t0\t10
+"""
+B = """chr1\t50\t250
+chr10\t0\t10
+chr2\t150\t160
+"""
+
+
+@pytest.fixture
+def beds(tmp_dir):
+    paths = []
+    for name, content in [("A.bed", A), ("B.bed", B)]:
+        path = os.path.join(tmp_dir, name)
+        Path(path).write_text(content)
+        paths.append(path)
+    return paths
+
+
+@pytest.fixture
+def sharded():
+    bt.set_sharded(True)
+    yield
+    bt.set_sharded(False)
+
+
+def test_split(tmp_dir, beds):
+    folder = os.path.join(tmp_dir, "shards")
+    os.mkdir(folder)
+    result = shards.split(beds[0], folder, 0)
+    assert sorted(result) == ["chr1", "chr10", "chr2", "chrX"]
+    assert Path(result["chr1"]).read_text() == "chr1\t0\t100\nchr1\t200\t300\n"
+    assert Path(result["chrX"]).read_text() == "chrX\t0\t10\n"
+
+
+@pytest.mark.parametrize("operation,expected", [
+    (union, """chr1\t0\t300\t1_{0}/A.bed|2_{0}/B.bed
+chr10\t0\t10\t2_{0}/B.bed
+chr10\t50\t60\t1_{0}/A.bed
+chr2\t100\t200\t1_{0}/A.bed|2_{0}/B.bed
+chrX\t0\t10\t1_{0}/A.bed
+"""),
+    (intersect, """chr1\t0\t300
+chr2\t100\t200
+"""),
+    (minus, """chr10\t50\t60
+chrX\t0\t10
+"""),
+])
+def test_sharded(tmp_dir, beds, backend, sharded, operation, expected):
+    result = operation(*[Bed(b) for b in beds])
+    result.compute()
+    assert Path(result.path).read_text() == expected.format(tmp_dir)
+
+
+def test_sharded_union_mask(beds, backend, sharded):
+    u = union(*[Bed(b) for b in beds], mask=True)
+    u.compute()
+    assert Path(u.path).read_text() == """chr1\t0\t300\t3
+chr10\t0\t10\t2
+chr10\t50\t60\t1
+chr2\t100\t200\t3
+chrX\t0\t10\t1
+"""
+
+
+def test_sharded_compare(tmp_dir, beds, backend, sharded):
+    c = compare(*[Bed(b) for b in beds])
+    c.compute()
+    assert Path(c.cond1.path).read_text() == "chr10\t50\t60\nchrX\t0\t10\n"
+    assert Path(c.cond2.path).read_text() == "chr10\t0\t10\n"
+    assert Path(c.common.path).read_text() == "chr1\t0\t300\nchr2\t100\t200\n"
+
+
+def test_sharded_union_bash_without_numpy(beds):
+    # Union labels are restored without native backend
+    script = """
+import sys
+import bed.bedtrace as bt
+bt.set_backend('bash')
+bt.set_sharded(True)
+u = bt.union(*[bt.Bed(p) for p in sys.argv[1:]])
+u.compute()
+print(open(u.path).read().split('\\n')[0])
+print('numpy' in sys.modules)
+"""
+    out = subprocess.check_output([sys.executable, "-c", script, *beds],
+                                  cwd=PROJECT_ROOT_PATH).decode("utf-8")
+    assert out == "chr1\t0\t300\t1_{}|2_{}\nFalse\n".format(*beds)
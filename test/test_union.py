@@ -1,6 +1,10 @@
+import io
+
 from pipeline_utils import run_bash
 
 import pytest
+from bed import native
+from bed.io import label
 from test.fixtures import test_data
 
 
@@ -31,3 +35,24 @@ def test_union_empty():
         assert False
     except:  # nopep8
         pass
+
+
+def test_union_native(test_data):
+    out = io.StringIO()
+    native.union_files([test_data('bed/A.bed'), test_data('bed/B.bed'),
+                        test_data('bed/C.bed')], out)
+    assert out.getvalue().replace(test_data("bed/"), "") == """chr1	0	100	1_A.bed|3_C.bed
+chr1	150	500	1_A.bed|2_B.bed|3_C.bed
+chr1	600	750	1_A.bed|2_B.bed
+chr1	800	850	3_C.bed
+"""
+
+
+@pytest.mark.parametrize("path,expected", [
+    ("/data/A.bed", "1_/data/A.bed"),
+    ("./A.bed", "1_A.bed"),
+    ("../data/A.bed", "1_A.bed"),
+    ("A.bed", "1_A.bed"),
+])
+def test_union_native_label(path, expected):
+    assert label(1, path) == expected
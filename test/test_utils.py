@@ -1,5 +1,6 @@
 import os
 import subprocess
+from pathlib import Path
 
 import pytest
 from test.fixtures import test_data, tmp_dir
@@ -16,6 +17,21 @@ def test_lcs():
     assert lcs1 < lcs2
 
 
+@pytest.mark.parametrize("x,y,expected", [
+    ("", "abc", 0),
+    ("abcbdab", "bdcaba", 4),
+    ("input", "input", 5),
+])
+def test_lcs_length(x, y, expected):
+    assert su.lcs(x, y) == expected
+    assert su.lcs(y, x) == expected
+
+
+def test_lcs_long():
+    # Longer than default recursion limit
+    assert su.lcs("a" * 3000, "ba" * 200) == 200
+
+
 @pytest.mark.parametrize("value,expected", [
     ("foo_input_boo", True),
     ("foo_od.input_boo", True),
@@ -42,6 +58,33 @@ def test_find_input(test_data, input, donor):
     assert su.find_input(test_data("input/" + donor)) == input
 
 
+def test_find_inputs(test_data):
+    inputs = su.find_inputs([test_data("input")])
+    assert len(inputs) == 9
+    for bam, input in inputs.items():
+        assert input == su.find_input(bam)
+    assert inputs[test_data("input/41_donor7_k27ac.bam")] == "44_DONOR7_INPUT.bam"
+
+
+def test_find_inputs_cli(test_data):
+    out = subprocess.check_output(
+        ["python", os.path.join(PROJECT_ROOT_PATH, "scripts/util.py"), "find_inputs",
+         "37_DONOR6_K27AC.bam", "40_donor6_input.bam"],
+        cwd=test_data("input")).decode("utf-8")
+    assert out == "37_DONOR6_K27AC.bam\t40_donor6_input.bam\n40_donor6_input.bam\t\n"
+
+
+def test_find_inputs_sh(test_data):
+    util_sh = os.path.join(PROJECT_ROOT_PATH, "parallel/util.sh")
+    out = subprocess.check_output(
+        ["bash", "-c", "source {}; find_inputs 37_DONOR6_K27AC.bam 40_donor6_input.bam; "
+                       "echo \"[$(input_of 37_DONOR6_K27AC.bam)]\"; "
+                       "echo \"[$(input_of 40_donor6_input.bam)]\"; "
+                       "find_inputs; echo \"[$(input_of 37_DONOR6_K27AC.bam)]\"".format(util_sh)],
+        cwd=test_data("input")).decode("utf-8")
+    assert out == "[40_donor6_input.bam]\n[]\n[]\n"
+
+
 @pytest.mark.parametrize("build,species", [
     ("hg18", "hs"),
     ("hg19", "hs"),
@@ -205,3 +248,56 @@ def test_pileup(tmp_dir, capfd, path, expected, home):
         shell=True, check=True)
     out, _err = capfd.readouterr()
     assert out == os.path.join(tmp_dir, expected) + "\n"
+
+
+FAKE_MACS2 = """#!/bin/bash
+echo "$@" >> {log}
+OUT=$(echo "$@" | sed -E 's/.* -(o|n) ([^ ]*).*/\\2/')
+case $1 in
+    callpeak)
+        printf '# tag size is determined as 36 bps\\n# d = 200\\n' > ${{OUT}}_peaks.xls
+        touch ${{OUT}}_treat_pileup.bdg ${{OUT}}_control_lambda.bdg ${{OUT}}_peaks.narrowPeak
+        ;;
+    bdgcmp) touch ${{OUT}} ;;
+    bdgpeakcall) printf 'track\\nchr1\\t0\\t100\\n' > ${{OUT}} ;;
+    bdgbroadcall)
+        printf 'chr1\\t0\\t100\\tp\\t0\\t.\\t0\\t100\\t0\\t1\\t100\\t0\\t5\\t6\\t7\\n' > ${{OUT}}
+        ;;
+esac
+"""
+
+
+def test_run_macs2_sweep(tmp_dir, monkeypatch):
+    bin_dir = os.path.join(tmp_dir, "bin")
+    os.makedirs(bin_dir)
+    log = os.path.join(tmp_dir, "macs2_calls.txt")
+    with open(os.path.join(bin_dir, "macs2"), "w") as f:
+        f.write(FAKE_MACS2.format(log=log))
+    os.chmod(os.path.join(bin_dir, "macs2"), 0o755)
+    monkeypatch.setenv("PATH", bin_dir + os.pathsep + os.environ["PATH"])
+    monkeypatch.setenv("WASHU_ROOT", PROJECT_ROOT_PATH)
+    monkeypatch.chdir(tmp_dir)
+    bams = os.path.join(tmp_dir, "bams")
+    os.makedirs(bams)
+    # Files of other stages sharing work dir are left untouched
+    for name in ["a.bam", "b.bam", "a_input.bam", "a_rip.csv", "b_signal.bw"]:
+        open(os.path.join(bams, name), "w").close()
+
+    results = su.run_macs2_sweep("hg19", "NONE", ["broad_0.1", "q0.05", "p1e-5"],
+                                 work_dirs=[bams])
+
+    assert results["q0.05"] == [bams + "_macs2_q0.05"]
+    calls = [c.split()[0] for c in Path(log).read_text().splitlines()]
+    assert calls.count("callpeak") == 2
+    assert calls.count("bdgcmp") == 4
+    assert Path(bams + "_macs2_q0.05/a_q0.05_peaks.narrowPeak").read_text() == \
+        "chr1\t0\t100\n"
+    assert Path(bams + "_macs2_broad_0.1/b_broad_0.1_peaks.broadPeak").read_text() == \
+        "chr1\t0\t100\tp\t0\t.\t5\t6\t7\n"
+    assert sorted(os.listdir(bams + "_macs2_p1e-5")) == \
+        ["a_p1e-5_peaks.narrowPeak", "a_sweep_peaks.xls",
+         "b_p1e-5_peaks.narrowPeak", "b_sweep_peaks.xls"]
+    assert sorted(os.listdir(bams)) == ["a.bam", "a_input.bam", "a_rip.csv", "b.bam",
+                                        "b_signal.bw"]
+    with pytest.raises(Exception):
+        su.run_macs2_sweep("hg19", "NONE", ["foo"], work_dirs=[bams])